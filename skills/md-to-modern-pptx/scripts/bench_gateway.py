@@ -0,0 +1,191 @@
+"""
+Offline throughput benchmark for `gemini_image_pack.py generate`, driven against stub_gateway.py.
+
+For every (response mode x image size) a stub gateway is started in its own process; for every
+concurrency level a fresh `generate` run renders --images unique prompts. Reported per run:
+images/sec, per-item latency p50/p95/max (from generate --metrics) and the generate process's
+peak RSS.
+
+  python bench_gateway.py --modes native,task --sizes 1376x768,2752x1536 --concurrency 1,4,8
+  python bench_gateway.py --modes native --error-rate 0.2 --json bench.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+PACK = SCRIPTS_DIR / "gemini_image_pack.py"
+STUB = SCRIPTS_DIR / "stub_gateway.py"
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))]
+
+
+def _start_stub(mode: str, width: int, height: int, args: argparse.Namespace) -> tuple[subprocess.Popen[str], str]:
+    cmd = [
+        sys.executable,
+        str(STUB),
+        "--mode",
+        mode,
+        "--width",
+        str(width),
+        "--height",
+        str(height),
+        "--latency",
+        str(args.latency),
+        "--jitter",
+        str(args.jitter),
+        "--error-rate",
+        str(args.error_rate),
+        "--task-duration",
+        str(args.task_duration),
+    ]
+    if args.noise:
+        cmd.append("--noise")
+    if args.require_model_prefix:
+        cmd += ["--require-model-prefix", args.require_model_prefix]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    assert proc.stdout is not None
+    return proc, proc.stdout.readline().strip()
+
+
+def _write_plan(path: Path, n: int, tag: str) -> None:
+    images = [
+        {
+            "name": f"slide-{i:02d}",
+            "slide_number": i,
+            "size": "16:9",
+            "resolution": "1K",
+            # Unique prompts: the benchmark measures gateway round trips, not in-run dedupe.
+            "prompt": f"benchmark image {i} ({tag})",
+        }
+        for i in range(1, n + 1)
+    ]
+    path.write_text(json.dumps({"version": 1, "theme": "bench", "images": images}), encoding="utf-8")
+
+
+def _run_generate(base_url: str, mode: str, concurrency: int, work: Path, args: argparse.Namespace) -> dict[str, Any]:
+    plan = work / "plan.json"
+    metrics = work / "metrics.jsonl"
+    _write_plan(plan, args.images, f"{mode}-{concurrency}-{time.time_ns()}")
+    cmd = [
+        sys.executable,
+        str(PACK),
+        "--dotenv",
+        os.devnull,
+        "generate",
+        "--plan",
+        str(plan),
+        "--out-dir",
+        str(work / "out"),
+        "--base-url",
+        base_url,
+        "--key",
+        "bench",
+        # The native route only serves Gemini model ids; other modes exercise /v1/images/generations.
+        "--model",
+        "gemini-3-pro-image-preview" if mode == "native" else "stub-image",
+        "--concurrency",
+        str(concurrency),
+        "--overwrite",
+        "--no-cache",
+        "--keep-going",
+        "--metrics",
+        str(metrics),
+        *args.generate_arg,
+    ]
+    env = {**os.environ, "CHERRY_CACHE_DIR": str(work / "cache")}
+    started = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, env=env)
+    # wait4 gives this child's own rusage (ru_maxrss in KiB on Linux).
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - started
+    stderr = proc.stderr.read() if proc.stderr else ""
+
+    records = [json.loads(l) for l in metrics.read_text(encoding="utf-8").splitlines()] if metrics.exists() else []
+    done = [r for r in records if r["status"] == "done"]
+    latencies = [r["total_s"] for r in done]
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "images": args.images,
+        "ok": len(done),
+        "exit_status": os.waitstatus_to_exitcode(status),
+        "wall_s": round(wall, 3),
+        "images_per_s": round(len(done) / wall, 3) if wall > 0 else 0.0,
+        "p50_s": round(_percentile(latencies, 0.5), 3),
+        "p95_s": round(_percentile(latencies, 0.95), 3),
+        "max_s": round(max(latencies, default=0.0), 3),
+        "retries": sum(r["retries"] for r in records),
+        "peak_rss_mib": round(usage.ru_maxrss / 1024, 1),
+        "stderr_tail": stderr.strip().splitlines()[-1:] if stderr.strip() else [],
+    }
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Offline generate benchmark against a local stub gateway.")
+    p.add_argument("--modes", default="native,b64_json,url,task", help="Comma list of stub response modes")
+    p.add_argument("--sizes", default="1376x768", help="Comma list of WxH images the stub returns")
+    p.add_argument("--concurrency", default="1,4,8", help="Comma list of --concurrency levels")
+    p.add_argument("--images", type=int, default=12, help="Plan items per run (default: 12)")
+    p.add_argument("--latency", type=float, default=0.5, help="Stub seconds per generation call")
+    p.add_argument("--jitter", type=float, default=0.1)
+    p.add_argument("--task-duration", type=float, default=1.5)
+    p.add_argument("--error-rate", type=float, default=0.0, help="Stub 429/503 injection rate")
+    p.add_argument("--noise", action="store_true", help="Noisy images (realistic payload size)")
+    p.add_argument("--require-model-prefix", default=None, help='Stub 400s native paths without it, e.g. "google/"')
+    p.add_argument(
+        "--generate-arg",
+        action="append",
+        default=[],
+        help="Extra argument passed to generate (repeatable), e.g. --generate-arg=--convert-workers=0",
+    )
+    p.add_argument("--json", default=None, help="Also write results as JSON to this path")
+    args = p.parse_args()
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    sizes = [tuple(int(v) for v in s.lower().split("x")) for s in args.sizes.split(",") if s.strip()]
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+
+    results: list[dict[str, Any]] = []
+    header = f"{'mode':<9} {'size':>10} {'conc':>4} {'ok':>5} {'wall s':>7} {'img/s':>6} {'p50':>6} {'p95':>6} {'max':>6} {'retry':>5} {'rss MiB':>8}"
+    print(header)
+    for mode in modes:
+        for width, height in sizes:
+            stub, base_url = _start_stub(mode, width, height, args)
+            try:
+                for level in levels:
+                    with tempfile.TemporaryDirectory(prefix="bench-gateway-") as tmp:
+                        r = _run_generate(base_url, mode, level, Path(tmp), args)
+                    r["size"] = f"{width}x{height}"
+                    results.append(r)
+                    print(
+                        f"{mode:<9} {r['size']:>10} {level:>4} {r['ok']:>2}/{r['images']:<2} {r['wall_s']:>7.2f} "
+                        f"{r['images_per_s']:>6.2f} {r['p50_s']:>6.2f} {r['p95_s']:>6.2f} {r['max_s']:>6.2f} "
+                        f"{r['retries']:>5} {r['peak_rss_mib']:>8.1f}"
+                    )
+                    if r["exit_status"] != 0 and r["stderr_tail"]:
+                        print(f"  (generate exited {r['exit_status']}: {r['stderr_tail'][0]})")
+            finally:
+                stub.terminate()
+                stub.wait()
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Peak-RSS comparison of the buffered vs streaming Gemini inline-image decode.
+
+Serves one synthetic generateContent response (a noisy WxH PNG, base64 in inlineData) from a
+local HTTP server and decodes it in a fresh subprocess per mode, so each peak RSS is isolated:
+
+  buffered   r.json() -> b64decode -> Pillow resize to PNG   (the old path)
+  streaming  _stream_inline_images -> _save_renditions      (what generate uses)
+
+  python bench_inline_decode_memory.py --width 4096 --height 2304
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import json
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+
+
+def _synthetic_body(width: int, height: int) -> bytes:
+    import io
+    import os
+
+    from PIL import Image  # type: ignore
+
+    # Random pixels defeat PNG compression, which makes the payload size realistic for 4K art.
+    im = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    buf = io.BytesIO()
+    im.save(buf, format="PNG", compress_level=1)
+    payload = {
+        "candidates": [
+            {"content": {"parts": [{"inlineData": {"mimeType": "image/png", "data": base64.b64encode(buf.getvalue()).decode()}}]}}
+        ]
+    }
+    return json.dumps(payload).encode("utf-8")
+
+
+def _serve(body: bytes) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            self.send_response(200)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _buffered_decode(resp_json: dict, out: Path) -> None:
+    """The pre-streaming path: the whole base64 string, the raw bytes and the PNG all in memory."""
+    import io
+
+    from PIL import Image  # type: ignore
+
+    inline = resp_json["candidates"][0]["content"]["parts"][0]["inlineData"]
+    raw = base64.b64decode(inline["data"])
+    with Image.open(io.BytesIO(raw)) as im:
+        im = im.resize((640, 360), Image.LANCZOS)
+        buf = io.BytesIO()
+        im.save(buf, format="PNG")
+    out.write_bytes(buf.getvalue())
+
+
+def _child(mode: str, url: str, out_dir: Path) -> None:
+    import requests
+
+    sys.path.insert(0, str(SCRIPTS_DIR))
+    import gemini_image_pack as gip
+
+    out = out_dir / f"{mode}.png"
+    if mode == "buffered":
+        r = requests.get(url, timeout=120)
+        _buffered_decode(r.json(), out)
+    else:
+        with requests.get(url, timeout=120, stream=True) as r:
+            blobs = gip._stream_inline_images(r, out_dir)
+        raw_path, mime = blobs[0]
+        gip._save_renditions(raw_path, mime, [(out, gip.Rendition(640, 360), True)])
+        raw_path.unlink()
+    print(json.dumps({"mode": mode, "peak_rss_mib": _peak_rss_kib() / 1024}))
+
+
+def _peak_rss_kib() -> float:
+    # ru_maxrss survives fork+exec on Linux (the child would report the parent's peak), so
+    # prefer the per-address-space high-water mark when /proc is available.
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return float(line.split()[1])
+    except OSError:
+        pass
+    import resource
+
+    return float(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--width", type=int, default=4096)
+    p.add_argument("--height", type=int, default=2304)
+    p.add_argument("--out-dir", default=None, help="Scratch dir (default: a temp dir)")
+    p.add_argument("--child", nargs=2, metavar=("MODE", "URL"), help=argparse.SUPPRESS)
+    args = p.parse_args()
+
+    import tempfile
+
+    out_dir = Path(args.out_dir or tempfile.mkdtemp(prefix="inline-bench-"))
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if args.child:
+        _child(args.child[0], args.child[1], out_dir)
+        return
+
+    body = _synthetic_body(args.width, args.height)
+    server = _serve(body)
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    print(f"response body: {len(body) / (1024 * 1024):.1f} MiB ({args.width}x{args.height})")
+
+    results: dict[str, float] = {}
+    for mode in ("buffered", "streaming"):
+        cp = subprocess.run(
+            [sys.executable, __file__, "--out-dir", str(out_dir), "--child", mode, url],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        results[mode] = json.loads(cp.stdout.strip().splitlines()[-1])["peak_rss_mib"]
+        print(f"{mode:>10}: peak RSS {results[mode]:.1f} MiB")
+    server.shutdown()
+
+    saved = results["buffered"] - results["streaming"]
+    print(f"reduction: {saved:.1f} MiB ({saved / results['buffered'] * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
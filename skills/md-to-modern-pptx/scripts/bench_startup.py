@@ -0,0 +1,131 @@
+"""
+Startup-time benchmark for `gemini_image_pack.py`, with a budget a CI job can enforce.
+
+Times fresh interpreter runs of the module import, `--help` and `make-plan` over a synthetic
+Deep Research report, each reported as the median overhead above a bare `python -c pass`.
+It also checks that make-plan leaves the network/imaging stack (requests, urllib3, PIL,
+NumPy, multiprocessing) unimported. Exits 1 when a median is over --budget-ms or a heavy
+module was loaded, so it can gate a change:
+
+  python bench_startup.py --repeat 15 --budget-ms 150
+  python bench_startup.py --json startup.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+PACK = SCRIPTS_DIR / "gemini_image_pack.py"
+HEAVY_MODULES = ("requests", "urllib3", "PIL", "numpy", "multiprocessing")
+
+
+def _write_report(path: Path, sections: int) -> None:
+    parts = ["# Startup Benchmark Report", "", "## Executive Summary", "", "Synthetic report.", "", "## Detailed Analysis", ""]
+    for i in range(1, sections + 1):
+        parts += [f"### Section {i}", "", f"Body text for section {i}. " * 20, ""]
+    parts += ["## Sources", "", "- none"]
+    path.write_text("\n".join(parts), encoding="utf-8")
+
+
+def _time_runs(cmd: list[str], repeat: int, env: dict[str, str]) -> list[float]:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run(cmd, cwd=SCRIPTS_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def _loaded_heavy_modules(argv: list[str], env: dict[str, str]) -> list[str]:
+    """Run the CLI in-process in a child and list the heavy modules it ended up importing."""
+    probe = (
+        "import json, runpy, sys\n"
+        f"sys.argv = {[str(PACK), *argv]!r}\n"
+        "try:\n"
+        f"    runpy.run_path({str(PACK)!r}, run_name='__main__')\n"
+        "finally:\n"
+        f"    print(json.dumps(sorted(m for m in {HEAVY_MODULES!r} if m in sys.modules)))\n"
+    )
+    cp = subprocess.run([sys.executable, "-c", probe], cwd=SCRIPTS_DIR, env=env, capture_output=True, text=True, check=True)
+    return json.loads(cp.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Startup-time benchmark for gemini_image_pack.py.")
+    p.add_argument("--repeat", type=int, default=10, help="Runs per command (default: 10)")
+    p.add_argument("--sections", type=int, default=8, help="### sections in the synthetic report (default: 8)")
+    p.add_argument(
+        "--budget-ms",
+        type=float,
+        default=200.0,
+        help="Max median milliseconds above a bare interpreter, per command (default: 200)",
+    )
+    p.add_argument("--json", default=None, help="Also write results as JSON to this path")
+    args = p.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench-startup-") as tmp:
+        work = Path(tmp)
+        md = work / "report.md"
+        _write_report(md, args.sections)
+        # A private cache dir: the first run stores the dotenv lookup, later runs reuse it.
+        env = {**os.environ, "CHERRY_CACHE_DIR": str(work / "cache")}
+        make_plan = ["make-plan", "--in", str(md), "--out", str(work / "plan.json")]
+        commands = {
+            "import": [sys.executable, "-c", "import gemini_image_pack"],
+            "--help": [sys.executable, str(PACK), "--help"],
+            "make-plan": [sys.executable, str(PACK), *make_plan],
+        }
+        # Warm-up: writes __pycache__ for the import and the dotenv cache entry.
+        for cmd in commands.values():
+            subprocess.run(cmd, cwd=SCRIPTS_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        baseline = statistics.median(_time_runs([sys.executable, "-c", "pass"], args.repeat, env))
+
+        results: list[dict[str, Any]] = []
+        over = False
+        print(f"{'command':<10} {'median ms':>10} {'p90 ms':>8} {'over python':>12}  budget {args.budget_ms:g} ms")
+        for name, cmd in commands.items():
+            times = _time_runs(cmd, args.repeat, env)
+            median = statistics.median(times)
+            p90 = sorted(times)[min(len(times) - 1, int(round(0.9 * (len(times) - 1))))]
+            overhead_ms = (median - baseline) * 1000
+            ok = overhead_ms <= args.budget_ms
+            over = over or not ok
+            results.append(
+                {
+                    "command": name,
+                    "median_ms": round(median * 1000, 1),
+                    "p90_ms": round(p90 * 1000, 1),
+                    "overhead_ms": round(overhead_ms, 1),
+                    "ok": ok,
+                }
+            )
+            print(f"{name:<10} {median * 1000:>10.1f} {p90 * 1000:>8.1f} {overhead_ms:>12.1f}  {'ok' if ok else 'OVER'}")
+        print(f"(bare interpreter: {baseline * 1000:.1f} ms)")
+
+        heavy = _loaded_heavy_modules(make_plan, env)
+        if heavy:
+            print(f"make-plan imported {', '.join(heavy)}; it should not need the network/imaging stack")
+        else:
+            print("make-plan imported none of: " + ", ".join(HEAVY_MODULES))
+
+    if args.json:
+        Path(args.json).write_text(
+            json.dumps({"baseline_ms": round(baseline * 1000, 1), "results": results, "heavy_modules": heavy}, indent=2),
+            encoding="utf-8",
+        )
+    if over or heavy:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,29 @@
 from __future__ import annotations
 
 import argparse
+import contextlib
+import dataclasses
+import hashlib
+import itertools
 import json
 import os
+import queue
+import random
+import re
+import shutil
+import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
-import requests
-import re
+# requests/urllib3, Pillow, NumPy and multiprocessing are imported where they are used:
+# make-plan and cache never touch the network or decode images, and start much faster.
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+    import requests
 
 
 def load_dotenv(dotenv_path: Path, *, override: bool) -> None:
@@ -31,10 +45,7 @@ def load_dotenv(dotenv_path: Path, *, override: bool) -> None:
             os.environ[k] = v
 
 
-def resolve_dotenv_path(cli_value: str | None) -> Path | None:
-    if cli_value:
-        return Path(cli_value)
-
+def _dotenv_candidates() -> list[Path]:
     candidates: list[Path] = []
 
     # 1) Project-local (CWD)
@@ -54,11 +65,42 @@ def resolve_dotenv_path(cli_value: str | None) -> Path | None:
         # Some installs end up nested (e.g. ...\md-to-modern-pptx\md-to-modern-pptx\.env).
         candidates.append(global_root / "md-to-modern-pptx" / ".env")
         candidates.append(global_root / ".env")
+    return candidates
+
+
+def resolve_dotenv_path(cli_value: str | None, *, cache_path: Path | None = None) -> Path | None:
+    """
+    The .env to load: --dotenv, else the first candidate that configures CHERRY_*, else the
+    first that exists. The choice is remembered in `cache_path` (default: dotenv.json in the
+    cache dir) against every candidate's mtime and size, so repeat runs only stat the files.
+    """
+    if cli_value:
+        return Path(cli_value)
 
-    existing = [c for c in candidates if c.exists()]
+    existing: list[Path] = []
+    stamp: list[Any] = []
+    for c in _dotenv_candidates():
+        try:
+            st = c.stat()
+        except OSError:
+            continue
+        existing.append(c)
+        stamp.append([str(c), st.st_mtime_ns, st.st_size])
     if not existing:
         return None
 
+    cache_path = cache_path or default_cache_dir() / "dotenv.json"
+    key = _text_hash(json.dumps(stamp))
+    try:
+        entries = json.loads(cache_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        entries = {}
+    if not isinstance(entries, dict):
+        entries = {}
+    if isinstance(entries.get(key), str):
+        return Path(entries[key])
+
+    chosen = existing[0]
     # Prefer a dotenv that contains CHERRY_* (new gateway config), if present.
     for c in existing:
         try:
@@ -66,30 +108,23 @@ def resolve_dotenv_path(cli_value: str | None) -> Path | None:
         except Exception:
             continue
         if "CHERRY_BASE_URL" in txt or "CHERRY_API_KEY" in txt:
-            return c
+            chosen = c
+            break
 
-    return existing[0]
-
-    return None
+    entries.pop(key, None)
+    entries[key] = str(chosen)
+    try:
+        # A few working directories' worth; the oldest lookups go first.
+        _atomic_write_bytes(cache_path, json.dumps(dict(list(entries.items())[-64:])).encode("utf-8"))
+    except OSError:
+        pass
+    return chosen
 
 
 def strip_md(text: str) -> str:
     return text.replace("**", "").replace("`", "").strip()
 
 
-def section_between(md: str, start_heading: str, end_heading_or_none: str | None) -> str:
-    start = md.find(start_heading)
-    if start < 0:
-        return ""
-    after = md[start + len(start_heading) :]
-    if not end_heading_or_none:
-        return after.strip()
-    end = after.find(end_heading_or_none)
-    if end < 0:
-        return after.strip()
-    return after[:end].strip()
-
-
 def normalize_paragraphs(raw: str) -> str:
     lines = []
     for l in raw.splitlines():
@@ -102,30 +137,249 @@ def normalize_paragraphs(raw: str) -> str:
     return "\n".join(lines)
 
 
-def parse_detailed_analysis(md: str) -> list[dict[str, str]]:
-    raw = section_between(md, "## Detailed Analysis", "## Areas of Consensus")
-    if not raw:
+# One pass over the raw bytes finds every #/##/### heading and every code fence (whose
+# contents must not be read as headings).
+_HEADING_RE = re.compile(rb"^(?:(#{1,3})[ \t]+([^\r\n]*?)(?:[ \t]+#+)?[ \t]*|(`{3,}|~{3,})[^\r\n]*)\r?$", re.M)
+
+
+@dataclass(frozen=True)
+class MdSection:
+    level: int
+    title: str
+    start: int  # byte offset of the heading line
+    body_start: int  # byte offset just past the heading line
+    end: int  # byte offset of the next heading at the same or a higher level (or EOF)
+
+
+class MarkdownIndex:
+    """
+    Offset index of all #/##/### sections of a Markdown buffer (bytes or an mmap), built in a
+    single regex scan. Bodies are decoded only when asked for, so a large concatenated corpus
+    is never materialized as one str.
+    """
+
+    def __init__(self, buf: Any) -> None:
+        self.buf = buf
+        self.sections: list[MdSection] = []
+        open_secs: list[list[Any]] = []  # [level, title, start, body_start] awaiting their end
+        fence: bytes | None = None
+        for m in _HEADING_RE.finditer(buf):
+            if m.group(3):
+                marker = m.group(3)[:1]
+                if fence is None:
+                    fence = marker
+                elif marker == fence:
+                    fence = None
+                continue
+            if fence is not None:
+                continue
+            level = len(m.group(1))
+            while open_secs and open_secs[-1][0] >= level:
+                self._close(open_secs.pop(), m.start())
+            title = m.group(2).decode("utf-8", "replace").strip()
+            open_secs.append([level, title, m.start(), min(m.end() + 1, len(buf))])
+        while open_secs:
+            self._close(open_secs.pop(), len(buf))
+        self.sections.sort(key=lambda sec: sec.start)
+        self._starts = [sec.start for sec in self.sections]
+
+    def _close(self, sec: list[Any], end: int) -> None:
+        self.sections.append(MdSection(sec[0], sec[1], sec[2], sec[3], end))
+
+    @staticmethod
+    @contextlib.contextmanager
+    def open(path: Path) -> Any:
+        """Index a file through a read-only mmap (plain bytes for empty files)."""
+        import mmap
+
+        with path.open("rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield MarkdownIndex(b"")
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield MarkdownIndex(mm)
+
+    def body(self, sec: MdSection) -> str:
+        return bytes(self.buf[sec.body_start : sec.end]).decode("utf-8", "replace")
+
+    def children(self, parent: MdSection | None, level: int) -> list[MdSection]:
+        import bisect
+
+        lo, hi = (parent.body_start, parent.end) if parent else (0, len(self.buf))
+        i, j = bisect.bisect_left(self._starts, lo), bisect.bisect_left(self._starts, hi)
+        return [sec for sec in self.sections[i:j] if sec.level == level]
+
+    def find(self, title: str, level: int, within: MdSection | None = None) -> MdSection | None:
+        return next((sec for sec in self.children(within, level) if sec.title == title), None)
+
+
+def parse_detailed_analysis(md: str | MarkdownIndex, within: MdSection | None = None) -> list[dict[str, str]]:
+    index = md if isinstance(md, MarkdownIndex) else MarkdownIndex(md.encode("utf-8"))
+    detailed = index.find("Detailed Analysis", 2, within)
+    if detailed is None:
         return []
-    blocks = [b.strip() for b in re.split(r"(?:^|\r?\n)###\s+", raw) if b.strip()]
     out: list[dict[str, str]] = []
-    for b in blocks:
-        lines = b.splitlines()
-        title = strip_md(lines[0].strip())
-        body = strip_md(normalize_paragraphs("\n".join(lines[1:])))
-        out.append({"title": title, "body": body})
+    for sec in index.children(detailed, 3):
+        out.append({"title": strip_md(sec.title), "body": strip_md(normalize_paragraphs(index.body(sec)))})
     return out
 
 
+# Per theme: the prompt's style hint and the palette it describes (background, accent 1,
+# accent 2, ink), which placeholders are drawn in.
+_THEME_STYLES: dict[str, tuple[str, tuple[str, str, str, str]]] = {
+    "golden-hour": (
+        "warm mustard yellow + terracotta + soft beige palette, cozy but premium",
+        ("E8DCC8", "F4A900", "C1666B", "4A403A"),
+    ),
+    "tech-innovation": (
+        "high-contrast dark gray with electric blue and neon cyan accents, sleek modern",
+        ("1E1E1E", "0066FF", "00FFFF", "E6E6E6"),
+    ),
+    "ocean-depths": (
+        "deep navy + teal + seafoam palette, clean and trustworthy",
+        ("1A2332", "2D8B8B", "A8DADC", "F1FAEE"),
+    ),
+    "modern-minimalist": (
+        "neutral grayscale, minimal, lots of whitespace",
+        ("F5F5F5", "708090", "D3D3D3", "36454F"),
+    ),
+    "midnight-galaxy": (
+        "dark cosmic palette, subtle glow accents",
+        ("2B1E3E", "4A4E8F", "A490C2", "E6E6FA"),
+    ),
+}
+_DEFAULT_STYLE = ("consistent palette matching the deck theme", ("EDF2F4", "8D99AE", "EF233C", "2B2D42"))
+
+
 def theme_style_hint(theme_slug: str) -> str:
-    slug = theme_slug.lower().strip()
-    hints: dict[str, str] = {
-        "golden-hour": "warm mustard yellow + terracotta + soft beige palette, cozy but premium",
-        "tech-innovation": "high-contrast dark gray with electric blue and neon cyan accents, sleek modern",
-        "ocean-depths": "deep navy + teal + seafoam palette, clean and trustworthy",
-        "modern-minimalist": "neutral grayscale, minimal, lots of whitespace",
-        "midnight-galaxy": "dark cosmic palette, subtle glow accents",
+    return _THEME_STYLES.get(theme_slug.lower().strip(), _DEFAULT_STYLE)[0]
+
+
+def theme_palette(theme_slug: str) -> tuple[str, str, str, str]:
+    """(background, accent 1, accent 2, ink) hex colours of the theme theme_style_hint describes."""
+    return _THEME_STYLES.get(theme_slug.lower().strip(), _DEFAULT_STYLE)[1]
+
+
+def render_placeholder(theme_slug: str, width: int, height: int, *, seed: str = "") -> bytes:
+    """
+    Themed abstract stand-in image (PNG bytes), drawn locally in milliseconds: a background
+    gradient with a few blurred accent shapes, varied by `seed`. No text, like real art.
+    """
+    import io
+    import random as _random
+
+    from PIL import Image, ImageDraw, ImageFilter  # type: ignore
+
+    bg, accent1, accent2, ink = (tuple(int(c[i : i + 2], 16) for i in (0, 2, 4)) for c in theme_palette(theme_slug))
+    w, h = max(16, width), max(16, height)
+    rng = _random.Random(seed)
+    # Corner-to-corner wash from the background towards the ink colour (a 2x2 image, upscaled).
+    corners = [0, 110, 110, 255]
+    rng.shuffle(corners)
+    mask = Image.new("L", (2, 2))
+    mask.putdata(corners)
+    far = tuple(int(b + (i - b) * 0.18) for b, i in zip(bg, ink))
+    im = Image.composite(
+        Image.new("RGB", (w, h), far), Image.new("RGB", (w, h), bg), mask.resize((w, h), Image.BILINEAR)
+    )
+    for colour in (accent1, accent2, accent1):
+        r = rng.uniform(0.18, 0.38) * h
+        cx, cy = rng.uniform(0.2, 0.8) * w, rng.uniform(0.25, 0.75) * h
+        blob = Image.new("L", (w, h), 0)
+        ImageDraw.Draw(blob).ellipse((cx - r, cy - r, cx + r, cy + r), fill=150)
+        im.paste(colour, (0, 0, w, h), blob.filter(ImageFilter.GaussianBlur(h / 14)))
+    buf = io.BytesIO()
+    im.save(buf, format="PNG", compress_level=1)
+    return buf.getvalue()
+
+
+def score_image(path: Path, theme_slug: str) -> dict[str, float] | None:
+    """
+    Cheap quality heuristics for a generated slide image, from a ~320px downscale (higher
+    `score` is better; every component is in [0, 1]):
+
+      edge_density      share of pixels on a luminance edge (busy compositions score high)
+      border_emptiness  share of quiet tiles along the border (room for the slide's text)
+      palette_distance  mean RGB distance to the nearest theme colour
+      text_likeness     share of high-contrast, two-tone, edge-dense tiles in horizontal runs,
+                        which is what baked-in lettering looks like
+
+    None when NumPy or Pillow is unavailable or the file does not decode.
+    """
+    try:
+        import numpy as np
+        from PIL import Image  # type: ignore
+    except ImportError:
+        return None
+    try:
+        with Image.open(path) as im:
+            im.draft("RGB", (320, 320))
+            im = im.convert("RGB")
+            im.thumbnail((320, 320))
+            rgb = np.asarray(im, dtype=np.float32) / 255.0
+    except Exception:
+        return None
+
+    lum = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    grad = np.hypot(np.abs(np.diff(lum, axis=1))[:-1, :], np.abs(np.diff(lum, axis=0))[:, :-1])
+    edges = grad > 0.08
+
+    t = 16
+    th, tw = edges.shape[0] // t, edges.shape[1] // t
+    if th < 3 or tw < 3:
+        return None
+    tile_edges = edges[: th * t, : tw * t].reshape(th, t, tw, t).mean(axis=(1, 3))
+    tiles = lum[: th * t, : tw * t].reshape(th, t, tw, t).transpose(0, 2, 1, 3).reshape(th, tw, t * t)
+    lo, hi = tiles.min(axis=2), tiles.max(axis=2)
+    contrast = hi - lo
+    # Lettering is two-tone: almost every pixel sits near the tile's darkest or lightest value.
+    near = np.abs(tiles - lo[..., None]) < 0.25 * contrast[..., None]
+    near |= np.abs(tiles - hi[..., None]) < 0.25 * contrast[..., None]
+    texty = (tile_edges > 0.15) & (contrast > 0.35) & (near.mean(axis=2) > 0.7)
+    runs = texty & (np.roll(texty, 1, axis=1) | np.roll(texty, -1, axis=1))
+
+    quiet = tile_edges < 0.02
+    ring = np.ones_like(quiet)
+    ring[1:-1, 1:-1] = False
+
+    palette = np.array(
+        [[int(c[i : i + 2], 16) for i in (0, 2, 4)] for c in theme_palette(theme_slug)], dtype=np.float32
+    ) / 255.0
+    px = rgb[::4, ::4].reshape(-1, 3)
+    nearest = np.sqrt(((px[:, None, :] - palette[None, :, :]) ** 2).sum(axis=2)).min(axis=1)
+
+    stats = {
+        "edge_density": float(edges.mean()),
+        "border_emptiness": float(quiet[ring].mean()),
+        "palette_distance": float(nearest.mean() / np.sqrt(3.0)),
+        "text_likeness": float(runs.mean()),
     }
-    return hints.get(slug, "consistent palette matching the deck theme")
+    stats["score"] = (
+        0.35 * stats["border_emptiness"]
+        + 0.25 * (1.0 - min(1.0, stats["edge_density"] / 0.25))
+        + 0.2 * (1.0 - min(1.0, stats["palette_distance"] * 2.0))
+        + 0.2 * (1.0 - min(1.0, stats["text_likeness"] * 10.0))
+    )
+    return {k: round(v, 4) for k, v in stats.items()}
+
+
+def pick_candidate(fetched: FetchedImage, theme_slug: str) -> tuple[FetchedImage, list[dict[str, Any]]]:
+    """
+    Keep the best-scoring image of `fetched` and its alternates and delete the others. Returns
+    it with every candidate's scores (in gateway order, the kept one marked "chosen"); one
+    that does not decode never wins. Without NumPy/Pillow the first candidate is kept unscored.
+    """
+    pool = [dataclasses.replace(fetched, alternates=()), *fetched.alternates]
+    scores = [score_image(f.path, theme_slug) for f in pool]
+    if all(sc is None for sc in scores):
+        best = 0
+    else:
+        best = max(range(len(pool)), key=lambda i: -1.0 if scores[i] is None else scores[i]["score"])
+    for i, f in enumerate(pool):
+        if i != best:
+            f.path.unlink(missing_ok=True)
+    records = [{**(sc or {"score": None}), "chosen": i == best} for i, sc in enumerate(scores)]
+    return pool[best], records if any(sc is not None for sc in scores) else []
 
 
 def prompt_template(
@@ -149,6 +403,71 @@ def prompt_template(
     )
 
 
+@dataclass(frozen=True)
+class ItemResult:
+    path: Path
+    source: str = "gateway"  # gateway | cache | placeholder
+    elapsed_s: float = 0.0
+    gateway: str = ""  # which configured gateway produced it
+    extras: tuple[Path, ...] = ()  # extra renditions written next to `path`
+    candidates: tuple[dict[str, Any], ...] = ()  # score_image() of each candidate, when several came back
+
+
+def _best_of(res: ItemResult) -> str:
+    """Log suffix naming the kept candidate's score among the others'."""
+    if not res.candidates:
+        return ""
+    kept = next(c["score"] for c in res.candidates if c["chosen"])
+    others = ", ".join("-" if c["score"] is None else f"{c['score']:.2f}" for c in res.candidates if not c["chosen"])
+    return f" (best of {len(res.candidates)}: {kept:.2f} vs {others})"
+
+
+def _then(fut: Future[Any], fn: Any) -> Future[Any]:
+    """Future for fn(fut.result()), without blocking a worker thread on fut."""
+    out: Future[Any] = Future()
+
+    def done(f: Future[Any]) -> None:
+        try:
+            out.set_result(fn(f.result()))
+        except BaseException as e:
+            out.set_exception(e)
+
+    fut.add_done_callback(done)
+    return out
+
+
+def _resolve(value: Any, *, deadline: float | None = None) -> Any:
+    """
+    Unwrap pipeline stages: a job may return a Future for its next stage. With a `deadline`
+    (epoch seconds), raises TimeoutError once it passes with a stage still unfinished.
+    """
+    while isinstance(value, Future):
+        value = value.result(timeout=None if deadline is None else max(0.0, deadline - time.time()))
+    return value
+
+
+def _flatten(value: Any) -> Future[Any]:
+    """Future that settles once every chained stage has (the non-blocking twin of _resolve)."""
+    out: Future[Any] = Future()
+
+    def settle(f: Future[Any]) -> None:
+        try:
+            v = f.result()
+        except BaseException as e:
+            out.set_exception(e)
+            return
+        if isinstance(v, Future):
+            v.add_done_callback(settle)
+        else:
+            out.set_result(v)
+
+    if isinstance(value, Future):
+        value.add_done_callback(settle)
+    else:
+        out.set_result(value)
+    return out
+
+
 @dataclass(frozen=True)
 class PlanItem:
     name: str
@@ -156,37 +475,262 @@ class PlanItem:
     prompt: str
     size: str = "16:9"
     resolution: str = "1K"
+    change: str = ""  # unchanged | changed | added, when make-plan diffed against a previous plan
+    priority: int = 0  # higher goes first under generate --deadline
+    candidates: int = 0  # images per gateway call to pick the best from (0 = the run's --candidates)
 
 
-def make_plan(md_path: Path, theme_slug: str, start_slide: int) -> dict[str, Any]:
-    md = md_path.read_text(encoding="utf-8")
-    deck_title = (next((l[2:].strip() for l in md.splitlines() if l.startswith("# ")), None) or "Deck").strip()
-    analyses = parse_detailed_analysis(md)
-    images: list[dict[str, Any]] = []
+def _plan_item(img: dict[str, Any], index: int) -> PlanItem:
+    """PlanItem from one plan images[] entry (or JSONL line); ValueError when it has no prompt."""
+    item = PlanItem(
+        name=str(img.get("name") or f"image-{index:02d}"),
+        slide_number=int(img.get("slide_number") or 0),
+        prompt=str(img.get("prompt") or ""),
+        size=str(img.get("size") or "16:9"),
+        resolution=str(img.get("resolution") or "1K"),
+        change=str(img.get("change") or ""),
+        priority=int(img.get("priority") or 0),
+        candidates=int(img.get("candidates") or 0),
+    )
+    if not item.prompt.strip():
+        raise ValueError(f"Plan item {item.name} missing prompt")
+    _check_relative_name(item.name)
+    return item
 
-    for i, a in enumerate(analyses[:5]):
-        slide_number = start_slide + i
-        images.append(
-            {
-                "name": f"slide-{slide_number:02d}",
-                "slide_number": slide_number,
-                "size": "16:9",
-                "resolution": "1K",
-                "prompt": prompt_template(
-                    deck_title=deck_title,
-                    section_title=a["title"],
-                    section_body=a["body"],
-                    theme_slug=theme_slug,
-                ),
-            }
-        )
 
-    return {
+def _check_relative_name(name: str) -> None:
+    """ValueError unless `name` is a plain relative path (no root, drive or `..`) on any OS."""
+    parts = re.split(r"[\\/]", name)
+    if not name or name.startswith(("/", "\\")) or re.match(r"[A-Za-z]:", name) or ".." in parts:
+        raise ValueError(f"Unsafe name {name!r}: must be a relative path without '..'")
+
+
+def _contained_path(root: Path, name: str) -> Path:
+    """root / name, or ValueError when name is unsafe or resolves (through symlinks) outside root."""
+    _check_relative_name(name)
+    path = root / name
+    if not path.resolve().is_relative_to(root.resolve()):
+        raise ValueError(f"Unsafe name {name!r}: resolves outside {root}")
+    return path
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def expand_md_inputs(specs: list[str]) -> list[Path]:
+    """Files, directories (every *.md below them) and glob patterns, deduplicated in order."""
+    import glob
+
+    paths: list[Path] = []
+    for spec in specs:
+        p = Path(spec)
+        if p.is_dir():
+            paths.extend(sorted(p.rglob("*.md")))
+        elif p.exists():
+            paths.append(p)
+        else:
+            matches = sorted(Path(m) for m in glob.glob(spec, recursive=True))
+            if not matches:
+                raise SystemExit(f"No markdown matches {spec}")
+            paths.extend(matches)
+    seen: set[Path] = set()
+    return [p for p in paths if not (p.resolve() in seen or seen.add(p.resolve()))]
+
+
+def iter_plan_images(
+    md_paths: list[Path], theme_slug: str, start_slide: int, *, max_images: int = 5
+) -> Any:
+    """
+    Yield plan items for every report in `md_paths`. A report is a `# ` section (a file may
+    concatenate many); its images come from the `###` entries under `## Detailed Analysis`,
+    at most `max_images` per report (0 = all). With more than one report in total, names are
+    prefixed with "<report>/" so each deck gets its own image subdirectory.
+    """
+    multi = len(md_paths) > 1
+    for md_path in md_paths:
+        with MarkdownIndex.open(md_path) as index:
+            reports = index.children(None, 1) or [None]
+            multi = multi or len(reports) > 1
+            for r, report in enumerate(reports, start=1):
+                deck_title = (report.title if report else "") or "Deck"
+                analyses = parse_detailed_analysis(index, report)
+                if max_images > 0:
+                    analyses = analyses[:max_images]
+                slug = md_path.stem if len(reports) == 1 else f"{md_path.stem}-{r:02d}"
+                for i, a in enumerate(analyses):
+                    slide_number = start_slide + i
+                    prompt = prompt_template(
+                        deck_title=deck_title,
+                        section_title=a["title"],
+                        section_body=a["body"],
+                        theme_slug=theme_slug,
+                    )
+                    name = f"slide-{slide_number:02d}"
+                    item: dict[str, Any] = {
+                        "name": f"{slug}/{name}" if multi else name,
+                        "slide_number": slide_number,
+                        "size": "16:9",
+                        "resolution": "1K",
+                        "prompt": prompt,
+                        "fingerprint": {
+                            "section": _text_hash(f"{deck_title}\n{a['title']}\n{a['body']}"),
+                            "prompt": _text_hash(prompt),
+                            "theme": theme_slug,
+                        },
+                    }
+                    if multi:
+                        item["report"] = slug
+                    yield item
+
+
+def make_plan(
+    md_path: Path | list[Path],
+    theme_slug: str,
+    start_slide: int,
+    *,
+    previous: dict[str, Any] | None = None,
+    max_images: int = 5,
+) -> dict[str, Any]:
+    md_paths = md_path if isinstance(md_path, list) else [md_path]
+    plan: dict[str, Any] = {
         "version": 1,
         "theme": theme_slug,
         "model_hint": "gemini-3-pro-image-preview",
-        "images": images,
+        "images": list(iter_plan_images(md_paths, theme_slug, start_slide, max_images=max_images)),
     }
+    if previous is not None:
+        diff_plans(previous, plan)
+    return plan
+
+
+class PlanDiff:
+    """
+    Diff against a previous plan's items (matched by name), one new item at a time so a
+    streamed plan can be marked as it is written: mark() sets item["change"] to unchanged /
+    changed / added, finish() returns {"diff": counts, "removed": names that disappeared}.
+    """
+
+    def __init__(self, previous_images: Any) -> None:
+        self.old_items = {str(img.get("name")): img for img in previous_images if isinstance(img, dict)}
+        self.counts = {"unchanged": 0, "changed": 0, "added": 0, "removed": 0}
+
+    def mark(self, img: dict[str, Any]) -> dict[str, Any]:
+        old = self.old_items.pop(img["name"], None)
+        if old is None:
+            change = "added"
+        else:
+            # Plans written before fingerprints existed only let us compare the prompt itself.
+            old_fp = old.get("fingerprint") or {"prompt": _text_hash(str(old.get("prompt") or ""))}
+            same = all(old_fp.get(k) == v for k, v in img["fingerprint"].items() if k in old_fp)
+            same = same and (old.get("size"), old.get("resolution")) == (img["size"], img["resolution"])
+            change = "unchanged" if same else "changed"
+            if same and old.get("change") in ("changed", "added"):
+                # Rewriting the plan must not lose a mark generate may not have acted on yet;
+                # once it has, the journal's prompt_hash says so (see output_is_stale).
+                change = str(old["change"])
+        img["change"] = change
+        self.counts[change] += 1
+        return img
+
+    def finish(self) -> dict[str, Any]:
+        self.counts["removed"] = len(self.old_items)
+        return {"diff": dict(self.counts), "removed": sorted(self.old_items)}
+
+
+def diff_plans(previous: dict[str, Any], plan: dict[str, Any]) -> dict[str, int]:
+    """Mark plan["images"] against `previous` and store plan["diff"] / plan["removed"]."""
+    differ = PlanDiff(previous.get("images") or [])
+    for img in plan["images"]:
+        differ.mark(img)
+    plan.update(differ.finish())
+    return plan["diff"]
+
+
+# Keys of the line write_plan_jsonl appends after the items (PlanDiff.finish()).
+_PLAN_TRAILER_KEYS = frozenset({"diff", "removed"})
+
+
+def open_plan(spec: Any) -> tuple[dict[str, Any], Any]:
+    """
+    Open a plan for lazy reading (a path, "-" = stdin, or an open text stream). Returns
+    (meta, items iterator).
+
+    Two formats are accepted: the version-1 JSON plan ({"images": [...]}, meta["count"] set)
+    and JSONL, one item per line. Only two JSONL lines may carry plan-level fields instead of
+    a prompt: a first-line header with "format": "jsonl" (version, theme, ...) and make-plan's
+    diff/removed trailer. They are merged into `meta` as they are read, so meta is only
+    complete once the iterator is exhausted; any other line without a prompt is an error.
+    """
+    import sys
+
+    if not isinstance(spec, str):
+        f = spec
+    else:
+        f = sys.stdin if spec == "-" else open(spec, encoding="utf-8")
+    owned = f is not sys.stdin and f is not spec
+    first = ""
+    for first in f:
+        if first.strip():
+            break
+    try:
+        head = json.loads(first) if first.strip() else {}
+    except json.JSONDecodeError:
+        head = None
+    if head is None or (isinstance(head, dict) and isinstance(head.get("images"), list)):
+        # Version-1 plan: pretty-printed over many lines, or compact on one.
+        plan = head if head is not None else json.loads(first + f.read())
+        if owned:
+            f.close()
+        images = plan.get("images") or []
+        if not isinstance(images, list):
+            raise SystemExit("Plan images[] is not a list")
+        meta = {k: v for k, v in plan.items() if k != "images"}
+        meta["count"] = len(images)
+        return meta, iter(images)
+
+    meta: dict[str, Any] = {}
+
+    def items() -> Any:
+        try:
+            for n, line in enumerate(itertools.chain([first], f), start=1):
+                if not line.strip():
+                    continue
+                try:
+                    obj = json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise SystemExit(f"Plan line {n} is not JSON: {e}") from e
+                if not isinstance(obj, dict):
+                    raise SystemExit(f"Plan line {n} is not a JSON object")
+                if "prompt" in obj:
+                    yield obj
+                elif n == 1 and obj.get("format") == "jsonl":
+                    meta.update(obj)
+                elif obj and set(obj) <= _PLAN_TRAILER_KEYS:
+                    meta.update(obj)
+                else:
+                    raise SystemExit(f"Plan line {n} has no prompt: {line.strip()[:200]}")
+        finally:
+            if owned:
+                f.close()
+
+    return meta, items()
+
+
+def write_plan_jsonl(out: Any, header: dict[str, Any], images: Any, differ: PlanDiff | None = None) -> int:
+    """Write header, one line per item (flushed, so a reading pipe can start), diff trailer."""
+    n = 0
+    out.write(json.dumps(header, ensure_ascii=False) + "\n")
+    for img in images:
+        if differ is not None:
+            differ.mark(img)
+        out.write(json.dumps(img, ensure_ascii=False) + "\n")
+        out.flush()
+        n += 1
+    if differ is not None:
+        out.write(json.dumps(differ.finish(), ensure_ascii=False) + "\n")
+    out.flush()
+    return n
 
 
 def _gemini_auth_headers(api_key: str, mode: str) -> dict[str, str]:
@@ -222,6 +766,7 @@ def _openai_auth_headers(api_key: str) -> dict[str, str]:
         "authorization": f"Bearer {api_key}",
     }
 
+
 def _pick_env(*names: str) -> str:
     for n in names:
         v = (os.getenv(n) or "").strip()
@@ -235,291 +780,3599 @@ def _is_gemini_model(model: str) -> bool:
     return m.startswith("gemini-") or "gemini" in m
 
 
-def _download_to(url: str, out_path: Path, api_key: str | None = None) -> None:
-    headers = {}
-    if api_key:
-        headers.update(_openai_auth_headers(api_key))
-    with requests.get(url, headers=headers, stream=True, timeout=120) as r:
-        r.raise_for_status()
-        out_path.parent.mkdir(parents=True, exist_ok=True)
-        with out_path.open("wb") as f:
-            for chunk in r.iter_content(chunk_size=1024 * 256):
-                if chunk:
-                    f.write(chunk)
-
+# Connect (TCP + TLS) time of the current thread's request; 0 when a pooled connection was reused.
+_net_timing = threading.local()
 
-def _normalize_base_url(base_url: str) -> str:
-    return base_url.rstrip("/")
 
+def _timed_pool_classes() -> dict[str, type]:
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+    from urllib3.exceptions import ConnectTimeoutError, EmptyPoolError, MaxRetryError
 
-def _gemini_native_payload(prompt: str, aspect_ratio: str | None, image_size: str | None) -> dict[str, Any]:
-    payload: dict[str, Any] = {
-        "contents": [{"parts": [{"text": prompt}]}],
-    }
-    # Match common Gemini image generation shape:
-    # generationConfig.responseModalities = ["IMAGE"]
-    # generationConfig.imageConfig.{aspectRatio,imageSize}
-    payload["generationConfig"] = {
-        "responseModalities": ["IMAGE"],
-        "imageConfig": {},
-    }
-    if aspect_ratio:
-        payload["generationConfig"]["imageConfig"]["aspectRatio"] = aspect_ratio
-    if image_size:
-        payload["generationConfig"]["imageConfig"]["imageSize"] = image_size
-    return payload
+    def timed(cls: type) -> type:
+        class Timed(cls):  # type: ignore[misc, valid-type]
+            def connect(self) -> None:
+                t0 = time.perf_counter()
+                try:
+                    super().connect()
+                finally:
+                    _net_timing.connect = getattr(_net_timing, "connect", 0.0) + time.perf_counter() - t0
 
+        return Timed
 
-def _extract_inline_image_bytes(resp_json: dict[str, Any]) -> tuple[bytes, str]:
-    """
-    Parse Gemini generateContent response and return (bytes, mime_type).
-    Expected: candidates[0].content.parts[*].inlineData.data (base64)
-    """
-    candidates = resp_json.get("candidates") or []
-    if not isinstance(candidates, list) or not candidates:
-        raise RuntimeError("No candidates in response")
+    def bounded(cls: type) -> type:
+        class Bounded(cls):  # type: ignore[misc, valid-type]
+            def urlopen(self, method: str, url: str, *args: Any, **kwargs: Any) -> Any:
+                # With pool_block=True urllib3 waits for a free connection forever by default;
+                # count that wait against the request's connect timeout (already capped by
+                # --deadline) and surface it as a connect timeout, which callers retry.
+                if kwargs.get("pool_timeout") is None:
+                    limit = self._get_timeout(kwargs.get("timeout", self.timeout)).connect_timeout
+                    kwargs["pool_timeout"] = limit if isinstance(limit, (int, float)) else None
+                try:
+                    return super().urlopen(method, url, *args, **kwargs)
+                except EmptyPoolError as e:
+                    raise MaxRetryError(self, url, ConnectTimeoutError(self, f"No free connection: {e}")) from None
 
-    content = (candidates[0] or {}).get("content") or {}
-    parts = content.get("parts") or []
-    if not isinstance(parts, list) or not parts:
-        raise RuntimeError("No content.parts in response")
+        return Bounded
 
-    for part in parts:
-        if not isinstance(part, dict):
-            continue
-        inline = part.get("inlineData") or part.get("inline_data")
-        if not inline or not isinstance(inline, dict):
-            continue
-        b64 = inline.get("data")
-        mime = inline.get("mimeType") or inline.get("mime_type") or "image/png"
-        if not b64:
-            continue
-        import base64
+    class TimedHTTPPool(bounded(HTTPConnectionPool)):  # type: ignore[misc]
+        ConnectionCls = timed(HTTPConnection)
 
-        return (base64.b64decode(b64), str(mime))
+    class TimedHTTPSPool(bounded(HTTPSConnectionPool)):  # type: ignore[misc]
+        ConnectionCls = timed(HTTPSConnection)
 
-    # If the model only returned text, include a short hint.
-    text_parts = []
-    for part in parts:
-        if isinstance(part, dict) and isinstance(part.get("text"), str):
-            text_parts.append(part["text"])
-    if text_parts:
-        preview = " ".join(t.strip() for t in text_parts if t.strip())[:500]
-        raise RuntimeError(f"No inlineData image found (text preview: {preview})")
+    return {"http": TimedHTTPPool, "https": TimedHTTPSPool}
 
-    raise RuntimeError("No inlineData image found in response parts")
 
+_timed_adapter: type | None = None
 
-def _mime_to_ext(mime: str) -> str:
-    m = (mime or "").lower()
-    if "jpeg" in m or "jpg" in m:
-        return ".jpg"
-    if "webp" in m:
-        return ".webp"
-    return ".png"
 
+def _timed_adapter_class() -> type:
+    """HTTPAdapter whose pools time TCP/TLS connects; defined on first use so requests loads lazily."""
+    global _timed_adapter
+    if _timed_adapter is None:
+        from requests.adapters import HTTPAdapter
 
-def _normalize_gemini_model_path(model: str) -> str:
-    """
-    Gateways vary. Some expect:
-      /v1beta/models/google/<model>:generateContent
-    while others accept:
-      /v1beta/models/<model>:generateContent
+        class _TimedHTTPAdapter(HTTPAdapter):
+            def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+                super().init_poolmanager(*args, **kwargs)
+                self.poolmanager.pool_classes_by_scheme = _timed_pool_classes()
 
-    Accept:
-      - gemini-3-pro-image-preview
-      - google/gemini-3-pro-image-preview
-      - models/google/gemini-3-pro-image-preview
-      - models/gemini-3-pro-image-preview
-    """
-    m = (model or "").strip().lstrip("/")
-    if not m:
-        return "gemini-3-pro-image-preview"
-    if m.startswith("models/"):
-        m = m[len("models/") :]
-    return m
+        _timed_adapter = _TimedHTTPAdapter
+    return _timed_adapter
 
 
-def _try_to_png(raw: bytes, mime: str, width: int, height: int, *, resize: bool) -> bytes | None:
+class ItemMetrics:
     """
-    Convert image bytes to PNG. Returns None if Pillow is unavailable.
+    Per-plan-item timings for --metrics. Stages: connect, ttfb, download, json_parse,
+    b64_decode, decode, resize, encode, write (seconds, summed over retries), plus the retry
+    count and every HTTP status seen.
     """
-    try:
-        from PIL import Image  # type: ignore
-    except Exception:
-        return None
 
-    import io
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.created = time.time()
+        self.stages: dict[str, float] = {}
+        self.http_statuses: list[int] = []
+        self.retries = 0
+        self._lock = threading.Lock()
 
-    with Image.open(io.BytesIO(raw)) as im:
-        im.load()
-        if resize and width > 0 and height > 0 and (im.size[0] != width or im.size[1] != height):
-            im = im.resize((width, height), Image.LANCZOS)
-        out = io.BytesIO()
-        im.save(out, format="PNG")
-        b = out.getvalue()
-        if not b or len(b) < 8 or b[:8] != b"\x89PNG\r\n\x1a\n":
-            raise RuntimeError(f"PNG encode failed (source_mime={mime})")
-        return b
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + max(0.0, seconds)
 
+    def merge(self, stages: dict[str, float]) -> None:
+        for k, v in stages.items():
+            self.add(k, v)
 
-def generate_one(
-    *,
-    base_url: str,
-    api_key: str,
-    model: str,
-    prompt: str,
-    size: str,
-    resolution: str,
-    out_path: Path,
-    poll_interval_s: float,
-    timeout_s: float,
-    out_width: int,
-    out_height: int,
-    no_resize: bool,
-) -> None:
-    base = _normalize_base_url(base_url)
-    auth_mode = (
-        _pick_env("GEMINI_AUTH_MODE", "CHERRY_AUTH_MODE")
-        or ("both" if _pick_env("CHERRY_API_KEY") else "goog")
-    ).strip().lower()
+    @contextlib.contextmanager
+    def stage(self, stage: str) -> Any:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - t0)
 
-    # Prefer Gemini-native generateContent for Gemini models (works on proxies that mirror Google paths).
-    if _is_gemini_model(model):
-        model_path = _normalize_gemini_model_path(model)
-        model_paths_to_try = [model_path]
-        if model_path.startswith("google/"):
-            model_paths_to_try.append(model_path[len("google/") :])
-        else:
-            model_paths_to_try.append(f"google/{model_path}")
-        # Deduplicate while preserving order
-        seen: set[str] = set()
-        model_paths_to_try = [p for p in model_paths_to_try if not (p in seen or seen.add(p))]
-        aspect_ratio = None
-        if isinstance(size, str) and re.fullmatch(r"\d+\s*:\s*\d+", size.strip()):
-            aspect_ratio = size.strip().replace(" ", "")
-        image_size = None
-        if isinstance(resolution, str) and resolution.strip().upper() in ("1K", "2K", "4K"):
-            image_size = resolution.strip().upper()
-
-        native_payload = _gemini_native_payload(prompt, aspect_ratio, image_size)
-
-        last_err: Exception | None = None
-        for mp in model_paths_to_try:
-            native_url = f"{base}/v1beta/models/{mp}:generateContent"
-            for attempt in range(3):
-                headers = _gemini_auth_headers(api_key, auth_mode)
-                r = requests.post(native_url, headers=headers, json=native_payload, timeout=120)
-                if r.status_code in (401, 403) and auth_mode != "both":
-                    # Some gateways require Bearer auth; retry once with both.
-                    headers2 = _gemini_auth_headers(api_key, "both")
-                    r = requests.post(native_url, headers=headers2, json=native_payload, timeout=120)
-
-                if r.status_code < 400:
-                    img_bytes, mime = _extract_inline_image_bytes(r.json())
-
-                    png = _try_to_png(
-                        img_bytes,
-                        mime=mime,
-                        width=out_width,
-                        height=out_height,
-                        resize=(not no_resize),
-                    )
-                    out_path.parent.mkdir(parents=True, exist_ok=True)
-                    if png is not None:
-                        out_path.with_suffix(".png").write_bytes(png)
-                    else:
-                        out_path.with_suffix(_mime_to_ext(mime)).write_bytes(img_bytes)
-                    return
+    def request(self, http: Any, method: str, url: str, **kwargs: Any) -> requests.Response:
+        """http.request() that books connect/ttfb and the status code on this item."""
+        _net_timing.connect = 0.0
+        r = http.request(method, url, **kwargs)
+        connect = getattr(_net_timing, "connect", 0.0)
+        self.add("connect", connect)
+        self.add("ttfb", r.elapsed.total_seconds() - connect)
+        with self._lock:
+            self.http_statuses.append(r.status_code)
+        return r
 
-                # Retry on transient server / rate errors.
-                if r.status_code in (429, 500, 502, 503, 504):
-                    last_err = RuntimeError(
-                        f"HTTP {r.status_code} POST {native_url}: {(r.text or '')[:800]}"
-                    )
-                    time.sleep(0.4 * (2**attempt))
-                    continue
+    def to_record(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "stages": {k: round(v, 6) for k, v in self.stages.items()},
+            "retries": self.retries,
+            "http_statuses": list(self.http_statuses),
+        }
 
-                if r.status_code == 400 and len(model_paths_to_try) > 1:
-                    # Often means "wrong model path variant" on some gateways.
-                    last_err = RuntimeError(
-                        f"HTTP {r.status_code} POST {native_url}: {(r.text or '')[:800]}"
-                    )
-                    break
 
-                snippet = (r.text or "")[:2000]
-                raise RuntimeError(f"HTTP {r.status_code} POST {native_url}: {snippet}")
+METRIC_STAGES = ("connect", "ttfb", "download", "json_parse", "b64_decode", "score", "decode", "resize", "encode", "write")
 
-        raise last_err or RuntimeError("Gemini request failed after retries")
 
-    # Fallback: OpenAI-like images endpoint for non-Gemini models.
-    url = f"{base}/v1/images/generations"
-    payload: dict[str, Any] = {"model": model, "prompt": prompt, "n": 1, "response_format": "b64_json"}
-    r = requests.post(url, headers=_openai_auth_headers(api_key), json=payload, timeout=120)
-    if r.status_code >= 400:
-        snippet = (r.text or "")[:2000]
-        raise RuntimeError(f"HTTP {r.status_code} POST {url}: {snippet}")
-    data = r.json()
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[idx]
 
-    # Common patterns:
-    # 1) Task-based gateway: { data: { task_id, status } }
-    # 2) OpenAI-like: { data: [ { url } ] } or { data: [ { b64_json } ] }
-    # 3) Provider-specific variations.
-    def poll_task(task_id: str) -> None:
-        task_url = f"{base}/v1/tasks/{task_id}"
-        started = time.time()
-        while True:
-            if time.time() - started > timeout_s:
-                raise TimeoutError(f"Task {task_id} timed out after {timeout_s}s")
 
-            tr = requests.get(
-                f"{task_url}?language=en",
-                headers=_openai_auth_headers(api_key),
-                timeout=120,
-            )
-            tr.raise_for_status()
-            td = tr.json()
-            status = (td.get("data") or {}).get("status")
-
-            if status in ("success", "succeeded", "completed"):
-                result = (td.get("data") or {}).get("result") or {}
-                images = result.get("images") or []
-                if not images:
-                    raise RuntimeError(f"Task {task_id} success but result.images missing")
-
-                first = images[0]
-                urls = first.get("url") or first.get("urls") or []
-                if not urls:
-                    raise RuntimeError(f"Task {task_id} success but url missing")
-
-                _download_to(str(urls[0]), out_path, api_key=None)
-                return
+class MetricsSink:
+    """Collects finished ItemMetrics; exports JSON lines, a Prometheus textfile and a summary."""
 
-            if status in ("failed", "error", "canceled", "cancelled"):
-                raise RuntimeError(f"Task {task_id} failed: {td}")
+    def __init__(self) -> None:
+        self.records: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
 
-            time.sleep(poll_interval_s)
+    def record(self, metrics: ItemMetrics, *, status: str, total_s: float, source: str = "") -> None:
+        rec = {**metrics.to_record(), "status": status, "source": source, "total_s": round(total_s, 6)}
+        with self._lock:
+            self.records.append(rec)
 
-    if isinstance(data, dict) and isinstance(data.get("data"), dict) and (data["data"].get("task_id") or data["data"].get("id")):
-        poll_task(str(data["data"].get("task_id") or data["data"].get("id")))
-        return
+    def write_jsonl(self, path: Path) -> None:
+        lines = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in self.records)
+        _atomic_write_bytes(path, lines.encode("utf-8"))
 
-    if isinstance(data, dict) and isinstance(data.get("data"), list) and data["data"]:
-        item = data["data"][0]
-        if isinstance(item, dict) and (item.get("task_id") or item.get("id")):
-            poll_task(str(item.get("task_id") or item.get("id")))
+    def _stage_values(self) -> dict[str, list[float]]:
+        values: dict[str, list[float]] = {s: [] for s in (*METRIC_STAGES, "total")}
+        for r in self.records:
+            for s, v in r["stages"].items():
+                values.setdefault(s, []).append(v)
+            values["total"].append(r["total_s"])
+        return {s: v for s, v in values.items() if v}
+
+    def write_prometheus(self, path: Path) -> None:
+        # node_exporter textfile collector format; written atomically as that collector expects.
+        out = [
+            "# HELP gemini_image_pack_stage_seconds Per-item time spent in each pipeline stage.",
+            "# TYPE gemini_image_pack_stage_seconds summary",
+        ]
+        for stage, vals in self._stage_values().items():
+            for q in (0.5, 0.95, 1.0):
+                out.append(f'gemini_image_pack_stage_seconds{{stage="{stage}",quantile="{q}"}} {_percentile(vals, q):.6f}')
+            out.append(f'gemini_image_pack_stage_seconds_sum{{stage="{stage}"}} {sum(vals):.6f}')
+            out.append(f'gemini_image_pack_stage_seconds_count{{stage="{stage}"}} {len(vals)}')
+
+        statuses: dict[str, int] = {}
+        codes: dict[int, int] = {}
+        for r in self.records:
+            statuses[r["status"]] = statuses.get(r["status"], 0) + 1
+            for c in r["http_statuses"]:
+                codes[c] = codes.get(c, 0) + 1
+        out += ["# HELP gemini_image_pack_items_total Plan items by outcome.", "# TYPE gemini_image_pack_items_total counter"]
+        out += [f'gemini_image_pack_items_total{{status="{k}"}} {v}' for k, v in sorted(statuses.items())]
+        out += [
+            "# HELP gemini_image_pack_http_responses_total Gateway/CDN responses by status code.",
+            "# TYPE gemini_image_pack_http_responses_total counter",
+        ]
+        out += [f'gemini_image_pack_http_responses_total{{code="{k}"}} {v}' for k, v in sorted(codes.items())]
+        out += [
+            "# HELP gemini_image_pack_retries_total Gateway request retries.",
+            "# TYPE gemini_image_pack_retries_total counter",
+            f"gemini_image_pack_retries_total {sum(r['retries'] for r in self.records)}",
+        ]
+        _atomic_write_bytes(path, ("\n".join(out) + "\n").encode("utf-8"))
+
+    def summary(self) -> str:
+        rows = [f"{'stage':<11} {'p50':>8} {'p95':>8} {'max':>8}  (seconds, {len(self.records)} items)"]
+        for stage, vals in self._stage_values().items():
+            rows.append(
+                f"{stage:<11} {_percentile(vals, 0.5):>8.3f} {_percentile(vals, 0.95):>8.3f} {max(vals):>8.3f}"
+            )
+        return "\n".join(rows)
+
+
+def make_http_session(*, pool_size: int, pool_hosts: int = 4) -> requests.Session:
+    """
+    One keep-alive connection pool shared by every gateway call in a run (ImagePipeline keeps
+    a second one, sized for _DOWNLOAD_PARTS ranges per worker, for image downloads and a
+    small third one for task polling).
+
+    urllib3 keeps a separate pool per host: `pool_hosts` is how many host pools are cached
+    (gateway + CDN download hosts), `pool_size` is the per-host connection cap. With
+    pool_block=True workers wait for a warm connection instead of opening extra ones, but
+    no longer than the request's connect timeout (then requests.ConnectTimeout).
+    """
+    import requests
+
+    session = requests.Session()
+    adapter = _timed_adapter_class()(
+        pool_connections=max(1, pool_hosts),
+        pool_maxsize=max(1, pool_size),
+        pool_block=True,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Files at least this big are fetched as parallel byte ranges when the server allows it;
+# below it the extra round trips cost more than a second connection saves.
+_RANGED_MIN_BYTES = 4 * 1024 * 1024
+_RANGE_PART_BYTES = 2 * 1024 * 1024
+# Times one transfer (or one range) picks up where it stopped after a dropped connection.
+_DOWNLOAD_RESUMES = 3
+# Parallel ranges per download (and connections per worker in the download pool).
+_DOWNLOAD_PARTS = 4
+
+
+class _RangesIgnored(RuntimeError):
+    """A ranged GET came back whole (or for another version of the file): use one stream."""
+
+
+def _download_to(
+    url: str,
+    out_path: Path,
+    api_key: str | None = None,
+    *,
+    session: requests.Session | None = None,
+    metrics: ItemMetrics | None = None,
+    max_parts: int = _DOWNLOAD_PARTS,
+    deadline: float | None = None,
+) -> None:
+    """
+    GET `url` into `out_path` through a sibling temp file. A HEAD probe checks for
+    `Accept-Ranges: bytes`: files of _RANGED_MIN_BYTES or more then come down as up to
+    `max_parts` parallel ranges into a preallocated temp file. Either way a connection that
+    drops mid-transfer resumes from its last byte (when the server takes ranges) instead of
+    starting over. The file is promoted only once its length, and its MD5 when the server
+    publishes one, check out. No request or read outlasts `deadline` (epoch seconds).
+    """
+    import requests
+
+    http = session or requests
+    metrics = metrics or ItemMetrics("")
+    headers = {}
+    if api_key:
+        headers.update(_openai_auth_headers(api_key))
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_path.with_name(f".{out_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with metrics.stage("download"):
+            probe = _probe_ranges(http, url, headers, deadline) if max_parts > 1 else None
+            size, md5 = None, None
+            if probe is not None and probe[0] >= _RANGED_MIN_BYTES:
+                size, validator, md5 = probe
+                try:
+                    _download_ranges(http, url, tmp, size, validator, headers, metrics, max_parts, deadline)
+                except _RangesIgnored:
+                    size = None
+            if size is None:
+                size, md5 = _download_stream(http, url, tmp, headers, metrics, deadline)
+            _verify_download(tmp, url, size, md5)
+        os.replace(tmp, out_path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def _range_headers(r: requests.Response) -> tuple[int | None, str | None, str | None, bool]:
+    """(full length, validator for If-Range, MD5 as hex, accepts byte ranges) from a response."""
+    import base64
+
+    encoded = bool(r.headers.get("content-encoding"))
+    length = r.headers.get("content-length")
+    etag = r.headers.get("etag") or ""
+    validator = etag if etag and not etag.startswith("W/") else r.headers.get("last-modified")
+    md5 = None
+    for part in (r.headers.get("x-goog-hash") or "").split(","):
+        if part.strip().startswith("md5="):
+            md5 = base64.b64decode(part.strip()[4:]).hex()
+    if md5 is None and r.headers.get("content-md5"):
+        md5 = base64.b64decode(r.headers["content-md5"]).hex()
+    ranges = "bytes" in (r.headers.get("accept-ranges") or "").lower() and not encoded
+    return (int(length) if length and length.isdigit() and not encoded else None), validator, md5, ranges
+
+
+def _probe_ranges(
+    http: Any, url: str, headers: dict[str, str], deadline: float | None = None
+) -> tuple[int, str | None, str | None] | None:
+    """HEAD `url`: (length, validator, md5) when it can be fetched in byte ranges, else None."""
+    import requests
+
+    timeout = _capped_timeout(15, deadline, f"HEAD {url}")
+    try:
+        r = http.request("HEAD", url, headers=headers, timeout=timeout, allow_redirects=True)
+    except (requests.ConnectionError, requests.Timeout):
+        return None
+    with r:
+        if r.status_code >= 400:
+            return None
+        length, validator, md5, ranges = _range_headers(r)
+    return (length, validator, md5) if ranges and length else None
+
+
+def _download_stream(
+    http: Any, url: str, tmp: Path, headers: dict[str, str], metrics: ItemMetrics, deadline: float | None = None
+) -> tuple[int | None, str | None]:
+    """One GET into `tmp`, resumed with a Range request if the connection drops; (length, md5)."""
+    import requests
+
+    written = 0
+    expected, validator, md5, resumable = None, None, None, False
+    resumes = 0
+    with tmp.open("wb") as f:
+        while True:
+            h = dict(headers)
+            if written:
+                h["Range"] = f"bytes={written}-"
+                if validator:
+                    h["If-Range"] = validator
+            timeout = _capped_timeout(120, deadline, f"GET {url}")
+            try:
+                with metrics.request(http, "GET", url, headers=h, stream=True, timeout=timeout) as r:
+                    r.raise_for_status()
+                    if written and r.status_code != 206:
+                        # Range ignored, or the file changed since: start over from this body.
+                        f.seek(0)
+                        f.truncate()
+                        written = 0
+                    if not written:
+                        expected, validator, md5, resumable = _range_headers(r)
+                    for chunk in r.iter_content(chunk_size=1024 * 256):
+                        _check_deadline(deadline, f"downloading {url}")
+                        if chunk:
+                            f.write(chunk)
+                            written += len(chunk)
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+                if not resumable or resumes >= _DOWNLOAD_RESUMES:
+                    raise
+            else:
+                if expected is None or written >= expected or not resumable or resumes >= _DOWNLOAD_RESUMES:
+                    return expected, md5
+            resumes += 1
+            metrics.retries += 1
+
+
+def _download_ranges(
+    http: Any,
+    url: str,
+    tmp: Path,
+    size: int,
+    validator: str | None,
+    headers: dict[str, str],
+    metrics: ItemMetrics,
+    max_parts: int,
+    deadline: float | None = None,
+) -> None:
+    """Fetch `size` bytes as parallel ranges into a preallocated `tmp`; each range resumes on its own."""
+    import requests
+
+    parts = max(1, min(max_parts, size // _RANGE_PART_BYTES))
+    step = -(-size // parts)
+    with tmp.open("wb") as f:
+        f.truncate(size)
+    abort = threading.Event()
+
+    def fetch(start: int, end: int) -> int:
+        pos, resumes = start, 0
+        with tmp.open("r+b") as f:
+            while pos <= end and not abort.is_set():
+                h = {**headers, "Range": f"bytes={pos}-{end}"}
+                if validator:
+                    h["If-Range"] = validator
+                timeout = _capped_timeout(120, deadline, f"GET {url} ({h['Range']})")
+                try:
+                    with metrics.request(http, "GET", url, headers=h, stream=True, timeout=timeout) as r:
+                        r.raise_for_status()
+                        if r.status_code != 206 or not (r.headers.get("content-range") or "").startswith(f"bytes {pos}-"):
+                            raise _RangesIgnored(f"{url} answered a range request with HTTP {r.status_code}")
+                        f.seek(pos)
+                        for chunk in r.iter_content(chunk_size=1024 * 256):
+                            _check_deadline(deadline, f"downloading {url}")
+                            if abort.is_set():
+                                break
+                            if chunk:
+                                f.write(chunk[: end + 1 - pos])
+                                pos += min(len(chunk), end + 1 - pos)
+                    if pos <= end and not abort.is_set():
+                        raise requests.exceptions.ChunkedEncodingError(f"range ended at byte {pos} of {start}-{end}")
+                except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+                    if resumes >= _DOWNLOAD_RESUMES:
+                        raise
+                    resumes += 1
+        return resumes
+
+    with ThreadPoolExecutor(max_workers=parts, thread_name_prefix="range") as pool:
+        futures = [pool.submit(fetch, start, min(size, start + step) - 1) for start in range(0, size, step)]
+        try:
+            metrics.retries += sum(fut.result() for fut in futures)
+        except BaseException:
+            abort.set()
+            raise
+
+
+def _verify_download(path: Path, url: str, size: int | None, md5: str | None) -> None:
+    written = path.stat().st_size
+    if size is not None and written != size:
+        raise RuntimeError(f"Truncated download from {url}: {written} of {size} bytes")
+    if md5 is not None:
+        digest = hashlib.md5()
+        with path.open("rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        if digest.hexdigest() != md5:
+            raise RuntimeError(f"Corrupt download from {url}: MD5 {digest.hexdigest()} != {md5}")
+
+
+def _normalize_base_url(base_url: str) -> str:
+    return base_url.rstrip("/")
+
+
+# Pixel size Gemini image models return at imageSize "1K" per aspectRatio; 2K/4K are 2x/4x.
+_GEMINI_1K_DIMS = {
+    "1:1": (1024, 1024),
+    "2:3": (848, 1264),
+    "3:2": (1264, 848),
+    "3:4": (896, 1200),
+    "4:3": (1200, 896),
+    "4:5": (928, 1152),
+    "5:4": (1152, 928),
+    "9:16": (768, 1376),
+    "16:9": (1376, 768),
+    "21:9": (1584, 672),
+}
+_IMAGE_SIZES = ("1K", "2K", "4K")
+
+
+def gemini_image_dims(aspect_ratio: str, image_size: str) -> tuple[int, int] | None:
+    """Pixels the gateway returns for (aspectRatio, imageSize), or None when not a known pair."""
+    base = _GEMINI_1K_DIMS.get(aspect_ratio.replace(" ", ""))
+    if base is None or image_size.upper() not in _IMAGE_SIZES:
+        return None
+    scale = 2 ** _IMAGE_SIZES.index(image_size.upper())
+    return base[0] * scale, base[1] * scale
+
+
+def pick_image_size(aspect_ratio: str, image_size: str, targets: list[tuple[int, int]]) -> tuple[str, str]:
+    """
+    Smallest (aspectRatio, imageSize) whose pixels cover every target (width, height) output.
+
+    The aspect ratio is kept unless it differs from the largest target's by more than 2%, in
+    which case the closest supported one is used (the resize would otherwise distort). When
+    even 4K is too small, 4K is returned. Unknown aspect ratios/sizes are passed through.
+    """
+    targets = [(w, h) for w, h in targets if w > 0 and h > 0]
+    aspect = aspect_ratio.replace(" ", "")
+    if not targets or gemini_image_dims(aspect, image_size) is None:
+        return aspect_ratio, image_size
+    tw, th = max(targets, key=lambda t: t[0] * t[1])
+    w, h = _GEMINI_1K_DIMS[aspect]
+    if abs((w / h) / (tw / th) - 1) > 0.02:
+        aspect = min(_GEMINI_1K_DIMS, key=lambda a: abs(_GEMINI_1K_DIMS[a][0] / _GEMINI_1K_DIMS[a][1] - tw / th))
+    for size in _IMAGE_SIZES:
+        dims = gemini_image_dims(aspect, size)
+        if dims is not None and all(dims[0] >= w and dims[1] >= h for w, h in targets):
+            return aspect, size
+    return aspect, _IMAGE_SIZES[-1]
+
+
+def _gemini_native_payload(
+    prompt: str, aspect_ratio: str | None, image_size: str | None, candidates: int = 1
+) -> dict[str, Any]:
+    payload: dict[str, Any] = {
+        "contents": [{"parts": [{"text": prompt}]}],
+    }
+    # Match common Gemini image generation shape:
+    # generationConfig.responseModalities = ["IMAGE"]
+    # generationConfig.imageConfig.{aspectRatio,imageSize}
+    payload["generationConfig"] = {
+        "responseModalities": ["IMAGE"],
+        "imageConfig": {},
+    }
+    if aspect_ratio:
+        payload["generationConfig"]["imageConfig"]["aspectRatio"] = aspect_ratio
+    if image_size:
+        payload["generationConfig"]["imageConfig"]["imageSize"] = image_size
+    if candidates > 1:
+        payload["generationConfig"]["candidateCount"] = candidates
+    return payload
+
+
+def _mime_to_ext(mime: str) -> str:
+    m = (mime or "").lower()
+    if "jpeg" in m or "jpg" in m:
+        return ".jpg"
+    if "webp" in m:
+        return ".webp"
+    return ".png"
+
+
+def _normalize_gemini_model_path(model: str) -> str:
+    """
+    Gateways vary. Some expect:
+      /v1beta/models/google/<model>:generateContent
+    while others accept:
+      /v1beta/models/<model>:generateContent
+
+    Accept:
+      - gemini-3-pro-image-preview
+      - google/gemini-3-pro-image-preview
+      - models/google/gemini-3-pro-image-preview
+      - models/gemini-3-pro-image-preview
+    """
+    m = (model or "").strip().lstrip("/")
+    if not m:
+        return "gemini-3-pro-image-preview"
+    if m.startswith("models/"):
+        m = m[len("models/") :]
+    return m
+
+
+_FORMAT_EXT = {"png": ".png", "webp": ".webp", "jpeg": ".jpg"}
+
+
+@dataclass(frozen=True)
+class Rendition:
+    """One encoding of a finished image: target size, format (png | webp | jpeg) and lossy quality."""
+
+    width: int
+    height: int
+    format: str = "png"
+    quality: int = 82  # webp/jpeg only
+
+    @property
+    def ext(self) -> str:
+        return _FORMAT_EXT[self.format]
+
+    def path_for(self, out_path: Path) -> Path:
+        """Extra renditions sit next to the main image: slide-05.png -> slide-05.320x180.webp."""
+        return out_path.with_name(f"{out_path.stem}.{self.width}x{self.height}{self.ext}")
+
+
+def parse_rendition(spec: str) -> Rendition:
+    """`WxH[:FORMAT[:QUALITY]]`, e.g. "320x180:webp" or "1280x720:jpeg:85"."""
+    parts = spec.strip().lower().split(":")
+    m = re.fullmatch(r"(\d+)x(\d+)", parts[0])
+    fmt = {"jpg": "jpeg"}.get(parts[1], parts[1]) if len(parts) > 1 and parts[1] else "png"
+    if not m or fmt not in _FORMAT_EXT or len(parts) > 3 or (len(parts) == 3 and not parts[2].isdigit()):
+        raise argparse.ArgumentTypeError(f"bad rendition {spec!r} (expected WxH[:png|webp|jpeg[:QUALITY]])")
+    return Rendition(int(m.group(1)), int(m.group(2)), fmt, int(parts[2]) if len(parts) == 3 else 82)
+
+
+def _save_renditions(
+    src: bytes | Path,
+    mime: str,
+    targets: list[tuple[Path, Rendition, bool]],
+    *,
+    compress_level: int = 6,
+    optimize: bool = False,
+    timings: dict[str, float] | None = None,
+) -> bool:
+    """
+    Decode once, then resize/encode each (dst, rendition, resize) target from the decoded
+    pixels, writing via temp files. Returns False if Pillow is unavailable.
+    """
+    try:
+        from PIL import Image  # type: ignore
+    except Exception:
+        return False
+
+    import io
+
+    timings = {} if timings is None else timings
+    clock = time.perf_counter()
+
+    def lap(stage: str) -> None:
+        nonlocal clock
+        now = time.perf_counter()
+        timings[stage] = timings.get(stage, 0.0) + now - clock
+        clock = now
+
+    written: list[tuple[Path, Path]] = []
+    try:
+        with Image.open(io.BytesIO(src) if isinstance(src, bytes) else src) as im:
+            sized = [(r.width, r.height) for _, r, resize in targets if resize and r.width > 0 and r.height > 0]
+            if len(sized) == len(targets) and im.format == "JPEG":
+                # Let libjpeg decode at 1/2, 1/4 or 1/8 scale (never below the largest target).
+                im.draft("RGB", max(sized))
+            im.load()
+            lap("decode")
+            for dst, r, resize in targets:
+                out = im
+                if resize and r.width > 0 and r.height > 0 and im.size != (r.width, r.height):
+                    out = im.resize((r.width, r.height), Image.LANCZOS)
+                lap("resize")
+                tmp = dst.with_name(f".{dst.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+                written.append((tmp, dst))
+                if r.format == "jpeg":
+                    out.convert("RGB").save(tmp, format="JPEG", quality=r.quality, optimize=True, progressive=True)
+                elif r.format == "webp":
+                    if out.mode not in ("RGB", "RGBA"):
+                        out = out.convert("RGBA" if "A" in out.getbands() else "RGB")
+                    out.save(tmp, format="WEBP", quality=r.quality, method=4)
+                else:
+                    out.save(tmp, format="PNG", compress_level=compress_level, optimize=optimize)
+                lap("encode")
+                if not _image_file_looks_complete(tmp):
+                    raise RuntimeError(f"{r.format.upper()} encode failed (source_mime={mime})")
+    except BaseException:
+        for tmp, _ in written:
+            tmp.unlink(missing_ok=True)
+        raise
+    for tmp, dst in written:
+        os.replace(tmp, dst)
+    lap("write")
+    return True
+
+
+def _part_path(tmp_dir: Path, prefix: str) -> Path:
+    """Fresh hidden `.part` path under tmp_dir (regular umask permissions, unlike mkstemp)."""
+    import uuid
+
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    return tmp_dir / f".{prefix}-{uuid.uuid4().hex}.part"
+
+
+class _InlineImageScanner:
+    """
+    Incremental scanner for a generateContent JSON body.
+
+    Every `"data": "<base64>"` value is base64-decoded in chunks straight into its own temp
+    file; everything else (the small "skeleton" of the response, with data emptied) is kept so
+    mime types and text-only error messages can still be read with json.loads.
+    """
+
+    _DATA_KEY = re.compile(rb'"data"\s*:\s*"')
+    # JSON may escape "/" as "\/"; drop the backslashes and any line breaks.
+    _STRIP = b"\\\r\n\t "
+
+    def __init__(self, tmp_dir: Path) -> None:
+        self.tmp_dir = tmp_dir
+        self.skeleton = bytearray()
+        self.blobs: list[Path] = []
+        self._scan_from = 0
+        self._out: Any = None
+        self._carry = b""
+        self.decode_s = 0.0
+
+    def feed(self, chunk: bytes) -> None:
+        while chunk:
+            if self._out is None:
+                # Only the tail can complete a partial key match from the previous chunk.
+                start = max(self._scan_from, len(self.skeleton) - 64)
+                self.skeleton += chunk
+                chunk = b""
+                m = self._DATA_KEY.search(self.skeleton, start)
+                in_inline = m is not None and (
+                    self.skeleton.rfind(b'"inlineData"', 0, m.start()) >= 0
+                    or self.skeleton.rfind(b'"inline_data"', 0, m.start()) >= 0
+                )
+                if m is None:
+                    continue
+                if not in_inline:
+                    self._scan_from = m.end()
+                    chunk = bytes(self.skeleton[m.end() :])
+                    del self.skeleton[m.end() :]
+                    continue
+                chunk = bytes(self.skeleton[m.end() :])
+                del self.skeleton[m.end() :]
+                self._open_blob()
+            else:
+                end = chunk.find(b'"')
+                data, chunk = (chunk, b"") if end < 0 else (chunk[:end], chunk[end:])
+                self._write_b64(data)
+                if end >= 0:
+                    self._close_blob()
+
+    def _open_blob(self) -> None:
+        path = _part_path(self.tmp_dir, "inline")
+        self._out = path.open("xb")
+        self._carry = b""
+        self.blobs.append(path)
+
+    def _write_b64(self, data: bytes) -> None:
+        import base64
+
+        t0 = time.perf_counter()
+        data = self._carry + data.translate(None, self._STRIP)
+        n = len(data) - len(data) % 4
+        if n:
+            self._out.write(base64.b64decode(data[:n]))
+        self._carry = data[n:]
+        self.decode_s += time.perf_counter() - t0
+
+    def _close_blob(self) -> None:
+        import base64
+
+        if self._carry:
+            self._out.write(base64.b64decode(self._carry + b"=" * (-len(self._carry) % 4)))
+        self._out.close()
+        self._out = None
+        self._carry = b""
+        self._scan_from = len(self.skeleton)
+
+    def discard(self) -> None:
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+        for p in self.blobs:
+            p.unlink(missing_ok=True)
+
+
+def _stream_inline_images(
+    r: requests.Response, tmp_dir: Path, metrics: ItemMetrics | None = None, *, deadline: float | None = None
+) -> list[tuple[Path, str]]:
+    """
+    Return [(temp_file, mime_type)] for every inline image in a generateContent response
+    (candidates[*].content.parts[*].inlineData.data) without ever holding the base64 text in memory.
+    The caller owns (and must remove) the temp files.
+    """
+    metrics = metrics or ItemMetrics("")
+    scanner = _InlineImageScanner(tmp_dir)
+    try:
+        t0 = time.perf_counter()
+        for chunk in r.iter_content(chunk_size=64 * 1024):
+            _check_deadline(deadline, f"reading {r.url}")
+            if chunk:
+                scanner.feed(chunk)
+        # Base64 decoding is interleaved with reading the body; book it separately.
+        metrics.add("download", time.perf_counter() - t0 - scanner.decode_s)
+        metrics.add("b64_decode", scanner.decode_s)
+        if scanner._out is not None:
+            raise RuntimeError("Truncated response: inlineData.data not terminated")
+        with metrics.stage("json_parse"):
+            skeleton = json.loads(bytes(scanner.skeleton).decode("utf-8"))
+    except Exception:
+        scanner.discard()
+        raise
+
+    parts = [
+        part
+        for cand in skeleton.get("candidates") or []
+        for part in ((cand or {}).get("content") or {}).get("parts") or []
+        if isinstance(part, dict)
+    ]
+    if not scanner.blobs:
+        if not parts:
+            raise RuntimeError("No candidates with content.parts in response")
+        # If the model only returned text, include a short hint.
+        preview = " ".join(p["text"].strip() for p in parts if isinstance(p.get("text"), str))[:500].strip()
+        if preview:
+            raise RuntimeError(f"No inlineData image found (text preview: {preview})")
+        raise RuntimeError("No inlineData image found in response parts")
+
+    mimes: list[str] = []
+    for part in parts:
+        inline = part.get("inlineData") or part.get("inline_data")
+        if isinstance(inline, dict) and "data" in inline:
+            mimes.append(str(inline.get("mimeType") or inline.get("mime_type") or "image/png"))
+    mimes += ["image/png"] * (len(scanner.blobs) - len(mimes))
+    return list(zip(scanner.blobs, mimes))
+
+
+def _atomic_write_bytes(path: Path, data: bytes) -> None:
+    """Write via a sibling temp file + rename, so readers never see a half-written file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def _sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _image_file_looks_complete(path: Path) -> bool:
+    """Cheap structural check: known signature at the head and the format's end marker at the tail."""
+    try:
+        size = path.stat().st_size
+        with path.open("rb") as f:
+            head = f.read(12)
+            f.seek(max(0, size - 12))
+            tail = f.read(12)
+    except OSError:
+        return False
+    if head[:8] == b"\x89PNG\r\n\x1a\n":
+        return b"IEND" in tail
+    if head[:3] == b"\xff\xd8\xff":
+        return tail.endswith(b"\xff\xd9")
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return int.from_bytes(head[4:8], "little") + 8 == size
+    # Unknown format (raw gateway bytes): nothing more to check.
+    return size > 0
+
+
+class RunJournal:
+    """
+    Append-only JSONL log of generate runs, kept with the images they describe
+    (`images.plan.json` -> `<out-dir>/images.plan.journal.jsonl`).
+
+    One line per event: {"ts", "run", "name", "status": started|done|failed|placeholder, ...}; "done"
+    lines also carry path, sha256, bytes, model, source and elapsed_s. --resume trusts the
+    last "done" line per item only while it names the output path being asked for and the
+    file on disk still matches it.
+    """
+
+    def __init__(self, path: Path) -> None:
+        import uuid
+
+        self.path = path
+        self.run_id = uuid.uuid4().hex[:12]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def default_path(plan_path: Path, out_dir: Path) -> Path:
+        """In out_dir, or next to the plan where older runs kept it (while only that one exists)."""
+        path = out_dir / plan_path.with_suffix(".journal.jsonl").name
+        legacy = plan_path.with_suffix(".journal.jsonl")
+        return legacy if legacy.exists() and not path.exists() else path
+
+    def append(self, name: str, status: str, **fields: Any) -> None:
+        rec = {"ts": round(time.time(), 3), "run": self.run_id, "name": name, "status": status, **fields}
+        line = json.dumps(rec, ensure_ascii=False) + "\n"
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(line)
+
+    def completed(self) -> dict[str, dict[str, Any]]:
+        done: dict[str, dict[str, Any]] = {}
+        if not self.path.exists():
+            return done
+        for line in self.path.read_text(encoding="utf-8", errors="replace").splitlines():
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                # A crash mid-append leaves a partial last line.
+                continue
+            if not isinstance(rec, dict) or not rec.get("name"):
+                continue
+            if rec.get("status") == "done":
+                done[str(rec["name"])] = rec
+            elif rec.get("status") in ("started", "placeholder"):
+                # A placeholder stands in for a missing image: --resume regenerates it.
+                done.pop(str(rec["name"]), None)
+        return done
+
+
+def verify_output(rec: dict[str, Any]) -> Path | None:
+    """Return the journaled output path if it is still intact (size, header/trailer, sha256)."""
+    path = Path(str(rec.get("path") or ""))
+    try:
+        if not rec.get("path") or path.stat().st_size != int(rec.get("bytes") or -1):
+            return None
+    except OSError:
+        return None
+    if not _image_file_looks_complete(path):
+        return None
+    if rec.get("sha256") and _sha256_file(path) != rec["sha256"]:
+        return None
+    return path
+
+
+def output_is_stale(item: PlanItem, out_path: Path, rec: dict[str, Any] | None) -> bool:
+    """
+    Whether an existing output must be regenerated for `item`. The journal's last done record
+    for this very path decides, by its prompt_hash; without one, make-plan's change mark does.
+    """
+    if rec is not None and rec.get("prompt_hash") and rec.get("path"):
+        if Path(str(rec["path"])).resolve() == out_path.resolve():
+            return rec["prompt_hash"] != _text_hash(item.prompt)
+    return item.change in ("changed", "added")
+
+
+def journaled_output(rec: dict[str, Any] | None, out_path: Path) -> Path | None:
+    """out_path if the journal's done record is for that very file and it is still intact."""
+    if rec is None or not rec.get("path") or Path(str(rec["path"])).resolve() != out_path.resolve():
+        return None
+    return verify_output(rec)
+
+
+def default_cache_dir() -> Path:
+    override = _pick_env("CHERRY_CACHE_DIR", "GEMINI_CACHE_DIR")
+    if override:
+        return Path(override)
+    xdg = os.environ.get("XDG_CACHE_HOME")
+    return (Path(xdg) if xdg else Path.home() / ".cache") / "md-to-modern-pptx"
+
+
+def image_cache_key(
+    *,
+    prompt: str,
+    model: str,
+    size: str,
+    resolution: str,
+    width: int,
+    height: int,
+    no_resize: bool,
+    out_format: str = "png",
+    quality: int = 82,
+    candidates: int = 1,
+) -> str:
+    fields: dict[str, Any] = {
+        "prompt": prompt,
+        "model": model,
+        "size": size,
+        "resolution": resolution,
+        "width": width,
+        "height": height,
+        "no_resize": no_resize,
+    }
+    if out_format != "png":
+        # PNG keys keep their original shape so existing caches stay valid.
+        fields.update(format=out_format, quality=quality)
+    if candidates > 1:
+        # Best of N is a different image than whatever a single call returned.
+        fields["candidates"] = candidates
+    blob = json.dumps(fields, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _link_or_copy(src: Path, dst: Path) -> None:
+    """
+    Hardlink when src/dst share a filesystem, otherwise copy. dst is replaced, never written
+    through, so a hardlinked cache entry is not modified when an output is regenerated.
+    """
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(f".{dst.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+    # rename() does nothing when dst already is a link to the same file, leaving tmp behind.
+    tmp.unlink(missing_ok=True)
+
+
+class ImageCache:
+    """
+    Content-addressed store of generated images, shared across decks and runs.
+
+    Layout: <root>/images/<key[:2]>/<key><ext>. An entry's mtime is its last use, which
+    drives LRU eviction once the store grows past `max_bytes`. The store's size is scanned
+    once per instance and then kept as a running total, so stores only rescan (to prune)
+    when they push it over the cap.
+    """
+
+    def __init__(self, root: Path, *, max_bytes: int) -> None:
+        self.root = root
+        self.images_dir = root / "images"
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._bytes: int | None = None
+
+    def _entry(self, key: str) -> Path | None:
+        shard = self.images_dir / key[:2]
+        for ext in (".png", ".jpg", ".webp"):
+            p = shard / f"{key}{ext}"
+            if p.exists():
+                return p
+        return None
+
+    def entries(self) -> list[tuple[Path, os.stat_result]]:
+        out: list[tuple[Path, os.stat_result]] = []
+        if not self.images_dir.exists():
+            return out
+        for p in self.images_dir.glob("*/*"):
+            if p.name.startswith("."):
+                continue
+            try:
+                out.append((p, p.stat()))
+            except FileNotFoundError:
+                continue
+        return out
+
+    def materialize(self, key: str, out_path: Path) -> Path | None:
+        """
+        Place a cached image at out_path (keeping the cached suffix). Returns None on miss.
+        """
+        src = self._entry(key)
+        if src is None:
+            return None
+        dst = out_path.with_suffix(src.suffix)
+        try:
+            os.utime(src)
+            _link_or_copy(src, dst)
+        except FileNotFoundError:
+            # Evicted by a concurrent prune.
+            return None
+        return dst
+
+    def has(self, key: str) -> bool:
+        return self._entry(key) is not None
+
+    def store(self, key: str, src: Path) -> None:
+        dst = self.images_dir / key[:2] / f"{key}{src.suffix}"
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = sum(st.st_size for _, st in self.entries())
+            try:
+                self._bytes -= dst.stat().st_size
+            except FileNotFoundError:
+                pass
+            _link_or_copy(src, dst)
+            os.utime(dst)
+            self._bytes += dst.stat().st_size
+            over = self._bytes > self.max_bytes
+        if over:
+            self.prune()
+
+    def stats(self) -> dict[str, Any]:
+        entries = self.entries()
+        mtimes = [st.st_mtime for _, st in entries]
+        return {
+            "root": str(self.root),
+            "entries": len(entries),
+            "bytes": sum(st.st_size for _, st in entries),
+            "oldest_use": min(mtimes) if mtimes else None,
+            "newest_use": max(mtimes) if mtimes else None,
+        }
+
+    def prune(self, max_bytes: int | None = None) -> tuple[int, int]:
+        """
+        Evict least-recently-used entries until the store fits. Returns (removed, bytes_freed).
+        """
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        with self._lock:
+            entries = sorted(self.entries(), key=lambda e: e[1].st_mtime)
+            total = sum(st.st_size for _, st in entries)
+            removed = freed = 0
+            for p, st in entries:
+                if total <= limit:
+                    break
+                try:
+                    p.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= st.st_size
+                freed += st.st_size
+                removed += 1
+            self._bytes = total
+            return removed, freed
+
+
+_PACK_MIMES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp"}
+
+
+class ImagePack:
+    """
+    A run's images in one file: a ZIP whose members are all STORED, so every image is one
+    contiguous byte range, with manifest.json as the last member. The manifest lists each
+    member's item name, slide number, format, dimensions, sha256 and data offset, and the
+    archive comment `imgpack manifest=<offset>,<length>` points at the manifest itself: a
+    reader seeks to the tail, then to the manifest, then to the one image it wants, with
+    no zip library and without unpacking the rest. Any unzip tool still opens it.
+    """
+
+    manifest_name = "manifest.json"
+
+    def __init__(self, path: Path, manifest: dict[str, Any]) -> None:
+        self.path = path
+        self.manifest = manifest
+
+    @property
+    def entries(self) -> list[dict[str, Any]]:
+        return list(self.manifest.get("images") or [])
+
+    @classmethod
+    def write(
+        cls, path: Path, images: list[tuple[PlanItem, Path, tuple[Path, ...]]], *, theme: str = ""
+    ) -> ImagePack:
+        """Pack each (item, main image, renditions) under its plan name; written atomically."""
+        import zipfile
+
+        entries: list[dict[str, Any]] = []
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        try:
+            with tmp.open("wb") as f, zipfile.ZipFile(f, "w", compression=zipfile.ZIP_STORED) as zf:
+                for item, main, extras in images:
+                    for src in (main, *extras):
+                        suffix = src.suffix.lower()
+                        # slide-05.png / slide-05.320x180.webp keep their names under the item's directory.
+                        member = f"{item.name.rsplit('/', 1)[0]}/{src.name}" if "/" in item.name else src.name
+                        data = src.read_bytes()
+                        zf.writestr(zipfile.ZipInfo(member, date_time=time.localtime(src.stat().st_mtime)[:6]), data)
+                        entry: dict[str, Any] = {
+                            "name": member,
+                            "item": item.name,
+                            "slide_number": item.slide_number,
+                            "format": suffix.lstrip(".").replace("jpg", "jpeg"),
+                            "mime": _PACK_MIMES.get(suffix, "application/octet-stream"),
+                            "offset": f.tell() - len(data),
+                            "bytes": len(data),
+                            "sha256": hashlib.sha256(data).hexdigest(),
+                        }
+                        entry.update(_image_dims(src))
+                        if src != main:
+                            entry["rendition"] = src.name[len(main.stem) + 1 :].rsplit(".", 1)[0]
+                        entries.append(entry)
+                manifest = {"version": 1, "theme": theme, "images": entries}
+                blob = json.dumps(manifest, ensure_ascii=False, indent=1).encode("utf-8")
+                zf.writestr(cls.manifest_name, blob)
+                zf.comment = f"imgpack manifest={f.tell() - len(blob)},{len(blob)}".encode("ascii")
+            os.replace(tmp, path)
+        finally:
+            tmp.unlink(missing_ok=True)
+        return cls(path, manifest)
+
+    @classmethod
+    def open(cls, path: Path) -> ImagePack:
+        """Read just the manifest: from the offset in the archive comment, else via zipfile."""
+        with path.open("rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - 1024))
+            m = re.search(rb"imgpack manifest=(\d+),(\d+)$", f.read())
+            if m:
+                f.seek(int(m.group(1)))
+                return cls(path, json.loads(f.read(int(m.group(2)))))
+        import zipfile
+
+        with zipfile.ZipFile(path) as zf:
+            return cls(path, json.loads(zf.read(cls.manifest_name)))
+
+    def read(self, entry: dict[str, Any], *, verify: bool = True) -> bytes:
+        with self.path.open("rb") as f:
+            f.seek(int(entry["offset"]))
+            data = f.read(int(entry["bytes"]))
+        if verify and hashlib.sha256(data).hexdigest() != entry["sha256"]:
+            raise RuntimeError(f"{self.path}: {entry['name']} does not match its manifest sha256")
+        return data
+
+
+def _image_dims(path: Path) -> dict[str, int]:
+    try:
+        from PIL import Image  # type: ignore
+
+        with Image.open(path) as im:
+            return {"width": im.width, "height": im.height}
+    except Exception:
+        return {}
+
+
+def _default_auth_mode() -> str:
+    return (
+        _pick_env("GEMINI_AUTH_MODE", "CHERRY_AUTH_MODE")
+        or ("both" if _pick_env("CHERRY_API_KEY") else "goog")
+    ).strip().lower()
+
+
+class GatewayCapabilities:
+    """
+    Small persisted record of what each gateway accepts, so later images and later runs skip
+    the fallback probing in fetch_image:
+
+      {"<base_url>": {"routes": {"<model>": {"endpoint", "model_path", "auth_mode", "ts"}},
+                      "models": [...], "models_ts": ...}}
+
+    Entries older than `ttl_s` are ignored (ttl_s <= 0 disables the cache).
+    """
+
+    def __init__(self, path: Path, *, ttl_s: float) -> None:
+        self.path = path
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._data: dict[str, Any] = {}
+        if ttl_s > 0 and path.exists():
+            try:
+                self._data = json.loads(path.read_text(encoding="utf-8"))
+            except Exception:
+                self._data = {}
+
+    def _fresh(self, ts: Any) -> bool:
+        return self.ttl_s > 0 and isinstance(ts, (int, float)) and time.time() - ts < self.ttl_s
+
+    def _save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(self._data, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def route(self, base: str, model: str) -> dict[str, Any] | None:
+        with self._lock:
+            r = ((self._data.get(base) or {}).get("routes") or {}).get(model)
+            return dict(r) if r and self._fresh(r.get("ts")) else None
+
+    def record_route(self, base: str, model: str, **fields: Any) -> None:
+        if self.ttl_s <= 0:
+            return
+        with self._lock:
+            routes = self._data.setdefault(base, {}).setdefault("routes", {})
+            current = routes.get(model) or {}
+            if self._fresh(current.get("ts")) and {k: v for k, v in current.items() if k != "ts"} == fields:
+                return
+            routes[model] = {**fields, "ts": time.time()}
+            self._save()
+
+    def models(self, base: str) -> list[str] | None:
+        with self._lock:
+            entry = self._data.get(base) or {}
+            return list(entry["models"]) if "models" in entry and self._fresh(entry.get("models_ts")) else None
+
+    def record_models(self, base: str, ids: list[str]) -> None:
+        if self.ttl_s <= 0:
+            return
+        with self._lock:
+            entry = self._data.setdefault(base, {})
+            entry["models"] = ids
+            entry["models_ts"] = time.time()
+            self._save()
+
+
+class CircuitOpenError(RuntimeError):
+    """A gateway's circuit breaker is open: calls fail fast instead of adding to the overload."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """The run's --deadline leaves no time for (another) gateway call."""
+
+
+def _check_deadline(deadline: float | None, what: str) -> None:
+    if deadline is not None and time.time() >= deadline:
+        raise DeadlineExceeded(f"Run deadline reached {what}")
+
+
+def _capped_timeout(timeout: float, deadline: float | None, what: str) -> float:
+    """`timeout` shortened to the time left before `deadline`; DeadlineExceeded when none is left."""
+    if deadline is None:
+        return timeout
+    left = deadline - time.time()
+    if left <= 0:
+        raise DeadlineExceeded(f"Run deadline reached before {what}")
+    return min(timeout, left)
+
+
+# 429/503 mean "slow down"; the rest of _RETRY_STATUSES are plain transient failures.
+_THROTTLE_STATUSES = (429, 503)
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class GatewayLimiter:
+    """
+    Send controller shared by every worker talking to one gateway.
+
+    - AIMD concurrency: at most `limit` generation calls in flight. The limit halves on
+      429/503 (at most once per round of in-flight calls) and grows by about one per round
+      of successes, back up to max_concurrency.
+    - Optional token bucket (rate_per_s, burst) for gateways with a published request rate.
+    - A Retry-After pauses every sender, not just the one that received it.
+    - Circuit breaker: breaker_threshold consecutive failures open the circuit for
+      breaker_cooldown_s (doubling per repeated trip); afterwards a single probe call decides
+      whether it closes again.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_concurrency: int = 1,
+        rate_per_s: float = 0.0,
+        burst: int = 0,
+        max_retries: int = 4,
+        backoff_base_s: float = 0.5,
+        backoff_max_s: float = 30.0,
+        breaker_threshold: int = 5,
+        breaker_cooldown_s: float = 30.0,
+    ) -> None:
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = float(self.max_concurrency)
+        self.rate_per_s = max(0.0, rate_per_s)
+        self.burst = max(1, burst or int(self.rate_per_s) or 1)
+        self.max_retries = max(0, max_retries)
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.breaker_threshold = max(1, breaker_threshold)
+        self.breaker_cooldown_s = breaker_cooldown_s
+        self.throttled = 0
+        self.trips = 0
+        self._cv = threading.Condition()
+        self._inflight = 0
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+        self._not_before = 0.0
+        self._last_decrease = 0.0
+        self._failures = 0
+        self._open_until = 0.0
+        self._probe: float | None = None
+
+    def _wait_s(self, now: float) -> float | None:
+        # None = wait for a release; > 0 = wait that long; 0 = go.
+        if now < self._not_before:
+            return self._not_before - now
+        if self._inflight >= max(1, int(self.limit)):
+            return None
+        if self.rate_per_s > 0:
+            self._tokens = min(float(self.burst), self._tokens + (now - self._refilled) * self.rate_per_s)
+            self._refilled = now
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rate_per_s
+        return 0.0
+
+    def acquire(self, *, deadline: float | None = None) -> float:
+        """
+        Block until a call may be sent; returns its ticket for record(). With a `deadline`
+        (epoch seconds) the wait ends there with DeadlineExceeded.
+        """
+        with self._cv:
+            while True:
+                _check_deadline(deadline, "while waiting for a gateway slot")
+                now = time.monotonic()
+                if self._open_until:
+                    if self._probe is not None:
+                        # Half-open: wait for the probe's verdict.
+                        self._cv.wait(None if deadline is None else max(0.0, deadline - time.time()))
+                        continue
+                    if now < self._open_until:
+                        raise CircuitOpenError(
+                            f"Gateway circuit open for another {self._open_until - now:.0f}s "
+                            f"after {self._failures} consecutive failures"
+                        )
+                wait = self._wait_s(now)
+                if wait is None or wait > 0:
+                    if deadline is not None:
+                        left = max(0.0, deadline - time.time())
+                        wait = left if wait is None else min(wait, left)
+                    self._cv.wait(wait)
+                    continue
+                if self._open_until:
+                    self._probe = now
+                if self.rate_per_s > 0:
+                    self._tokens -= 1
+                self._inflight += 1
+                return now
+
+    def release(self, ticket: float) -> None:
+        """Give back a slot taken by acquire() without sending anything."""
+        with self._cv:
+            self._inflight -= 1
+            if self._probe == ticket:
+                self._probe = None
+            self._cv.notify_all()
+
+    def record(self, ticket: float, status: int | None, retry_after: float | None = None) -> None:
+        """Release the slot taken by acquire(); status None means no response (connection error)."""
+        with self._cv:
+            now = time.monotonic()
+            self._inflight -= 1
+            failed = status is None or status in _RETRY_STATUSES
+            if status in _THROTTLE_STATUSES:
+                self.throttled += 1
+                if retry_after:
+                    self._not_before = max(self._not_before, now + retry_after)
+                # Calls sent before the last cut were already counted against the old limit.
+                if ticket >= self._last_decrease:
+                    self.limit = max(1.0, self.limit / 2)
+                    self._last_decrease = now
+            elif status is not None and status < 400:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+
+            was_probe = self._probe == ticket
+            if was_probe:
+                self._probe = None
+            if failed:
+                self._failures += 1
+                if was_probe or (not self._open_until and self._failures >= self.breaker_threshold):
+                    self.trips += 1
+                    cooldown = min(self.breaker_cooldown_s * 2 ** (self.trips - 1), self.breaker_cooldown_s * 10)
+                    self._open_until = now + cooldown
+            else:
+                self._failures = 0
+                self._open_until = 0.0
+            self._cv.notify_all()
+
+    def has_capacity(self) -> bool:
+        """True when acquire() would not wait: circuit closed, no Retry-After pause, a free slot and token."""
+        with self._cv:
+            return not self._open_until and self._wait_s(time.monotonic()) == 0.0
+
+    def available(self) -> bool:
+        """False while the circuit is open (or half-open with its probe still in flight)."""
+        with self._cv:
+            return not self._open_until or (self._probe is None and time.monotonic() >= self._open_until)
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    def backoff_s(self, attempt: int, retry_after: float | None) -> float:
+        # Equal jitter: half the exponential step plus a random half, so workers spread out.
+        step = min(self.backoff_max_s, self.backoff_base_s * 2**attempt)
+        return max(retry_after or 0.0, step / 2 + random.uniform(0, step / 2))
+
+    def summary(self) -> str:
+        return (
+            f"Gateway throttled {self.throttled} call(s); concurrency limit ended at "
+            f"{self.limit:.1f}/{self.max_concurrency}; circuit breaker trips: {self.trips}"
+        )
+
+
+def _send_with_retries(
+    limiter: GatewayLimiter,
+    metrics: ItemMetrics,
+    http: Any,
+    method: str,
+    url: str,
+    *,
+    deadline: float | None = None,
+    **kwargs: Any,
+) -> requests.Response:
+    """
+    One gateway call under `limiter`: retries 429/5xx and connection errors with jittered
+    backoff (never sooner than Retry-After) and returns the final response, which may still
+    be an error status once retries are exhausted. With a `deadline` (epoch seconds) each
+    attempt's timeout shrinks to the time left, and no retry starts that could not finish.
+    """
+    import requests
+
+    attempt = 0
+    timeout = kwargs.pop("timeout", 120)
+    while True:
+        ticket = limiter.acquire(deadline=deadline)
+        try:
+            kwargs["timeout"] = _capped_timeout(timeout, deadline, f"{method} {url}")
+        except DeadlineExceeded:
+            limiter.release(ticket)
+            raise
+        r: requests.Response | None = None
+        retry_after: float | None = None
+        try:
+            r = metrics.request(http, method, url, **kwargs)
+            retry_after = _retry_after_s(r)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt >= limiter.max_retries:
+                raise
+            if deadline is not None and time.time() >= deadline:
+                raise DeadlineExceeded(f"Run deadline reached during {method} {url}") from None
+        finally:
+            limiter.record(ticket, r.status_code if r is not None else None, retry_after)
+
+        pause = limiter.backoff_s(attempt, retry_after)
+        if r is not None:
+            if r.status_code not in _RETRY_STATUSES:
+                return r
+            # A Retry-After longer than our backoff cap means "not today": report it instead.
+            if attempt >= limiter.max_retries or (retry_after or 0.0) > limiter.backoff_max_s:
+                return r
+            if deadline is not None and time.time() + pause >= deadline:
+                return r
+            # Drain the (small) error body so the keep-alive connection goes back to the pool.
+            _ = r.content
+            r.close()
+        elif deadline is not None and time.time() + pause >= deadline:
+            raise DeadlineExceeded(f"Run deadline leaves no time to retry {method} {url}")
+        metrics.retries += 1
+        time.sleep(pause)
+        attempt += 1
+
+
+def fetch_model_ids(http: Any, base: str, api_key: str, auth_mode: str, *, timeout_s: float) -> tuple[list[str], Any]:
+    """GET /v1/models; returns (model ids, raw JSON). Raises RuntimeError on HTTP errors."""
+    r = http.get(f"{base}/v1/models", headers=_gemini_auth_headers(api_key, auth_mode), timeout=timeout_s)
+    if r.status_code >= 400:
+        snippet = (r.text or "")[:2000]
+        raise RuntimeError(f"HTTP {r.status_code} GET {base}/v1/models: {snippet}")
+    data = r.json()
+
+    ids = []
+    if isinstance(data, dict) and isinstance(data.get("data"), list):
+        for item in data["data"]:
+            if isinstance(item, dict) and item.get("id"):
+                ids.append(str(item["id"]))
+    elif isinstance(data, dict) and isinstance(data.get("models"), list):
+        for item in data["models"]:
+            if isinstance(item, dict) and item.get("name"):
+                ids.append(str(item["name"]))
+    return ids, data
+
+
+@dataclass(frozen=True)
+class Gateway:
+    name: str
+    base_url: str
+    api_key: str
+    model: str
+    auth_mode: str | None = None  # None = GEMINI_AUTH_MODE / probing
+    max_concurrency: int = 0  # 0 = --concurrency
+
+
+def load_gateways(
+    config_path: str | None, *, default_model: str, base_url: str | None = None, api_key: str | None = None
+) -> list[Gateway]:
+    """
+    Gateways to spread a run over, from (first match wins):
+
+    - --base-url/--key on the command line: that single gateway;
+    - a JSON file (--gateways or CHERRY_GATEWAYS_FILE):
+        {"gateways": [{"name", "base_url", "key" | "key_env", "model", "auth_mode", "max_concurrency"}]}
+    - CHERRY_GATEWAYS=a,b in the environment/.env, with CHERRY_GATEWAY_<NAME>_BASE_URL, _KEY,
+      _MODEL, _AUTH_MODE and _MAX_CONCURRENCY per name;
+    - the single CHERRY_BASE_URL/GEMINI_BASE_URL + key pair.
+    """
+    entries: list[dict[str, Any]] = []
+    path = config_path or _pick_env("CHERRY_GATEWAYS_FILE")
+    names = _pick_env("CHERRY_GATEWAYS")
+    if base_url or api_key or not (path or names):
+        entries.append(
+            {
+                "name": "default",
+                "base_url": base_url or _pick_env("CHERRY_BASE_URL", "GEMINI_BASE_URL"),
+                "key": api_key or _pick_env("CHERRY_API_KEY", "GEMINI_API_KEY"),
+            }
+        )
+    elif path:
+        raw = json.loads(Path(path).read_text(encoding="utf-8"))
+        entries = raw.get("gateways") if isinstance(raw, dict) else raw
+        if not isinstance(entries, list):
+            raise SystemExit(f"{path}: expected a list of gateways")
+    elif names:
+        for name in [n.strip() for n in names.split(",") if n.strip()]:
+            prefix = f"CHERRY_GATEWAY_{re.sub(r'[^A-Za-z0-9]', '_', name).upper()}_"
+            entries.append(
+                {
+                    "name": name,
+                    "base_url": _pick_env(prefix + "BASE_URL"),
+                    "key": _pick_env(prefix + "KEY", prefix + "API_KEY"),
+                    "model": _pick_env(prefix + "MODEL"),
+                    "auth_mode": _pick_env(prefix + "AUTH_MODE"),
+                    "max_concurrency": _pick_env(prefix + "MAX_CONCURRENCY"),
+                }
+            )
+
+    gateways: list[Gateway] = []
+    for i, e in enumerate(entries, start=1):
+        name = str(e.get("name") or f"gateway-{i}")
+        key = str(e.get("key") or (_pick_env(str(e["key_env"])) if e.get("key_env") else ""))
+        if not e.get("base_url"):
+            if name == "default":
+                raise SystemExit("Missing CHERRY_BASE_URL/GEMINI_BASE_URL (set in .env or pass --base-url)")
+            raise SystemExit(f"Gateway {name}: missing base URL")
+        if not key:
+            if name == "default":
+                raise SystemExit("Missing CHERRY_API_KEY/GEMINI_API_KEY (set in .env or pass --key)")
+            raise SystemExit(f"Gateway {name}: missing API key (key or key_env)")
+        gateways.append(
+            Gateway(
+                name=name,
+                base_url=_normalize_base_url(str(e["base_url"])),
+                api_key=key,
+                model=str(e.get("model") or default_model),
+                auth_mode=str(e["auth_mode"]).strip().lower() if e.get("auth_mode") else None,
+                max_concurrency=int(e.get("max_concurrency") or 0),
+            )
+        )
+    return gateways
+
+
+@dataclass
+class _GatewayState:
+    gateway: Gateway
+    limiter: GatewayLimiter
+    latency_s: float | None = None  # EWMA of successful call times
+    error_rate: float = 0.0  # EWMA of failures
+    inflight: int = 0
+    calls: int = 0
+    failures: int = 0
+    disabled: str = ""  # why an active check took it out of the run
+
+
+class GatewayRouter:
+    """
+    Spreads image calls over several gateways.
+
+    Each call goes to a weighted-random gateway among those still healthy, weighted by
+    1 / cost with cost = latency EWMA x (1 + in-flight share) / (1 - error EWMA): fast, idle,
+    reliable gateways get most of the traffic while the others keep getting enough to be
+    re-measured. Passive health checking is each gateway's own GatewayLimiter circuit
+    breaker; check() adds an active /v1/models probe. A call that fails on one gateway is
+    retried on the next until every healthy gateway has been tried.
+    """
+
+    EWMA_ALPHA = 0.3
+
+    def __init__(self, gateways: list[Gateway], *, make_limiter: Any) -> None:
+        self.states = [_GatewayState(g, make_limiter(g)) for g in gateways]
+        self._lock = threading.Lock()
+
+    def check(self, http: Any, *, timeout_s: float = 15.0) -> None:
+        """Active health check: drop gateways whose /v1/models fails or does not list their model."""
+
+        def probe(st: _GatewayState) -> None:
+            g = st.gateway
+            try:
+                ids, _ = fetch_model_ids(http, g.base_url, g.api_key, g.auth_mode or _default_auth_mode(), timeout_s=timeout_s)
+            except Exception as e:
+                st.disabled = f"health check failed: {str(e)[:200]}"
+                return
+            wanted = g.model.split("/")[-1]
+            if ids and not any(i.split("/")[-1] == wanted for i in ids):
+                st.disabled = f"model {g.model} not listed"
+
+        with ThreadPoolExecutor(max_workers=len(self.states)) as ex:
+            list(ex.map(probe, self.states))
+        for st in self.states:
+            if st.disabled:
+                print(f"[gateway] {st.gateway.name} excluded: {st.disabled}")
+        if all(st.disabled for st in self.states):
+            raise SystemExit("No gateway passed the health check")
+
+    def pick(self, exclude: set[str], *, free_only: bool = False) -> _GatewayState | None:
+        """Weighted-random healthy gateway; with free_only, only one that can send right away."""
+        with self._lock:
+            candidates = [
+                st
+                for st in self.states
+                if st.gateway.name not in exclude
+                and not st.disabled
+                and (st.limiter.has_capacity() if free_only else st.limiter.available())
+            ]
+            if not candidates:
+                return None
+            known = [st.latency_s for st in candidates if st.latency_s is not None]
+            # Unmeasured gateways are assumed as fast as the fastest known one, so they get tried.
+            default_latency = min(known) if known else 1.0
+            weights = []
+            for st in candidates:
+                latency = st.latency_s if st.latency_s is not None else default_latency
+                load = 1 + st.inflight / st.limiter.max_concurrency
+                weights.append(1 / (max(latency, 0.01) * load / max(0.05, 1 - st.error_rate)))
+            st = random.choices(candidates, weights=weights)[0]
+            st.inflight += 1
+            st.calls += 1
+            return st
+
+    def release(self, st: _GatewayState) -> None:
+        """Give back the in-flight count taken by pick() for a call cut short by our own deadline."""
+        with self._lock:
+            st.inflight -= 1
+
+    def record(self, st: _GatewayState, elapsed_s: float, *, ok: bool) -> None:
+        a = self.EWMA_ALPHA
+        with self._lock:
+            st.inflight -= 1
+            st.error_rate = (1 - a) * st.error_rate + a * (0.0 if ok else 1.0)
+            if ok:
+                st.latency_s = elapsed_s if st.latency_s is None else (1 - a) * st.latency_s + a * elapsed_s
+            else:
+                st.failures += 1
+
+    def fetch(
+        self, *, tried: set[str] | None = None, free_only: bool = False, **fetch_kwargs: Any
+    ) -> tuple[FetchedImage | Future[FetchedImage], Gateway]:
+        """
+        fetch_image() on the best available gateway, failing over to the others. Gateway names
+        in `tried` are skipped; the set is updated as gateways are picked. With free_only, only
+        gateways with a free slot are used and CircuitOpenError means nothing was sent.
+        """
+        tried = set() if tried is None else tried
+        errors: list[str] = []
+        while True:
+            st = self.pick(tried, free_only=free_only)
+            if st is None:
+                if not errors:
+                    raise CircuitOpenError(
+                        "No gateway with a free slot"
+                        if free_only
+                        else "No healthy gateway available (all circuits open)"
+                    )
+                raise RuntimeError("; ".join(errors))
+            g = st.gateway
+            tried.add(g.name)
+            started = time.time()
+            try:
+                out = fetch_image(
+                    base_url=g.base_url,
+                    api_key=g.api_key,
+                    model=g.model,
+                    auth_mode=g.auth_mode,
+                    limiter=st.limiter,
+                    **fetch_kwargs,
+                )
+            except DeadlineExceeded:
+                self.release(st)
+                raise
+            except Exception as e:
+                self.record(st, time.time() - started, ok=False)
+                errors.append(f"[{g.name}] {e}" if len(self.states) > 1 else str(e))
+                if len(self.states) == 1:
+                    raise
+                continue
+            if isinstance(out, Future):
+                out.add_done_callback(lambda f, st=st: self._settle(st, started, f.exception()))
+            else:
+                self.record(st, time.time() - started, ok=True)
+            return out, g
+
+    def _settle(self, st: _GatewayState, started: float, error: BaseException | None) -> None:
+        if isinstance(error, DeadlineExceeded):
+            self.release(st)
+        else:
+            self.record(st, time.time() - started, ok=error is None)
+
+    def summary(self) -> str:
+        lines = []
+        for st in self.states:
+            lat = f"{st.latency_s:.2f}s" if st.latency_s is not None else "-"
+            lines.append(
+                f"[gateway] {st.gateway.name}: {st.calls} calls, {st.failures} failed, latency~{lat}; "
+                + st.limiter.summary()
+            )
+        return "\n".join(lines)
+
+
+@dataclass
+class _Race:
+    future: Future[tuple[FetchedImage, Gateway]]
+    tried: set[str]
+    pending: int = 1
+    settled: bool = False
+    error: BaseException | None = None  # the primary's failure; a failed or skipped hedge never masks it
+
+
+class Hedger:
+    """
+    Hedged fetches: when an image has not arrived after the `percentile` latency of recent
+    fetches (or `initial_after_s` until `min_samples` have been seen), a duplicate request goes
+    to another gateway (the same one when there is only one) and the first valid image wins.
+    A hedge is only sent to a gateway with a free slot right now: queued behind the primary
+    on the same limiter and connection pool it would only add a paid call and latency, so it
+    is skipped instead. The loser cannot be cancelled mid-flight; its image is deleted when
+    it lands. At most `budget` duplicates are sent per run, counted when actually sent.
+    """
+
+    def __init__(
+        self,
+        router: GatewayRouter,
+        *,
+        percentile: float,
+        budget: int,
+        workers: int,
+        initial_after_s: float | None = None,
+        min_samples: int = 5,
+    ) -> None:
+        import collections
+
+        self.router = router
+        self.percentile = percentile
+        self.budget = budget
+        self.initial_after_s = initial_after_s
+        self.min_samples = min_samples
+        self.spent = 0
+        self.wins = 0
+        self.skipped = 0
+        self._samples: collections.deque[float] = collections.deque(maxlen=200)
+        self._lock = threading.Lock()
+        # Separate pools so a hedge never queues behind the primaries it is meant to overtake.
+        self._primary = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="fetch")
+        self._hedges = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="hedge")
+
+    def __enter__(self) -> Hedger:
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        # Every race is settled by now; don't hold up the run for losers still in flight.
+        self._primary.shutdown(wait=False, cancel_futures=True)
+        self._hedges.shutdown(wait=False, cancel_futures=True)
+
+    def threshold_s(self) -> float | None:
+        with self._lock:
+            if len(self._samples) >= self.min_samples:
+                return _percentile(list(self._samples), self.percentile / 100)
+        return self.initial_after_s
+
+    def fetch(self, **fetch_kwargs: Any) -> Future[tuple[FetchedImage, Gateway]]:
+        race = _Race(Future(), set())
+        self._start(race, self._primary, fetch_kwargs, hedge=False)
+        return race.future
+
+    def _arm(self, race: _Race, fetch_kwargs: dict[str, Any]) -> None:
+        # Armed when the primary actually starts, so time spent queued never triggers a hedge.
+        after = self.threshold_s()
+        if after is None or self.spent >= self.budget:
+            return
+        timer = threading.Timer(after, self._hedge, args=(race, fetch_kwargs))
+        timer.daemon = True
+        timer.start()
+        race.future.add_done_callback(lambda _: timer.cancel())
+
+    def _hedge(self, race: _Race, fetch_kwargs: dict[str, Any]) -> None:
+        with self._lock:
+            if race.settled or self.spent >= self.budget:
+                return
+            race.pending += 1
+        try:
+            self._start(race, self._hedges, fetch_kwargs, hedge=True)
+        except RuntimeError:
+            # Shutting down: the primary settles the race on its own.
+            with self._lock:
+                race.pending -= 1
+
+    def _start(self, race: _Race, pool: ThreadPoolExecutor, fetch_kwargs: dict[str, Any], *, hedge: bool) -> None:
+        started = time.time()  # reset when the attempt leaves the queue
+        if not hedge:
+            tried = race.tried
+        elif len(self.router.states) > 1:
+            # A hedge avoids the primary's gateway unless there is no other healthy one.
+            tried = set(race.tried)
+        else:
+            tried = set()
+
+        def submitted(f: Future[Any]) -> None:
+            try:
+                fetched, gateway = f.result()
+            except BaseException as e:
+                self._settle(race, None, e, started, hedge)
+                return
+            if isinstance(fetched, Future):
+                fetched.add_done_callback(
+                    lambda g: self._settle(
+                        race, None if g.exception() else (g.result(), gateway), g.exception(), started, hedge
+                    )
+                )
+            else:
+                self._settle(race, (fetched, gateway), None, started, hedge)
+
+        def run() -> tuple[FetchedImage | Future[FetchedImage], Gateway]:
+            nonlocal started
+            started = time.time()
+            if not hedge:
+                self._arm(race, fetch_kwargs)
+                return self.router.fetch(tried=tried, **fetch_kwargs)
+            with self._lock:
+                if race.settled or self.spent >= self.budget:
+                    raise CircuitOpenError("hedge no longer needed")
+                self.spent += 1  # reserved now, refunded below if nothing is sent
+            try:
+                try:
+                    return self.router.fetch(tried=tried, free_only=True, **fetch_kwargs)
+                except CircuitOpenError:
+                    if not tried:
+                        raise
+                    # Every other gateway is out or busy: the primary's, if it has a free slot.
+                    return self.router.fetch(free_only=True, **fetch_kwargs)
+            except CircuitOpenError:
+                with self._lock:
+                    self.spent -= 1
+                    self.skipped += 1
+                raise
+
+        pool.submit(run).add_done_callback(submitted)
+
+    def _settle(
+        self,
+        race: _Race,
+        result: tuple[FetchedImage, Gateway] | None,
+        error: BaseException | None,
+        started: float,
+        hedge: bool,
+    ) -> None:
+        with self._lock:
+            race.pending -= 1
+            if error is not None and race.error is None and not hedge:
+                race.error = error
+            if result is not None:
+                self._samples.append(time.time() - started)
+                if race.settled:
+                    # Lost the race: drop the duplicate image.
+                    result[0].discard()
+                    return
+                if hedge:
+                    self.wins += 1
+            elif race.settled or race.pending > 0:
+                # The other attempt may still deliver.
+                return
+            race.settled = True
+        if result is not None:
+            race.future.set_result(result)
+        else:
+            race.future.set_exception(race.error or error or RuntimeError("hedged fetch failed"))
+
+    def summary(self) -> str:
+        return (
+            f"Hedging: {self.spent}/{self.budget} duplicate call(s) sent, {self.wins} won the race, "
+            f"{self.skipped} skipped (no gateway with a free slot)"
+        )
+
+
+class _NativeUnsupported(RuntimeError):
+    """Every Gemini-native model path answered 404/405: the gateway only has the OpenAI-like route."""
+
+
+def _gemini_model_paths(model: str, preferred: str | None) -> list[str]:
+    model_path = _normalize_gemini_model_path(model)
+    paths = [preferred] if preferred else []
+    paths.append(model_path)
+    if model_path.startswith("google/"):
+        paths.append(model_path[len("google/") :])
+    else:
+        paths.append(f"google/{model_path}")
+    # Deduplicate while preserving order
+    seen: set[str] = set()
+    return [p for p in paths if not (p in seen or seen.add(p))]
+
+
+@dataclass(frozen=True)
+class FetchedImage:
+    """Raw gateway output in a temp file next to the output, before PNG conversion/resize."""
+
+    path: Path
+    mime: str
+    # The OpenAI-like route historically stores the gateway's bytes as-is.
+    convert: bool = True
+    # Further candidates from the same call (fetch_image(candidates=N)); see pick_candidate.
+    alternates: tuple[FetchedImage, ...] = ()
+
+    def discard(self) -> None:
+        for f in (self, *self.alternates):
+            f.path.unlink(missing_ok=True)
+
+
+def finalize_image_timed(
+    fetched: FetchedImage,
+    out_path: Path,
+    *,
+    out_width: int,
+    out_height: int,
+    no_resize: bool,
+    png_compress_level: int = 6,
+    png_optimize: bool = False,
+    out_format: str = "png",
+    quality: int = 82,
+    renditions: tuple[Rendition, ...] = (),
+) -> tuple[Path, dict[str, float], list[Path]]:
+    """
+    CPU half of the pipeline: decode, resize, encode and move into place. Top-level and
+    argument-picklable so it can run in a process pool. Returns the main image's path, its
+    stage timings (they cannot be shared across processes) and the extra rendition paths
+    written alongside it.
+    """
+    timings: dict[str, float] = {}
+    main = Rendition(out_width, out_height, out_format, quality)
+    try:
+        # Raw OpenAI-route bytes are kept as-is unless another format or size was asked for.
+        if fetched.convert or renditions or out_format != "png":
+            written = out_path.with_suffix(main.ext)
+            targets = [(written, main, not no_resize)] + [(r.path_for(written), r, True) for r in renditions]
+            if _save_renditions(
+                fetched.path,
+                fetched.mime,
+                targets,
+                compress_level=png_compress_level,
+                optimize=png_optimize,
+                timings=timings,
+            ):
+                return written, timings, [dst for dst, _, _ in targets[1:]]
+            written = out_path.with_suffix(_mime_to_ext(fetched.mime))
+        else:
+            written = out_path
+        t0 = time.perf_counter()
+        os.replace(fetched.path, written)
+        timings["write"] = time.perf_counter() - t0
+        return written, timings, []
+    finally:
+        fetched.path.unlink(missing_ok=True)
+
+
+def fetch_image(
+    *,
+    base_url: str,
+    api_key: str,
+    model: str,
+    prompt: str,
+    size: str,
+    resolution: str,
+    tmp_dir: Path,
+    poll_interval_s: float,
+    timeout_s: float,
+    poll_max_interval_s: float = 8.0,
+    session: requests.Session | None = None,
+    download_session: requests.Session | None = None,
+    capabilities: GatewayCapabilities | None = None,
+    limiter: GatewayLimiter | None = None,
+    auth_mode: str | None = None,
+    poller: TaskPoller | None = None,
+    metrics: ItemMetrics | None = None,
+    deadline: float | None = None,
+    candidates: int = 1,
+) -> FetchedImage | Future[FetchedImage]:
+    """
+    Network half of an item: ask the gateway for one image and leave the raw bytes in a
+    temp file under `tmp_dir`. With a `poller`, task-based gateways return right after
+    submission with a Future that resolves once the task is done and downloaded. `deadline`
+    (epoch seconds) bounds every request, retry and task poll. `candidates` > 1 asks for
+    that many images in the same call (candidateCount / n); whatever else comes back is in
+    the result's `alternates`. Image URLs are fetched over `download_session` (default:
+    `session`), so ranged downloads never wait for connections held by gateway calls.
+    """
+    base = _normalize_base_url(base_url)
+    metrics = metrics or ItemMetrics("")
+    limiter = limiter or GatewayLimiter()
+    route = (capabilities.route(base, model) if capabilities else None) or {}
+    auth_mode = str(route.get("auth_mode") or auth_mode or _default_auth_mode())
+
+    # Prefer Gemini-native generateContent for Gemini models (works on proxies that mirror Google paths).
+    native_err: Exception | None = None
+    if _is_gemini_model(model) and route.get("endpoint") != "openai":
+        try:
+            return _generate_native(
+                session=session,
+                base=base,
+                api_key=api_key,
+                model=model,
+                prompt=prompt,
+                size=size,
+                resolution=resolution,
+                tmp_dir=tmp_dir,
+                auth_mode=auth_mode,
+                preferred_path=route.get("model_path"),
+                capabilities=capabilities,
+                limiter=limiter,
+                metrics=metrics,
+                deadline=deadline,
+                candidates=candidates,
+            )
+        except _NativeUnsupported as e:
+            native_err = e
+
+    try:
+        submitted = _submit_openai(
+            session=session,
+            download_session=download_session,
+            base=base,
+            api_key=api_key,
+            model=model,
+            prompt=prompt,
+            tmp_dir=tmp_dir,
+            capabilities=capabilities,
+            limiter=limiter,
+            metrics=metrics,
+            deadline=deadline,
+            candidates=candidates,
+        )
+    except Exception as e:
+        if native_err is not None:
+            raise RuntimeError(f"{e} (after Gemini-native route was rejected: {native_err})") from e
+        raise
+    if isinstance(submitted, FetchedImage):
+        return submitted
+    if poller is not None:
+        return poller.track(base, submitted, tmp_dir, api_key=api_key, metrics=metrics, deadline=deadline)
+    url = _poll_task_blocking(
+        session=session,
+        base=base,
+        api_key=api_key,
+        task_id=submitted,
+        poll_interval_s=poll_interval_s,
+        max_interval_s=poll_max_interval_s,
+        timeout_s=timeout_s,
+        metrics=metrics,
+        deadline=deadline,
+    )
+    return _download_fetched(url, tmp_dir, session=download_session or session, metrics=metrics, deadline=deadline)
+
+
+def _generate_native(
+    *,
+    session: requests.Session | None,
+    base: str,
+    api_key: str,
+    model: str,
+    prompt: str,
+    size: str,
+    resolution: str,
+    tmp_dir: Path,
+    auth_mode: str,
+    preferred_path: str | None,
+    capabilities: GatewayCapabilities | None,
+    limiter: GatewayLimiter,
+    metrics: ItemMetrics,
+    deadline: float | None = None,
+    candidates: int = 1,
+) -> FetchedImage:
+    import requests
+
+    http = session or requests
+    model_paths_to_try = _gemini_model_paths(model, preferred_path)
+    aspect_ratio = None
+    if isinstance(size, str) and re.fullmatch(r"\d+\s*:\s*\d+", size.strip()):
+        aspect_ratio = size.strip().replace(" ", "")
+    image_size = None
+    if isinstance(resolution, str) and resolution.strip().upper() in ("1K", "2K", "4K"):
+        image_size = resolution.strip().upper()
+
+    native_payload = _gemini_native_payload(prompt, aspect_ratio, image_size, candidates)
+
+    last_err: Exception | None = None
+    not_found = 0
+    for mp in model_paths_to_try:
+        native_url = f"{base}/v1beta/models/{mp}:generateContent"
+        # stream=True: 2K/4K responses are tens of MB of base64; decode them incrementally.
+        send_kwargs: dict[str, Any] = {"json": native_payload, "timeout": 120, "stream": True, "deadline": deadline}
+        r = _send_with_retries(
+            limiter, metrics, http, "POST", native_url, headers=_gemini_auth_headers(api_key, auth_mode), **send_kwargs
+        )
+        if r.status_code in (401, 403) and auth_mode != "both":
+            # Some gateways require Bearer auth; retry once with both (and remember it).
+            r.close()
+            metrics.retries += 1
+            r = _send_with_retries(
+                limiter, metrics, http, "POST", native_url, headers=_gemini_auth_headers(api_key, "both"), **send_kwargs
+            )
+            if r.status_code < 400:
+                auth_mode = "both"
+
+        if r.status_code < 400:
+            with r:
+                blobs = _stream_inline_images(r, tmp_dir, metrics, deadline=deadline)
+            if capabilities is not None:
+                capabilities.record_route(base, model, endpoint="native", model_path=mp, auth_mode=auth_mode)
+
+            if candidates > 1:
+                return FetchedImage(*blobs[0], alternates=tuple(FetchedImage(*b) for b in blobs[1:candidates]))
+            for extra, _ in blobs[1:]:
+                extra.unlink(missing_ok=True)
+            return FetchedImage(*blobs[0])
+
+        if r.status_code in (404, 405):
+            not_found += 1
+            last_err = RuntimeError(f"HTTP {r.status_code} POST {native_url}: {(r.text or '')[:800]}")
+            continue
+
+        if r.status_code == 400 and len(model_paths_to_try) > 1:
+            # Often means "wrong model path variant" on some gateways.
+            last_err = RuntimeError(f"HTTP {r.status_code} POST {native_url}: {(r.text or '')[:800]}")
+            metrics.retries += 1
+            continue
+
+        snippet = (r.text or "")[:2000]
+        raise RuntimeError(f"HTTP {r.status_code} POST {native_url}: {snippet}")
+
+    if not_found == len(model_paths_to_try):
+        raise _NativeUnsupported(str(last_err))
+    raise last_err or RuntimeError("Gemini request failed after retries")
+
+
+def _submit_openai(
+    *,
+    session: requests.Session | None,
+    base: str,
+    download_session: requests.Session | None = None,
+    api_key: str,
+    model: str,
+    prompt: str,
+    tmp_dir: Path,
+    capabilities: GatewayCapabilities | None,
+    limiter: GatewayLimiter | None = None,
+    metrics: ItemMetrics | None = None,
+    deadline: float | None = None,
+    candidates: int = 1,
+) -> FetchedImage | str:
+    """
+    POST to the OpenAI-like images endpoint (non-Gemini models, or gateways without the native
+    route). Returns the image when the gateway answers inline, or the task id to poll.
+    """
+    import requests
+
+    http = session or requests
+    metrics = metrics or ItemMetrics("")
+    url = f"{base}/v1/images/generations"
+    payload: dict[str, Any] = {"model": model, "prompt": prompt, "n": max(1, candidates), "response_format": "b64_json"}
+    r = _send_with_retries(
+        limiter or GatewayLimiter(),
+        metrics,
+        http,
+        "POST",
+        url,
+        headers=_openai_auth_headers(api_key),
+        json=payload,
+        timeout=120,
+        deadline=deadline,
+    )
+    if r.status_code >= 400:
+        snippet = (r.text or "")[:2000]
+        raise RuntimeError(f"HTTP {r.status_code} POST {url}: {snippet}")
+    with metrics.stage("download"):
+        body = r.content
+    with metrics.stage("json_parse"):
+        data = json.loads(body)
+    if capabilities is not None:
+        capabilities.record_route(base, model, endpoint="openai", model_path=model, auth_mode="bearer")
+
+    # Common patterns:
+    # 1) Task-based gateway: { data: { task_id, status } }
+    # 2) OpenAI-like: { data: [ { url } ] } or { data: [ { b64_json } ] }
+    # 3) Provider-specific variations.
+    if isinstance(data, dict) and isinstance(data.get("data"), dict) and (data["data"].get("task_id") or data["data"].get("id")):
+        return str(data["data"].get("task_id") or data["data"].get("id"))
+
+    if isinstance(data, dict) and isinstance(data.get("data"), list) and data["data"]:
+        item = data["data"][0]
+        if isinstance(item, dict) and (item.get("task_id") or item.get("id")):
+            return str(item.get("task_id") or item.get("id"))
+        fetched: list[FetchedImage] = []
+        try:
+            for item in data["data"][: max(1, candidates)]:
+                if isinstance(item, dict) and item.get("url"):
+                    fetched.append(
+                        _download_fetched(
+                            str(item["url"]),
+                            tmp_dir,
+                            session=download_session or session,
+                            metrics=metrics,
+                            deadline=deadline,
+                        )
+                    )
+                elif isinstance(item, dict) and item.get("b64_json"):
+                    import base64
+
+                    raw_path = _part_path(tmp_dir, "download")
+                    with metrics.stage("b64_decode"):
+                        raw = base64.b64decode(item["b64_json"])
+                    with metrics.stage("write"):
+                        raw_path.write_bytes(raw)
+                    fetched.append(FetchedImage(raw_path, "application/octet-stream", convert=False))
+        except BaseException:
+            for f in fetched:
+                f.discard()
+            raise
+        if fetched:
+            return dataclasses.replace(fetched[0], alternates=tuple(fetched[1:]))
+
+    raise RuntimeError(f"Unrecognized response shape: {data}")
+
+
+def _download_fetched(
+    url: str,
+    tmp_dir: Path,
+    *,
+    session: requests.Session | None,
+    metrics: ItemMetrics | None = None,
+    deadline: float | None = None,
+) -> FetchedImage:
+    raw_path = _part_path(tmp_dir, "download")
+    try:
+        _download_to(url, raw_path, api_key=None, session=session, metrics=metrics, deadline=deadline)
+    except BaseException:
+        raw_path.unlink(missing_ok=True)
+        raise
+    return FetchedImage(raw_path, "application/octet-stream", convert=False)
+
+
+def _retry_after_s(r: requests.Response) -> float | None:
+    value = (r.headers.get("retry-after") or "").strip()
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def _check_task(
+    http: Any,
+    base: str,
+    api_key: str,
+    task_id: str,
+    metrics: ItemMetrics | None = None,
+    deadline: float | None = None,
+) -> tuple[str, str | None, float | None]:
+    """
+    One status probe of a task-based gateway. Returns (state, image_url, retry_after_s) where
+    state is "done", "pending" or "throttled"; raises when the task has failed.
+    """
+    metrics = metrics or ItemMetrics("")
+    url = f"{base}/v1/tasks/{task_id}?language=en"
+    timeout = _capped_timeout(120, deadline, f"polling task {task_id}")
+    tr = metrics.request(http, "GET", url, headers=_openai_auth_headers(api_key), timeout=timeout)
+    retry_after = _retry_after_s(tr)
+    if tr.status_code in (429, 503):
+        tr.close()
+        return "throttled", None, retry_after
+    tr.raise_for_status()
+    td = tr.json()
+    status = (td.get("data") or {}).get("status")
+
+    if status in ("success", "succeeded", "completed"):
+        result = (td.get("data") or {}).get("result") or {}
+        images = result.get("images") or []
+        if not images:
+            raise RuntimeError(f"Task {task_id} success but result.images missing")
+
+        first = images[0]
+        urls = first.get("url") or first.get("urls") or []
+        if not urls:
+            raise RuntimeError(f"Task {task_id} success but url missing")
+        return "done", str(urls[0] if isinstance(urls, list) else urls), retry_after
+
+    if status in ("failed", "error", "canceled", "cancelled"):
+        raise RuntimeError(f"Task {task_id} failed: {td}")
+
+    return "pending", None, retry_after
+
+
+def _next_poll_delay(
+    delay: float, state: str, retry_after: float | None, *, backoff: float, max_interval_s: float
+) -> float:
+    # Fast at first, slower the longer a task runs; throttling doubles the step.
+    step = delay * (backoff * 2 if state == "throttled" else backoff)
+    return max(min(step, max_interval_s), retry_after or 0.0)
+
+
+def _poll_task_blocking(
+    *,
+    session: requests.Session | None,
+    base: str,
+    api_key: str,
+    task_id: str,
+    poll_interval_s: float,
+    max_interval_s: float,
+    timeout_s: float,
+    metrics: ItemMetrics | None = None,
+    deadline: float | None = None,
+) -> str:
+    import requests
+
+    http = session or requests
+    started = time.time()
+    delay = poll_interval_s
+    while True:
+        if time.time() - started > timeout_s:
+            raise TimeoutError(f"Task {task_id} timed out after {timeout_s}s")
+        state, url, retry_after = _check_task(http, base, api_key, task_id, metrics, deadline)
+        if state == "done" and url:
+            return url
+        pause = max(delay, retry_after or 0.0)
+        time.sleep(pause if deadline is None else max(0.0, min(pause, deadline - time.time())))
+        delay = _next_poll_delay(delay, state, retry_after, backoff=1.5, max_interval_s=max_interval_s)
+
+
+@dataclass
+class _TrackedTask:
+    base: str
+    task_id: str
+    tmp_dir: Path
+    future: Future[FetchedImage]
+    started: float
+    delay: float
+    metrics: ItemMetrics | None = None
+    api_key: str | None = None
+    deadline: float | None = None
+
+
+class TaskPoller:
+    """
+    Tracks every outstanding task id of a task-based gateway from a single thread.
+
+    Each task is polled on its own adaptive schedule (poll_interval_s, growing by `backoff` up
+    to max_interval_s, never sooner than a Retry-After) and downloaded on a small worker pool
+    as soon as it succeeds, so a batch takes about as long as its slowest task rather than
+    the sum of all of them.
+    """
+
+    def __init__(
+        self,
+        *,
+        session: requests.Session | None,
+        api_key: str,
+        timeout_s: float,
+        poll_interval_s: float,
+        max_interval_s: float,
+        backoff: float = 1.5,
+        download_workers: int = 4,
+        download_session: requests.Session | None = None,
+    ) -> None:
+        self.session = session
+        self.download_session = download_session or session
+        self.api_key = api_key
+        self.timeout_s = timeout_s
+        self.poll_interval_s = poll_interval_s
+        self.max_interval_s = max_interval_s
+        self.backoff = backoff
+        self._downloads = ThreadPoolExecutor(max_workers=max(1, download_workers))
+        self._cv = threading.Condition()
+        self._heap: list[tuple[float, int, _TrackedTask]] = []
+        self._seq = 0
+        self._stopped = False
+        self._thread: threading.Thread | None = None
+
+    def __enter__(self) -> TaskPoller:
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    def track(
+        self,
+        base: str,
+        task_id: str,
+        tmp_dir: Path,
+        *,
+        api_key: str | None = None,
+        metrics: ItemMetrics | None = None,
+        deadline: float | None = None,
+    ) -> Future[FetchedImage]:
+        fut: Future[FetchedImage] = Future()
+        now = time.time()
+        task = _TrackedTask(base, task_id, tmp_dir, fut, now, self.poll_interval_s, metrics, api_key, deadline)
+        with self._cv:
+            if self._stopped:
+                raise RuntimeError("TaskPoller is closed")
+            self._push(task, now + task.delay)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="task-poller", daemon=True)
+                self._thread.start()
+            self._cv.notify()
+        return fut
+
+    def close(self) -> None:
+        with self._cv:
+            self._stopped = True
+            pending, self._heap = self._heap, []
+            self._cv.notify()
+        if self._thread is not None:
+            self._thread.join()
+        for _, _, task in pending:
+            task.future.set_exception(RuntimeError(f"Task {task.task_id} abandoned (poller closed)"))
+        self._downloads.shutdown(wait=True)
+
+    def _push(self, task: _TrackedTask, due: float) -> None:
+        import heapq
+
+        self._seq += 1
+        heapq.heappush(self._heap, (due, self._seq, task))
+
+    def _run(self) -> None:
+        import heapq
+
+        while True:
+            with self._cv:
+                while not self._stopped and (not self._heap or self._heap[0][0] > time.time()):
+                    self._cv.wait(timeout=(self._heap[0][0] - time.time()) if self._heap else None)
+                if self._stopped:
+                    return
+                _, _, task = heapq.heappop(self._heap)
+            self._poll(task)
+
+    def _poll(self, task: _TrackedTask) -> None:
+        import requests
+
+        if time.time() - task.started > self.timeout_s:
+            task.future.set_exception(TimeoutError(f"Task {task.task_id} timed out after {self.timeout_s}s"))
+            return
+        if task.deadline is not None and time.time() >= task.deadline:
+            task.future.set_exception(DeadlineExceeded(f"Run deadline reached while task {task.task_id} was running"))
             return
-        if isinstance(item, dict) and item.get("url"):
-            _download_to(str(item["url"]), out_path, api_key=None)
+        try:
+            state, url, retry_after = _check_task(
+                self.session or requests,
+                task.base,
+                task.api_key or self.api_key,
+                task.task_id,
+                task.metrics,
+                task.deadline,
+            )
+        except Exception as e:
+            task.future.set_exception(e)
             return
-        if isinstance(item, dict) and item.get("b64_json"):
-            import base64
 
-            out_path.parent.mkdir(parents=True, exist_ok=True)
-            out_path.write_bytes(base64.b64decode(item["b64_json"]))
+        if state == "done" and url:
+            self._downloads.submit(self._download, task, url)
             return
+        due = time.time() + max(task.delay, retry_after or 0.0)
+        if task.deadline is not None:
+            # One last look right at the deadline rather than a poll scheduled past it.
+            due = min(due, task.deadline)
+        task.delay = _next_poll_delay(
+            task.delay, state, retry_after, backoff=self.backoff, max_interval_s=self.max_interval_s
+        )
+        with self._cv:
+            if not self._stopped:
+                self._push(task, due)
+                return
+        task.future.set_exception(RuntimeError(f"Task {task.task_id} abandoned (poller closed)"))
 
-    raise RuntimeError(f"Unrecognized response shape: {data}")
+    def _download(self, task: _TrackedTask, url: str) -> None:
+        try:
+            task.future.set_result(
+                _download_fetched(
+                    url, task.tmp_dir, session=self.download_session, metrics=task.metrics, deadline=task.deadline
+                )
+            )
+        except BaseException as e:
+            task.future.set_exception(e)
+
+
+class ImagePipeline:
+    """
+    Everything that turns plan items into images, shared by every item submitted to it: one
+    HTTP connection pool, the gateway router with its limiters, the cache, the task poller,
+    the convert process pool, the optional hedger and the worker threads.
+
+    `generate` runs one plan through it; `serve` keeps one open and feeds it jobs from many
+    clients. Identical in-flight requests (same cache key) share a single gateway call.
+    """
+
+    def __init__(
+        self,
+        gateways: list[Gateway],
+        *,
+        concurrency: int,
+        pool_size: int = 0,
+        pool_hosts: int = 4,
+        cache: ImageCache | None,
+        capabilities: GatewayCapabilities,
+        limiter_kwargs: dict[str, Any],
+        finalize_kwargs: dict[str, Any],
+        convert_workers: int,
+        timeout_s: float,
+        poll_interval_s: float,
+        poll_max_interval_s: float,
+        hedge_kwargs: dict[str, Any] | None = None,
+        keep_done: bool = True,
+        resolution_policy: str = "plan",
+        deadline: float | None = None,
+        candidates: int = 1,
+    ) -> None:
+        self.gateways = gateways
+        # The first gateway's model names the cache entries; the others serve the same images.
+        self.model = gateways[0].model
+        self.gateway_models = {g.name: g.model for g in gateways}
+        self.concurrency = max(1, concurrency)
+        self.cache = cache
+        self.capabilities = capabilities
+        self.finalize_kwargs = finalize_kwargs
+        self.convert_workers = convert_workers
+        self.timeout_s = timeout_s
+        self.poll_interval_s = poll_interval_s
+        self.poll_max_interval_s = poll_max_interval_s
+        # One pool for the whole run; default to one warm connection per worker.
+        self.session = make_http_session(pool_size=int(pool_size or self.concurrency), pool_hosts=pool_hosts)
+        # Downloads get their own pool with room for every worker's ranges at once: on the
+        # generation pool (one connection per worker, blocking) the ranges of one file would
+        # queue behind each other, or behind other workers' gateway calls.
+        self.download_session = make_http_session(pool_size=self.concurrency * _DOWNLOAD_PARTS, pool_hosts=pool_hosts)
+        # Status GETs come from the poller's single thread; on the generation pool they would
+        # wait behind long generation calls holding every connection.
+        self.poll_session = make_http_session(pool_size=2, pool_hosts=pool_hosts)
+        # One limiter per gateway, shared by all workers: they back off together on 429/503
+        # instead of each retrying blindly.
+        self.router = GatewayRouter(
+            gateways,
+            make_limiter=lambda g: GatewayLimiter(max_concurrency=g.max_concurrency or self.concurrency, **limiter_kwargs),
+        )
+        self.poller = TaskPoller(
+            session=self.poll_session,
+            download_session=self.download_session,
+            api_key=gateways[0].api_key,
+            timeout_s=timeout_s,
+            poll_interval_s=poll_interval_s,
+            max_interval_s=poll_max_interval_s,
+            download_workers=self.concurrency,
+        )
+        self.hedger = Hedger(self.router, workers=self.concurrency, **hedge_kwargs) if hedge_kwargs else None
+        # generate keeps finished entries so a later duplicate in the same plan is a copy even
+        # with --no-cache; a long-running server forgets them and relies on the cache instead.
+        self._keep_done = keep_done
+        # "auto": ask the gateway for the smallest imageSize covering the outputs (see fit_resolution).
+        self.resolution_policy = resolution_policy
+        self._refits: dict[tuple[str, str], int] = {}
+        self._saved_bytes = 0
+        # Epoch seconds after which no gateway call is started (generate --deadline).
+        self.deadline = deadline
+        # Images per gateway call for items that do not say; the best-scoring one is kept.
+        self.candidates = max(1, candidates)
+        self._accepting = True
+        self._inflight: dict[str, tuple[Future[ItemResult], Path]] = {}
+        # Outputs given up on (a deadline placeholder stands there): late results never land on them.
+        self._abandoned: set[Path] = set()
+        self._lock = threading.Lock()
+        self._stack = contextlib.ExitStack()
+        self.convert_pool: ProcessPoolExecutor | None = None
+        self.pool: ThreadPoolExecutor | None = None
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace, gateways: list[Gateway], **kwargs: Any) -> ImagePipeline:
+        concurrency = max(1, int(args.concurrency))
+        cache_root = Path(args.cache_dir) if args.cache_dir else default_cache_dir()
+        return cls(
+            gateways,
+            concurrency=concurrency,
+            pool_size=int(args.pool_size),
+            pool_hosts=int(args.pool_hosts),
+            cache=None if args.no_cache else ImageCache(cache_root, max_bytes=int(args.cache_max_mb) * 1024 * 1024),
+            capabilities=GatewayCapabilities(cache_root / "gateways.json", ttl_s=float(args.capability_ttl)),
+            limiter_kwargs={
+                "rate_per_s": float(args.rate),
+                "max_retries": int(args.max_retries),
+                "breaker_threshold": int(args.breaker_threshold),
+                "breaker_cooldown_s": float(args.breaker_cooldown),
+            },
+            finalize_kwargs={
+                "out_width": int(args.width),
+                "out_height": int(args.height),
+                "no_resize": bool(args.no_resize),
+                "png_compress_level": int(args.png_compress_level),
+                "png_optimize": bool(args.png_optimize),
+                "out_format": str(args.format),
+                "quality": int(args.quality),
+                "renditions": tuple(dict.fromkeys(args.rendition or ())),
+            },
+            convert_workers=(
+                int(args.convert_workers)
+                if args.convert_workers is not None
+                else (min(os.cpu_count() or 1, concurrency) if concurrency > 1 else 0)
+            ),
+            timeout_s=float(args.timeout),
+            poll_interval_s=float(args.poll_interval),
+            poll_max_interval_s=float(args.poll_max_interval),
+            resolution_policy=str(args.resolution_policy),
+            candidates=int(args.candidates),
+            hedge_kwargs=(
+                {
+                    "percentile": float(args.hedge_percentile),
+                    "budget": int(args.hedge_budget),
+                    "initial_after_s": args.hedge_after,
+                }
+                if args.hedge_percentile > 0
+                else None
+            ),
+            **kwargs,
+        )
+
+    def __enter__(self) -> ImagePipeline:
+        stack = self._stack
+        stack.enter_context(self.session)
+        stack.enter_context(self.download_session)
+        stack.enter_context(self.poll_session)
+        if self.convert_workers > 0:
+            from concurrent.futures import ProcessPoolExecutor
+
+            self.convert_pool = stack.enter_context(ProcessPoolExecutor(max_workers=self.convert_workers))
+        stack.enter_context(self.poller)
+        if self.hedger is not None:
+            stack.enter_context(self.hedger)
+        # Thread pool entered last so it drains before the poller and process pool shut down.
+        self.pool = stack.enter_context(ThreadPoolExecutor(max_workers=self.concurrency))
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self._stack.__exit__(*exc)
+
+    def cancel_pending(self, *, wait: bool = True) -> None:
+        """Drop queued jobs and refuse new ones; in-flight ones finish before the pipeline exits."""
+        with self._lock:
+            self._accepting = False
+        if self.pool is not None:
+            self.pool.shutdown(wait=wait, cancel_futures=True)
+
+    @property
+    def inflight(self) -> int:
+        with self._lock:
+            return sum(1 for fut, _ in self._inflight.values() if not fut.done())
+
+    def cache_key(self, item: PlanItem, finalize: dict[str, Any] | None = None) -> str:
+        finalize = finalize or self.finalize_kwargs
+        return image_cache_key(
+            prompt=item.prompt,
+            model=self.model,
+            size=item.size,
+            resolution=item.resolution,
+            width=int(finalize["out_width"]),
+            height=int(finalize["out_height"]),
+            no_resize=bool(finalize["no_resize"]),
+            out_format=str(finalize.get("out_format", "png")),
+            quality=int(finalize.get("quality", 82)),
+            candidates=self.candidates_for(item),
+        )
+
+    def candidates_for(self, item: PlanItem) -> int:
+        return max(1, item.candidates or self.candidates)
+
+    def _rendition_keys(self, item: PlanItem, finalize: dict[str, Any]) -> list[str]:
+        return [
+            image_cache_key(
+                prompt=item.prompt,
+                model=self.model,
+                size=item.size,
+                resolution=item.resolution,
+                width=r.width,
+                height=r.height,
+                no_resize=False,
+                out_format=r.format,
+                quality=r.quality,
+                candidates=self.candidates_for(item),
+            )
+            for r in finalize.get("renditions", ())
+        ]
+
+    def fit_resolution(self, item: PlanItem, finalize: dict[str, Any] | None = None) -> PlanItem:
+        """
+        The item as it will be requested: under the "auto" policy its size/resolution become
+        the smallest the gateway offers that still covers the main image and every rendition,
+        instead of downloading pixels the resize throws away (or upscaling a too-small one).
+        """
+        finalize = finalize or self.finalize_kwargs
+        if self.resolution_policy != "auto" or finalize["no_resize"]:
+            return item
+        targets = [(int(finalize["out_width"]), int(finalize["out_height"]))]
+        targets += [(r.width, r.height) for r in finalize.get("renditions", ())]
+        aspect, image_size = pick_image_size(item.size, item.resolution.upper(), targets)
+        if (aspect, image_size) == (item.size, item.resolution.upper()):
+            return item
+        change = (f"{item.size} @ {item.resolution}", f"{aspect} @ {image_size}")
+        with self._lock:
+            first = change not in self._refits
+            self._refits[change] = self._refits.get(change, 0) + 1
+        if first:
+            largest = max(targets, key=lambda t: t[0] * t[1])
+            print(
+                f"[resolution] {item.name}: plan asks {change[0]}, largest output is {largest[0]}x{largest[1]}; "
+                f"requesting {change[1]} (and for every item like it)"
+            )
+        return dataclasses.replace(item, size=aspect, resolution=image_size)
+
+    def _note_download(self, planned: PlanItem, fitted: PlanItem, fetched: FetchedImage) -> None:
+        """Estimate what the planned size would have cost, from the bytes actually received."""
+        want = gemini_image_dims(planned.size, planned.resolution)
+        got = gemini_image_dims(fitted.size, fitted.resolution)
+        if want is None or got is None or want[0] * want[1] <= got[0] * got[1]:
+            return
+        try:
+            received = fetched.path.stat().st_size
+        except OSError:
+            return
+        with self._lock:
+            self._saved_bytes += int(received * (want[0] * want[1] / (got[0] * got[1]) - 1))
+
+    def output_path(self, out_dir: Path, item: PlanItem, finalize: dict[str, Any] | None = None) -> Path:
+        """Where an item's main image goes; its suffix follows the output format."""
+        finalize = finalize or self.finalize_kwargs
+        return _contained_path(out_dir, f"{item.name}{_FORMAT_EXT[finalize.get('out_format', 'png')]}")
+
+    def submit(
+        self,
+        item: PlanItem,
+        out_path: Path,
+        metrics: ItemMetrics,
+        *,
+        finalize: dict[str, Any] | None = None,
+        journal: RunJournal | None = None,
+        theme: str = "",
+        overwrite: bool = False,
+    ) -> Future[ItemResult]:
+        """
+        Queue one item; the Future settles once its image is on disk. `finalize` overrides
+        the output size/encoding for this item only; `theme` is the palette candidates are
+        scored against. `overwrite` skips the cache lookup (the fresh image is still stored).
+        """
+        assert self.pool is not None, "ImagePipeline used outside its with-block"
+        finalize = {**self.finalize_kwargs, **(finalize or {})}
+        fitted = self.fit_resolution(item, finalize)
+        key = self.cache_key(fitted, finalize)
+        with self._lock:
+            late = self.deadline is not None and time.time() >= self.deadline
+            if late or not self._accepting:
+                stopped: Future[ItemResult] = Future()
+                stopped.set_exception(
+                    DeadlineExceeded(f"Run deadline reached before {item.name} was queued")
+                    if late
+                    else RuntimeError("Pipeline stopped before this item was queued")
+                )
+                return stopped
+            entry = self._inflight.get(key)
+            if entry is None or (not self._keep_done and entry[0].done()):
+                fut = _flatten(
+                    self.pool.submit(
+                        self._run_item, item, fitted, out_path, metrics, key, finalize, journal, theme, overwrite
+                    )
+                )
+                self._inflight[key] = (fut, out_path)
+                if not self._keep_done:
+                    fut.add_done_callback(lambda f: self._forget(key, f))
+                return fut
+        first, first_path = entry
+        if first_path == out_path:
+            return first
+        started = time.time()
+        return _then(first, lambda res: self._copy(res, out_path, started, item.name))
+
+    def _forget(self, key: str, fut: Future[ItemResult]) -> None:
+        with self._lock:
+            if self._inflight.get(key, (None,))[0] is fut:
+                del self._inflight[key]
+
+    def _copy(self, first: ItemResult, out_path: Path, started: float, name: str) -> ItemResult:
+        dst = out_path.with_suffix(first.path.suffix)
+        # slide-03.320x180.webp -> slide-07.320x180.webp
+        pairs = [(first.path, dst)] + [(src, dst.with_name(dst.stem + src.name[len(first.path.stem) :])) for src in first.extras]
+        with self._lock:
+            if out_path in self._abandoned:
+                raise DeadlineExceeded(f"{name} arrived after its placeholder was written")
+            for ext in _FORMAT_EXT.values():
+                out_path.with_suffix(ext).unlink(missing_ok=True)
+            for src, target in pairs:
+                _link_or_copy(src, target)
+        return ItemResult(
+            dst, source="cache", elapsed_s=time.time() - started, gateway=first.gateway, extras=tuple(t for _, t in pairs[1:])
+        )
+
+    def abandon(self, out_path: Path) -> None:
+        """Give up on an output: a result still in flight for it is dropped instead of written."""
+        with self._lock:
+            self._abandoned.add(out_path)
+
+    def _commit(self, out_path: Path, name: str, written: Path, extras: list[Path]) -> tuple[Path, list[Path]]:
+        """
+        Move a finished item's staged files into place next to out_path, unless the output was
+        abandoned meanwhile (DeadlineExceeded then; the staged files are left for the caller).
+        """
+        with self._lock:
+            if out_path in self._abandoned:
+                raise DeadlineExceeded(f"{name} arrived after its placeholder was written")
+            placed = []
+            for src in (written, *extras):
+                dst = out_path.parent / src.name
+                os.replace(src, dst)
+                placed.append(dst)
+        return placed[0], placed[1:]
+
+    def _run_item(
+        self,
+        planned: PlanItem,
+        item: PlanItem,
+        out_path: Path,
+        metrics: ItemMetrics,
+        key: str,
+        finalize: dict[str, Any],
+        journal: RunJournal | None,
+        theme: str = "",
+        overwrite: bool = False,
+    ) -> ItemResult | Future[ItemResult]:
+        started = time.time()
+        renditions: tuple[Rendition, ...] = finalize.get("renditions", ())
+        with self._lock:
+            if out_path in self._abandoned:
+                raise DeadlineExceeded(f"{item.name} was given up on before it started")
+            # Other formats' main images go, or the deck builder could pick up a stale one.
+            for ext in _FORMAT_EXT.values():
+                out_path.with_suffix(ext).unlink(missing_ok=True)
+            for r in renditions:
+                r.path_for(out_path).unlink(missing_ok=True)
+        if journal is not None:
+            journal.append(item.name, "started", slide_number=item.slide_number)
+        # Everything is finalized in a private directory and moved into place by _commit(),
+        # so an existing output (maybe a hardlink into the cache) is replaced, never written
+        # through, and a result arriving after its deadline placeholder is never written.
+        staging = out_path.parent / f".staging-{os.getpid()}-{threading.get_ident()}-{time.monotonic_ns()}"
+        staged = staging / out_path.name
+        staging.mkdir(parents=True, exist_ok=True)
+
+        def cleanup(res: Any) -> Any:
+            shutil.rmtree(staging, ignore_errors=True)
+            return res
+
+        extra_keys = self._rendition_keys(item, finalize)
+        if self.cache is not None and not overwrite and all(self.cache.has(k) for k in extra_keys):
+            hit = self.cache.materialize(key, staged)
+            extras = [self.cache.materialize(k, r.path_for(staged)) for k, r in zip(extra_keys, renditions)]
+            if hit is not None and None not in extras:
+                try:
+                    hit, placed = self._commit(out_path, item.name, hit, [p for p in extras if p is not None])
+                finally:
+                    cleanup(None)
+                return ItemResult(hit, source="cache", elapsed_s=time.time() - started, extras=tuple(placed))
+        if self.deadline is not None and time.time() >= self.deadline:
+            cleanup(None)
+            raise DeadlineExceeded(f"Run deadline reached before {item.name} started")
+        fetch_kwargs: dict[str, Any] = {
+            "prompt": item.prompt,
+            "size": item.size,
+            "resolution": item.resolution,
+            "tmp_dir": out_path.parent,
+            "poll_interval_s": self.poll_interval_s,
+            "poll_max_interval_s": self.poll_max_interval_s,
+            "timeout_s": self.timeout_s,
+            "session": self.session,
+            "download_session": self.download_session,
+            "capabilities": self.capabilities,
+            "poller": self.poller,
+            "metrics": metrics,
+            "deadline": self.deadline,
+            "candidates": self.candidates_for(item),
+        }
+
+        def finish(fetched: FetchedImage, gateway: Gateway) -> ItemResult | Future[ItemResult]:
+            if item is not planned:
+                self._note_download(planned, item, fetched)
+            scores: list[dict[str, Any]] = []
+            if fetched.alternates:
+                with metrics.stage("score"):
+                    fetched, scores = pick_candidate(fetched, theme)
+
+            def stored(finalized: tuple[Path, dict[str, float], list[Path]]) -> ItemResult:
+                written, timings, extras = finalized
+                metrics.merge(timings)
+                if self.cache is not None:
+                    # Cached even when too late for this run: the rerun gets it for free.
+                    self.cache.store(key, written)
+                    for k, extra in zip(extra_keys, extras):
+                        self.cache.store(k, extra)
+                written, extras = self._commit(out_path, item.name, written, extras)
+                return ItemResult(
+                    written,
+                    elapsed_s=time.time() - started,
+                    gateway=gateway.name,
+                    extras=tuple(extras),
+                    candidates=tuple(scores),
+                )
+
+            if self.convert_pool is None:
+                return stored(finalize_image_timed(fetched, staged, **finalize))
+            # Decode/resize/encode in another process; this thread moves on to the next download.
+            return _then(self.convert_pool.submit(finalize_image_timed, fetched, staged, **finalize), stored)
+
+        try:
+            if self.hedger is not None:
+                # Resolves to (image, gateway) of whichever attempt lands first.
+                result: Any = _then(self.hedger.fetch(**fetch_kwargs), lambda won: finish(*won))
+            else:
+                fetched, gateway = self.router.fetch(**fetch_kwargs)
+                if isinstance(fetched, Future):
+                    # Task-based gateway: submitted; the shared poller finishes the job.
+                    result = _then(fetched, lambda f: finish(f, gateway))
+                else:
+                    result = finish(fetched, gateway)
+        except BaseException:
+            cleanup(None)
+            raise
+        if isinstance(result, Future):
+            result = _flatten(result)
+            result.add_done_callback(cleanup)
+            return result
+        return cleanup(result)
+
+    def write_placeholder(
+        self, item: PlanItem, out_path: Path, theme: str, finalize: dict[str, Any] | None = None
+    ) -> ItemResult:
+        """
+        Draw a themed stand-in (main image and renditions) where the item's image belongs. The
+        output is abandoned first, so the real image arriving later cannot replace it.
+        """
+        self.abandon(out_path)
+        finalize = {**self.finalize_kwargs, **(finalize or {})}
+        started = time.time()
+        main = Rendition(
+            int(finalize["out_width"]),
+            int(finalize["out_height"]),
+            finalize.get("out_format", "png"),
+            int(finalize.get("quality", 82)),
+        )
+        if finalize["no_resize"] or main.width <= 0 or main.height <= 0:
+            dims = gemini_image_dims(item.size, item.resolution) or (1376, 768)
+            main = dataclasses.replace(main, width=dims[0], height=dims[1])
+        renditions: tuple[Rendition, ...] = finalize.get("renditions", ())
+        largest = max((main, *renditions), key=lambda r: r.width * r.height)
+        written = out_path.with_suffix(main.ext)
+        targets = [(written, main, True)] + [(r.path_for(written), r, True) for r in renditions]
+        png = render_placeholder(theme, largest.width, largest.height, seed=item.name)
+        _save_renditions(
+            png,
+            "image/png",
+            targets,
+            compress_level=int(finalize.get("png_compress_level", 6)),
+            optimize=False,
+        )
+        return ItemResult(
+            written,
+            source="placeholder",
+            elapsed_s=time.time() - started,
+            extras=tuple(dst for dst, _, _ in targets[1:]),
+        )
+
+    def journal_done(self, journal: RunJournal, item: PlanItem, res: ItemResult) -> None:
+        journal.append(
+            item.name,
+            "done",
+            slide_number=item.slide_number,
+            path=str(res.path.resolve()),
+            sha256=_sha256_file(res.path),
+            bytes=res.path.stat().st_size,
+            prompt_hash=_text_hash(item.prompt),
+            model=self.gateway_models.get(res.gateway, self.model),
+            gateway=res.gateway,
+            source=res.source,
+            elapsed_s=round(res.elapsed_s, 3),
+            **({"renditions": [str(p.resolve()) for p in res.extras]} if res.extras else {}),
+            **({"candidates": list(res.candidates)} if res.candidates else {}),
+        )
+
+    def summary(self) -> str:
+        lines = []
+        if self._refits:
+            changes = ", ".join(f"{a} -> {b} x{n}" for (a, b), n in self._refits.items())
+            saved = f"; ~{self._saved_bytes / (1024 * 1024):.1f} MiB of download avoided" if self._saved_bytes else ""
+            lines.append(f"Resolution fitted to the outputs: {changes}{saved}")
+        if len(self.router.states) > 1 or any(st.limiter.throttled or st.limiter.trips for st in self.router.states):
+            lines.append(self.router.summary())
+        if self.hedger is not None:
+            lines.append(self.hedger.summary())
+        return "\n".join(lines)
+
+
+class ServeJob:
+    """One plan submitted to `serve`: its per-item events, replayable to any number of readers."""
+
+    def __init__(self, job_id: str, total: int) -> None:
+        self.id = job_id
+        self.total = total
+        self.created = time.time()
+        self.counts = {"done": 0, "failed": 0, "skipped": 0}
+        self.events: list[dict[str, Any]] = []
+        self._cv = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return sum(self.counts.values()) >= self.total
+
+    def emit(self, event: dict[str, Any]) -> None:
+        with self._cv:
+            self.events.append({"job": self.id, **event})
+            status = event.get("status")
+            if status in self.counts:
+                self.counts[status] += 1
+                if self.finished:
+                    self.events.append(
+                        {"job": self.id, "event": "finished", **self.counts, "elapsed_s": round(time.time() - self.created, 3)}
+                    )
+            self._cv.notify_all()
+
+    def follow(self) -> Any:
+        """Yield every event from the first, blocking for new ones until the job has finished."""
+        n = 0
+        while True:
+            with self._cv:
+                while n >= len(self.events) and not self.finished:
+                    self._cv.wait()
+                batch = self.events[n:]
+                done = self.finished
+            yield from batch
+            n += len(batch)
+            if done and n >= len(self.events):
+                return
+
+    def status(self) -> dict[str, Any]:
+        with self._cv:
+            return {"job": self.id, "total": self.total, **self.counts, "finished": self.finished}
+
+
+class ImageServer:
+    """
+    Job API behind `serve`, speaking HTTP on 127.0.0.1 or a Unix socket:
+
+      POST /v1/jobs?out_dir=DIR[&overwrite=1&width=W&height=H&no_resize=1&stream=1]
+           body: a plan (version-1 JSON or JSONL) -> {"job", "total"}, or with stream=1
+           the job's NDJSON events on the same response
+      GET  /v1/jobs/<id>          -> counts so far
+      GET  /v1/jobs/<id>/events   -> NDJSON events (replayed from the start, then live)
+      GET  /v1/health             -> queue depth and per-gateway state
+
+    Every job goes through one ImagePipeline, so all clients share its connection pool,
+    limiters, cache and workers, and identical prompts in flight are generated once.
+
+    Requests must carry `Authorization: Bearer <token>` when a token is set, and any request
+    with an Origin header (i.e. from a browser page) gets 403. out_dir must lie under `root`
+    and item names may not climb out of it.
+    """
+
+    max_jobs = 256  # finished jobs kept for status/event replay
+
+    def __init__(self, pipeline: ImagePipeline, *, root: Path, token: str | None = None) -> None:
+        self.pipeline = pipeline
+        self.root = root.expanduser().resolve()
+        self.token = token
+        self.jobs: dict[str, ServeJob] = {}
+        self._journals: dict[Path, RunJournal] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, plan_text: str, options: dict[str, str]) -> ServeJob:
+        import io
+
+        out_dir = options.get("out_dir")
+        if not out_dir:
+            raise ValueError("out_dir is required")
+        out_dir_path = Path(out_dir).expanduser().resolve()
+        if not out_dir_path.is_relative_to(self.root):
+            raise ValueError(f"out_dir must be under {self.root}")
+        overwrite = options.get("overwrite") in ("1", "true")
+        finalize: dict[str, Any] = {}
+        if options.get("width"):
+            finalize["out_width"] = int(options["width"])
+        if options.get("height"):
+            finalize["out_height"] = int(options["height"])
+        if options.get("no_resize"):
+            finalize["no_resize"] = options["no_resize"] in ("1", "true")
+        if options.get("format"):
+            if options["format"] not in _FORMAT_EXT:
+                raise ValueError(f"format must be one of {', '.join(_FORMAT_EXT)}")
+            finalize["out_format"] = options["format"]
+        if options.get("quality"):
+            finalize["quality"] = int(options["quality"])
+
+        try:
+            plan_meta, raw_images = open_plan(io.StringIO(plan_text))
+            items = [_plan_item(img, i) for i, img in enumerate(raw_images, start=1)]
+        except SystemExit as e:
+            raise ValueError(str(e)) from None
+        if not items:
+            raise ValueError("Plan has no items")
+        finalize_all = {**self.pipeline.finalize_kwargs, **finalize}
+        out_paths = [self.pipeline.output_path(out_dir_path, item, finalize_all) for item in items]
+
+        with self._lock:
+            job = ServeJob(f"{next(self._ids):06d}", len(items))
+            self.jobs[job.id] = job
+            finished = [j for j in self.jobs.values() if j.finished]
+            for old in finished[: max(0, len(finished) - self.max_jobs)]:
+                del self.jobs[old.id]
+            # Jobs writing to the same directory append to one journal (and one lock).
+            journal = self._journals.setdefault(out_dir_path, RunJournal(out_dir_path / "serve.journal.jsonl"))
+        job.emit({"event": "accepted", "total": job.total, "out_dir": str(out_dir_path)})
+        done_before = journal.completed() if not overwrite else {}
+
+        for item, out_path in zip(items, out_paths):
+            out_path.parent.mkdir(parents=True, exist_ok=True)
+            stale = output_is_stale(item, out_path, done_before.get(item.name))
+            if out_path.exists() and not overwrite and not stale:
+                job.emit({"event": "item", "name": item.name, "status": "skipped", "path": str(out_path)})
+                continue
+            fut = self.pipeline.submit(
+                item,
+                out_path,
+                ItemMetrics(item.name),
+                finalize=finalize,
+                journal=journal,
+                theme=str(plan_meta.get("theme") or ""),
+                overwrite=overwrite,
+            )
+            fut.add_done_callback(lambda f, item=item: self._item_done(job, journal, item, f))
+        return job
+
+    def _item_done(self, job: ServeJob, journal: RunJournal, item: PlanItem, fut: Future[ItemResult]) -> None:
+        event: dict[str, Any] = {"event": "item", "name": item.name, "slide_number": item.slide_number}
+        try:
+            res = fut.result()
+            self.pipeline.journal_done(journal, item, res)
+        except BaseException as e:
+            journal.append(item.name, "failed", error=str(e)[:500])
+            event.update(status="failed", error=str(e)[:500])
+        else:
+            event.update(
+                status="done",
+                path=str(res.path),
+                renditions=[str(p) for p in res.extras],
+                source=res.source,
+                gateway=res.gateway,
+                elapsed_s=round(res.elapsed_s, 3),
+                **({"candidates": list(res.candidates)} if res.candidates else {}),
+            )
+        job.emit(event)
+
+    def health(self) -> dict[str, Any]:
+        with self._lock:
+            jobs = list(self.jobs.values())
+        return {
+            "jobs": len(jobs),
+            "active_jobs": sum(1 for j in jobs if not j.finished),
+            "inflight": self.pipeline.inflight,
+            "gateways": [
+                {
+                    "name": st.gateway.name,
+                    "calls": st.calls,
+                    "failures": st.failures,
+                    "inflight": st.inflight,
+                    "latency_s": round(st.latency_s, 3) if st.latency_s is not None else None,
+                    "error_rate": round(st.error_rate, 3),
+                    "disabled": st.disabled,
+                }
+                for st in self.pipeline.router.states
+            ],
+        }
+
+    def authorized(self, headers: Any) -> bool:
+        if not self.token:
+            return True
+        import hmac
+
+        got = headers.get("authorization") or ""
+        return hmac.compare_digest(got.encode("utf-8"), f"Bearer {self.token}".encode("utf-8"))
+
+    def make_server(self, *, socket_path: str | None = None, port: int = 0) -> Any:
+        import socketserver
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import parse_qsl, urlsplit
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args: object) -> None:
+                pass
+
+            def _json(self, status: int, obj: Any) -> None:
+                body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _stream(self, job: ServeJob) -> None:
+                # HTTP/1.0 without a length: the stream ends when the job does.
+                self.send_response(200)
+                self.send_header("content-type", "application/x-ndjson")
+                self.end_headers()
+                try:
+                    for event in job.follow():
+                        self.wfile.write((json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8"))
+                        self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client stopped listening; the job carries on
+
+            def _allowed(self) -> bool:
+                # Browsers always send Origin on cross-site POSTs; local clients (curl, Node) don't.
+                if self.headers.get("origin") is not None:
+                    self._json(403, {"error": "browser requests are not accepted"})
+                    return False
+                if not server.authorized(self.headers):
+                    self._json(401, {"error": "missing or wrong bearer token"})
+                    return False
+                return True
+
+            def do_POST(self) -> None:
+                if not self._allowed():
+                    return
+                url = urlsplit(self.path)
+                if url.path != "/v1/jobs":
+                    self._json(404, {"error": f"no route for POST {url.path}"})
+                    return
+                options = dict(parse_qsl(url.query))
+                body = self.rfile.read(int(self.headers.get("content-length") or 0))
+                try:
+                    job = server.submit(body.decode("utf-8"), options)
+                except (ValueError, UnicodeDecodeError) as e:
+                    self._json(400, {"error": str(e)})
+                    return
+                if options.get("stream") in ("1", "true"):
+                    self._stream(job)
+                else:
+                    self._json(202, {"job": job.id, "total": job.total, "events": f"/v1/jobs/{job.id}/events"})
+
+            def do_GET(self) -> None:
+                if not self._allowed():
+                    return
+                path = urlsplit(self.path).path.rstrip("/")
+                if path == "/v1/health":
+                    self._json(200, server.health())
+                    return
+                m = re.fullmatch(r"/v1/jobs/([^/]+)(/events)?", path)
+                job = server.jobs.get(m.group(1)) if m else None
+                if job is None:
+                    self._json(404, {"error": f"no such job or route: {path}"})
+                elif m.group(2):
+                    self._stream(job)
+                else:
+                    self._json(200, job.status())
+
+        if socket_path:
+
+            class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+                daemon_threads = True
+
+                def get_request(self) -> Any:
+                    request, _ = super().get_request()
+                    # BaseHTTPRequestHandler expects a (host, port) client address.
+                    return request, ("local", 0)
+
+            Path(socket_path).unlink(missing_ok=True)
+            return UnixHTTPServer(socket_path, Handler)
+        if not self.token:
+            raise RuntimeError("A TCP listener needs a token; pass one or use a Unix socket")
+        httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        httpd.daemon_threads = True
+        return httpd
+
+
+@dataclass
+class _Deck:
+    md_path: Path
+    slug: str
+    items: list[PlanItem]
+    out_path: Path
+    images_dir: Path
+    pending: int = 0
+    failed: int = 0
+    images_ready_s: float = 0.0
+    build_s: float = 0.0
+    error: str = ""
+
+
+def plan_deck(md_path: Path, theme_slug: str, start_slide: int, *, max_images: int, out_dir: Path) -> _Deck:
+    """
+    In-memory plan for one markdown file, as the Node builder sees it: one deck per file, so a
+    file concatenating several reports only gets images for its first one.
+    """
+    slug = md_path.stem
+    items: list[PlanItem] = []
+    first_report = None
+    for i, img in enumerate(iter_plan_images([md_path], theme_slug, start_slide, max_images=max_images), start=1):
+        report = img.get("report")
+        if report is not None:
+            first_report = first_report or report
+            if report != first_report:
+                print(f"[build] {md_path} holds several reports; the deck (and its images) covers only the first")
+                break
+        img["name"] = f"{slug}/{str(img['name']).rsplit('/', 1)[-1]}"
+        items.append(_plan_item(img, i))
+    return _Deck(md_path, slug, items, out_dir / f"{slug}.pptx", out_dir / "images" / slug)
+
+
+class DeckBatch:
+    """
+    Behind `build`: every deck's images go through one ImagePipeline queue (decks in input
+    order, so the first ones finish first), and each deck's Node build starts as soon as its
+    own last image has settled, while later decks are still generating.
+    """
+
+    def __init__(
+        self,
+        pipeline: ImagePipeline,
+        decks: list[_Deck],
+        *,
+        theme: str,
+        node: str = "node",
+        deck_jobs: int = 2,
+        overwrite: bool = False,
+        journal: RunJournal | None = None,
+    ) -> None:
+        self.pipeline = pipeline
+        self.decks = decks
+        self.theme = theme
+        self.node = node
+        self.overwrite = overwrite
+        self.journal = journal
+        self._done_before = journal.completed() if journal is not None and not overwrite else {}
+        self.builder_js = Path(__file__).resolve().with_name("md-deepresearch-to-pptx.js")
+        self._builders = ThreadPoolExecutor(max_workers=max(1, deck_jobs), thread_name_prefix="deck-build")
+        self._built: dict[str, Future[_Deck]] = {d.slug: Future() for d in decks}
+        self._lock = threading.Lock()
+        self._print_lock = threading.Lock()
+
+    def run(self) -> float:
+        """Generate and build every deck; returns the batch wall-clock seconds."""
+        started = time.time()
+        with self._builders:
+            for deck in self.decks:
+                self._submit_deck(deck, started)
+            for fut in self._built.values():
+                fut.result()
+        return time.time() - started
+
+    def _submit_deck(self, deck: _Deck, started: float) -> None:
+        deck.images_dir.mkdir(parents=True, exist_ok=True)
+        todo: list[tuple[PlanItem, Path]] = []
+        for item in deck.items:
+            out_path = self.pipeline.output_path(deck.images_dir.parent, item)
+            stale = output_is_stale(item, out_path, self._done_before.get(item.name))
+            if out_path.exists() and not self.overwrite and not stale:
+                self._log(f"[skip] {out_path} exists")
+                continue
+            todo.append((item, out_path))
+        # One extra count held while submitting, so a fast first image cannot launch the build early.
+        deck.pending = len(todo) + 1
+        for item, out_path in todo:
+            fut = self.pipeline.submit(
+                item, out_path, ItemMetrics(item.name), journal=self.journal, theme=self.theme, overwrite=self.overwrite
+            )
+            fut.add_done_callback(lambda f, item=item: self._image_done(deck, item, f, started))
+        self._settle(deck, started)
+
+    def _image_done(self, deck: _Deck, item: PlanItem, fut: Future[ItemResult], started: float) -> None:
+        try:
+            res = fut.result()
+        except Exception as e:
+            deck.failed += 1
+            if self.journal is not None:
+                self.journal.append(item.name, "failed", error=str(e)[:500])
+            self._log(f"  !! {item.name} failed: {e}")
+        else:
+            if self.journal is not None:
+                self.pipeline.journal_done(self.journal, item, res)
+            self._log(f"  -> {res.path}" + (" (cached)" if res.source == "cache" else _best_of(res)))
+        self._settle(deck, started)
+
+    def _settle(self, deck: _Deck, started: float) -> None:
+        with self._lock:
+            deck.pending -= 1
+            if deck.pending:
+                return
+        deck.images_ready_s = time.time() - started
+        self._builders.submit(self._build, deck)
+
+    def _build(self, deck: _Deck) -> None:
+        import subprocess
+
+        t0 = time.time()
+        cmd = [
+            self.node,
+            str(self.builder_js),
+            "--in",
+            str(deck.md_path),
+            "--out",
+            str(deck.out_path),
+            "--theme",
+            self.theme,
+            "--images-dir",
+            str(deck.images_dir),
+        ]
+        self._log(f"[build] {deck.slug}: images ready, building {deck.out_path}")
+        try:
+            cp = subprocess.run(cmd, capture_output=True, text=True)
+            if cp.returncode != 0:
+                tail = [l.strip() for l in (cp.stderr or cp.stdout).splitlines() if l.strip()][-3:]
+                deck.error = " / ".join(tail)[:300] or f"exit {cp.returncode}"
+        except OSError as e:
+            deck.error = f"cannot run {self.node}: {e}"
+        finally:
+            deck.build_s = time.time() - t0
+            self._built[deck.slug].set_result(deck)
+        self._log(f"[build] {deck.slug}: " + (f"FAILED ({deck.error})" if deck.error else f"wrote {deck.out_path}"))
+
+    def _log(self, line: str) -> None:
+        # Callbacks and builds report from several threads; keep their lines whole.
+        with self._print_lock:
+            print(line, flush=True)
+
+    def summary(self, wall_s: float) -> str:
+        """Per-deck table (seconds since the batch started) and the batch wall-clock."""
+        lines = [f"{'deck':<28} {'images':>7} {'ready at':>9} {'build s':>8} {'done at':>8}  status"]
+        for d in self.decks:
+            status = f"failed: {d.error}" if d.error else "ok" + (f" ({d.failed} image(s) missing)" if d.failed else "")
+            lines.append(
+                f"{d.slug[:28]:<28} {len(d.items) - d.failed:>3}/{len(d.items):<3} {d.images_ready_s:>9.1f} "
+                f"{d.build_s:>8.1f} {d.images_ready_s + d.build_s:>8.1f}  {status}"
+            )
+        built = sum(1 for d in self.decks if not d.error)
+        lines.append(f"Batch: {built}/{len(self.decks)} decks built in {wall_s:.1f}s wall-clock")
+        return "\n".join(lines)
+
+
+def _add_pipeline_args(p: argparse.ArgumentParser) -> None:
+    """Gateway, cache and throughput options shared by `generate`, `serve` and `build` (see ImagePipeline)."""
+    p.add_argument("--base-url", default=None, help="Override CHERRY_BASE_URL/GEMINI_BASE_URL")
+    p.add_argument("--key", default=None, help="Override CHERRY_API_KEY/GEMINI_API_KEY")
+    p.add_argument("--model", default=None, help="Override CHERRY_MODEL/GEMINI_MODEL")
+    p.add_argument(
+        "--gateways",
+        default=None,
+        help="JSON file listing several gateways to balance over (default: CHERRY_GATEWAYS_FILE / CHERRY_GATEWAYS)",
+    )
+    p.add_argument(
+        "--health-check",
+        action="store_true",
+        help="Probe every gateway's /v1/models first and leave out those failing or missing the model",
+    )
+    p.add_argument(
+        "--poll-interval",
+        type=float,
+        default=0.5,
+        help="First task-status poll delay; grows 1.5x per poll (default: 0.5)",
+    )
+    p.add_argument("--poll-max-interval", type=float, default=8.0, help="Task poll delay cap (default: 8)")
+    p.add_argument("--timeout", type=float, default=180.0)
+    p.add_argument("--width", type=int, default=640, help="Output image width (default: 640)")
+    p.add_argument("--height", type=int, default=360, help="Output image height (default: 360)")
+    p.add_argument("--no-resize", action="store_true", help="Do not resize; keep model output size")
+    p.add_argument("--concurrency", type=int, default=1, help="Parallel generate jobs (default: 1)")
+    p.add_argument(
+        "--pool-size",
+        type=int,
+        default=0,
+        help="Keep-alive connections per host (default: --concurrency)",
+    )
+    p.add_argument("--pool-hosts", type=int, default=4, help="Distinct hosts to keep pools for (default: 4)")
+    p.add_argument("--cache-dir", default=None, help="Image cache dir (default: CHERRY_CACHE_DIR or ~/.cache)")
+    p.add_argument("--cache-max-mb", type=int, default=2048, help="Image cache size bound (default: 2048)")
+    p.add_argument("--no-cache", action="store_true", help="Neither read nor populate the image cache")
+    p.add_argument(
+        "--convert-workers",
+        type=int,
+        default=None,
+        help="Processes for PNG decode/resize/encode (0 = inline; default: min(CPUs, --concurrency) when concurrent)",
+    )
+    p.add_argument("--png-compress-level", type=int, default=6, choices=range(10), metavar="0-9")
+    p.add_argument("--png-optimize", action="store_true", help="Extra PNG optimization pass (smaller, slower)")
+    p.add_argument(
+        "--resolution-policy",
+        choices=("auto", "plan"),
+        default="auto",
+        help="auto: request the smallest imageSize/aspect covering --width/--height and renditions; plan: as written",
+    )
+    p.add_argument(
+        "--format",
+        choices=tuple(_FORMAT_EXT),
+        default="png",
+        help="Main image format (default: png; webp/jpeg make much smaller decks)",
+    )
+    p.add_argument("--quality", type=int, default=82, help="WebP/JPEG quality for --format (default: 82)")
+    p.add_argument(
+        "--candidates",
+        type=int,
+        default=1,
+        help="Images per gateway call (candidateCount / n); the best by local scoring is kept. "
+        'A plan item\'s "candidates" overrides it (default: 1)',
+    )
+    p.add_argument(
+        "--rendition",
+        action="append",
+        type=parse_rendition,
+        metavar="WxH[:FMT[:Q]]",
+        help="Extra output from the same decode, e.g. 320x180:webp -> slide-05.320x180.webp (repeatable)",
+    )
+    p.add_argument(
+        "--capability-ttl",
+        type=float,
+        default=86400.0,
+        help="Seconds to trust the cached gateway route/auth mode (0 = always probe; default: 86400)",
+    )
+    p.add_argument(
+        "--max-retries",
+        type=int,
+        default=4,
+        help="Retries per gateway call on 429/5xx/connection errors, jittered, honouring Retry-After (default: 4)",
+    )
+    p.add_argument("--rate", type=float, default=0.0, help="Max generation calls/sec to the gateway (0 = no cap)")
+    p.add_argument(
+        "--breaker-threshold",
+        type=int,
+        default=5,
+        help="Consecutive gateway failures that open the circuit breaker (default: 5)",
+    )
+    p.add_argument(
+        "--hedge-percentile",
+        type=float,
+        default=0.0,
+        help="Send a duplicate request when an image is slower than this percentile of recent ones, e.g. 90 (0 = off)",
+    )
+    p.add_argument("--hedge-budget", type=int, default=4, help="Max duplicate requests per run (default: 4)")
+    p.add_argument(
+        "--hedge-after",
+        type=float,
+        default=None,
+        help="Hedge delay in seconds until enough latencies are known (default: no hedging until then)",
+    )
+    p.add_argument("--breaker-cooldown", type=float, default=30.0, help="Seconds the breaker stays open (default: 30)")
+
+
+def _gateways_from_args(args: argparse.Namespace) -> list[Gateway]:
+    gateways = load_gateways(
+        args.gateways,
+        default_model=args.model or _pick_env("CHERRY_MODEL", "GEMINI_MODEL") or "gemini-3-pro-image-preview",
+        base_url=args.base_url,
+        api_key=args.key,
+    )
+    if args.model:
+        gateways = [dataclasses.replace(g, model=args.model) for g in gateways]
+    return gateways
 
 
 def main() -> None:
@@ -532,25 +4385,136 @@ def main() -> None:
     p_models.add_argument("--base-url", default=None, help="Override CHERRY_BASE_URL/GEMINI_BASE_URL")
     p_models.add_argument("--key", default=None, help="Override CHERRY_API_KEY/GEMINI_API_KEY")
     p_models.add_argument("--contains", default=None, help="Only print model ids containing this substring")
+    p_models.add_argument("--cache-dir", default=None, help="Cache dir (default: CHERRY_CACHE_DIR or ~/.cache)")
+    p_models.add_argument("--capability-ttl", type=float, default=86400.0, help="Seconds to reuse a cached list")
+    p_models.add_argument("--refresh", action="store_true", help="Ignore the cached model list")
 
     p_plan = sub.add_parser("make-plan", help="Create an images plan JSON from a Deep Research markdown")
-    p_plan.add_argument("--in", dest="md_in", required=True, help="Input markdown file")
+    p_plan.add_argument(
+        "--in",
+        dest="md_in",
+        nargs="+",
+        required=True,
+        help="Input markdown file(s), directories or glob patterns (one plan covers all reports)",
+    )
     p_plan.add_argument("--theme", default="golden-hour", help="Theme slug (theme-factory)")
     p_plan.add_argument("--analysis-start-slide", type=int, default=5, help="First analysis slide number (default: 5)")
-    p_plan.add_argument("--out", required=True, help="Output plan JSON path")
+    p_plan.add_argument("--max-images", type=int, default=5, help="Images per report (0 = every ### section; default: 5)")
+    p_plan.add_argument(
+        "--out",
+        required=True,
+        help='Output plan path: *.jsonl = one item per line, "-" = JSONL on stdout (pipe into generate --plan -)',
+    )
+    p_plan.add_argument(
+        "--previous",
+        default=None,
+        help="Plan to diff against (default: the existing --out file); generate then redoes only changed items",
+    )
+    p_plan.add_argument("--no-diff", action="store_true", help="Write a plain plan without change markers")
 
     p_gen = sub.add_parser("generate", help="Generate images from a plan JSON")
-    p_gen.add_argument("--plan", required=True, help="Plan JSON path")
+    p_gen.add_argument("--plan", required=True, help='Plan JSON or JSONL path ("-" = read JSONL/JSON from stdin)')
     p_gen.add_argument("--out-dir", default="images", help="Output directory (default: images/)")
-    p_gen.add_argument("--base-url", default=None, help="Override CHERRY_BASE_URL/GEMINI_BASE_URL")
-    p_gen.add_argument("--key", default=None, help="Override CHERRY_API_KEY/GEMINI_API_KEY")
-    p_gen.add_argument("--model", default=None, help="Override CHERRY_MODEL/GEMINI_MODEL")
-    p_gen.add_argument("--poll-interval", type=float, default=1.5)
-    p_gen.add_argument("--timeout", type=float, default=180.0)
-    p_gen.add_argument("--width", type=int, default=640, help="Output image width (default: 640)")
-    p_gen.add_argument("--height", type=int, default=360, help="Output image height (default: 360)")
-    p_gen.add_argument("--no-resize", action="store_true", help="Do not resize; keep model output size")
     p_gen.add_argument("--overwrite", action="store_true")
+    p_gen.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip only items whose journaled output is intact (size/header/sha256); redo the rest",
+    )
+    p_gen.add_argument(
+        "--journal", default=None, help="Run journal path (default: <out-dir>/<plan name>.journal.jsonl)"
+    )
+    p_gen.add_argument("--metrics", default=None, help="Write per-item stage timings as JSON lines to FILE")
+    p_gen.add_argument(
+        "--metrics-prom",
+        default=None,
+        help="Prometheus textfile path (default: --metrics path with .prom suffix)",
+    )
+    p_gen.add_argument(
+        "--deadline",
+        type=float,
+        default=None,
+        help="Finish the whole run within SECONDS: request timeouts shrink to fit, items not ready get "
+        "a themed placeholder (journaled, so --resume fills them in later)",
+    )
+    p_gen.add_argument(
+        "--pack",
+        default=None,
+        help="Also write every image of the run into this one-file indexed pack (.zip); see the pack command",
+    )
+    p_gen.add_argument(
+        "--pack-only",
+        action="store_true",
+        help="With --pack: finish images in a local temp dir and write nothing but the pack (no files in "
+        "--out-dir; get them back with pack export)",
+    )
+    p_gen.add_argument(
+        "--keep-going",
+        action="store_true",
+        help="Continue with remaining images after a failure (exit non-zero at the end)",
+    )
+    _add_pipeline_args(p_gen)
+
+    p_serve = sub.add_parser(
+        "serve",
+        help="Run a local job server: many clients share one queue, connection pool and rate limit",
+    )
+    p_serve.add_argument("--socket", default=None, help="Listen on this Unix socket path instead of a TCP port")
+    p_serve.add_argument("--port", type=int, default=8765, help="TCP port on 127.0.0.1 (default: 8765; 0 = any free)")
+    p_serve.add_argument(
+        "--root",
+        default=".",
+        help="Jobs may only write under this directory (default: current directory)",
+    )
+    p_serve.add_argument(
+        "--token",
+        default=os.getenv("CHERRY_SERVE_TOKEN"),
+        help="Bearer token clients must send (env CHERRY_SERVE_TOKEN). TCP always needs one: "
+        "a random token is generated and printed when unset; a Unix socket only checks one if given",
+    )
+    _add_pipeline_args(p_serve)
+
+    p_build = sub.add_parser(
+        "build",
+        help="Markdown files -> decks in one go: plan in memory, one image queue, each deck built once its images are in",
+    )
+    p_build.add_argument(
+        "--in",
+        dest="md_in",
+        nargs="+",
+        required=True,
+        help="Input markdown file(s), directories or glob patterns (one deck per file)",
+    )
+    p_build.add_argument("--out-dir", default="decks", help="Decks go to DIR/<name>.pptx, images to DIR/images/<name>/")
+    p_build.add_argument("--theme", default="golden-hour", help="Theme slug (theme-factory)")
+    p_build.add_argument("--analysis-start-slide", type=int, default=5, help="First analysis slide number (default: 5)")
+    p_build.add_argument("--max-images", type=int, default=5, help="Images per deck (0 = every ### section; default: 5)")
+    p_build.add_argument("--overwrite", action="store_true", help="Regenerate images that already exist")
+    p_build.add_argument("--node", default="node", help="Node.js executable for the deck builder (default: node)")
+    p_build.add_argument("--deck-jobs", type=int, default=2, help="Deck builds run in parallel (default: 2)")
+    _add_pipeline_args(p_build)
+
+    p_pack = sub.add_parser("pack", help="List or unpack a one-file image pack (generate --pack)")
+    pack_sub = p_pack.add_subparsers(dest="pack_cmd", required=True)
+    p_pack_ls = pack_sub.add_parser("ls", help="Print the pack's manifest")
+    p_pack_ls.add_argument("pack", help="Pack file")
+    p_pack_ls.add_argument("--json", action="store_true", help="Print the manifest JSON as-is")
+    p_pack_export = pack_sub.add_parser("export", help="Write packed images back out as loose files")
+    p_pack_export.add_argument("pack", help="Pack file")
+    p_pack_export.add_argument(
+        "--name",
+        action="append",
+        default=[],
+        help="Only this member or item, e.g. slide-05 (repeatable; default: all)",
+    )
+    p_pack_export.add_argument("--out-dir", default="images", help="Output directory (default: images/)")
+
+    p_cache = sub.add_parser("cache", help="Inspect or prune the content-addressed image cache")
+    p_cache.add_argument("--cache-dir", default=None, help="Image cache dir (default: CHERRY_CACHE_DIR or ~/.cache)")
+    cache_sub = p_cache.add_subparsers(dest="cache_cmd", required=True)
+    cache_sub.add_parser("stats", help="Print entry count and size")
+    p_prune = cache_sub.add_parser("prune", help="Evict least-recently-used entries")
+    p_prune.add_argument("--max-mb", type=int, default=2048, help="Target size after pruning (default: 2048)")
 
     args = p.parse_args()
 
@@ -560,10 +4524,85 @@ def main() -> None:
         load_dotenv(dotenv_path, override=True)
 
     if args.cmd == "make-plan":
-        plan = make_plan(Path(args.md_in), args.theme, args.analysis_start_slide)
+        import io
+        import sys
+
+        to_stdout = args.out == "-"
         out_path = Path(args.out)
-        out_path.write_text(json.dumps(plan, ensure_ascii=False, indent=2), encoding="utf-8")
-        print(f"Wrote plan: {out_path}")
+        prev_path = Path(args.previous) if args.previous else (None if to_stdout else out_path)
+        previous_images = None
+        if not args.no_diff and prev_path is not None and prev_path.exists():
+            previous_images = list(open_plan(str(prev_path))[1])
+        md_paths = expand_md_inputs(args.md_in)
+        # With --out - stdout carries the plan itself; progress goes to stderr.
+        log = sys.stderr if to_stdout else sys.stdout
+
+        if to_stdout or out_path.suffix == ".jsonl":
+            header = {"version": 1, "format": "jsonl", "theme": args.theme, "model_hint": "gemini-3-pro-image-preview"}
+            images = iter_plan_images(md_paths, args.theme, args.analysis_start_slide, max_images=int(args.max_images))
+            differ = PlanDiff(previous_images) if previous_images is not None else None
+            if to_stdout:
+                try:
+                    n = write_plan_jsonl(sys.stdout, header, images, differ)
+                except BrokenPipeError:
+                    # The reading end (generate --plan -) stopped early, e.g. after a failure.
+                    os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+                    raise SystemExit(1)
+            else:
+                buf = io.StringIO()
+                n = write_plan_jsonl(buf, header, images, differ)
+                _atomic_write_bytes(out_path, buf.getvalue().encode("utf-8"))
+            counts = differ.counts if differ is not None else None
+        else:
+            plan = make_plan(
+                md_paths,
+                args.theme,
+                args.analysis_start_slide,
+                previous={"images": previous_images} if previous_images is not None else None,
+                max_images=int(args.max_images),
+            )
+            _atomic_write_bytes(out_path, json.dumps(plan, ensure_ascii=False, indent=2).encode("utf-8"))
+            n, counts = len(plan["images"]), plan.get("diff")
+        print(f"Wrote plan: {'<stdout>' if to_stdout else out_path} ({n} images)", file=log)
+        if counts is not None:
+            print("Diff vs {}: {}".format(prev_path, ", ".join(f"{v} {k}" for k, v in counts.items())), file=log)
+        return
+
+    if args.cmd == "pack":
+        pack = ImagePack.open(Path(args.pack))
+        if args.pack_cmd == "ls":
+            if args.json:
+                print(json.dumps(pack.manifest, ensure_ascii=False, indent=2))
+                return
+            for e in pack.entries:
+                dims = f"{e['width']}x{e['height']}" if "width" in e else "?"
+                print(f"{e['name']:<36} slide {e['slide_number']:>3}  {e['format']:<5} {dims:>10} {e['bytes']:>10,}  {e['sha256'][:12]}")
+            print(f"{len(pack.entries)} images, {sum(e['bytes'] for e in pack.entries) / (1024 * 1024):.1f} MiB")
+            return
+        entries = pack.entries
+        if args.name:
+            wanted = set(args.name)
+            entries = [e for e in entries if e["name"] in wanted or e["item"] in wanted]
+            missing = sorted(wanted - {e["name"] for e in entries} - {e["item"] for e in entries})
+            if missing:
+                raise SystemExit(f"Not in {args.pack}: {', '.join(missing)}")
+        out_dir = Path(args.out_dir)
+        try:
+            targets = [_contained_path(out_dir, str(e["name"])) for e in entries]
+        except ValueError as e:
+            raise SystemExit(f"{args.pack}: {e}") from None
+        for e, target in zip(entries, targets):
+            _atomic_write_bytes(target, pack.read(e))
+        print(f"Exported {len(entries)} images to {out_dir}")
+        return
+
+    if args.cmd == "cache":
+        cache = ImageCache(Path(args.cache_dir) if args.cache_dir else default_cache_dir(), max_bytes=0)
+        if args.cache_cmd == "stats":
+            print(json.dumps(cache.stats(), ensure_ascii=False, indent=2))
+            return
+        removed, freed = cache.prune(int(args.max_mb) * 1024 * 1024)
+        print(f"Pruned {removed} entries ({freed / (1024 * 1024):.1f} MiB) from {cache.images_dir}")
         return
 
     if args.cmd == "list-models":
@@ -575,25 +4614,22 @@ def main() -> None:
             raise SystemExit("Missing CHERRY_API_KEY/GEMINI_API_KEY (set in .env or pass --key)")
 
         base = _normalize_base_url(base_url)
-        auth_mode = (
-            _pick_env("GEMINI_AUTH_MODE", "CHERRY_AUTH_MODE")
-            or ("both" if _pick_env("CHERRY_API_KEY") else "goog")
-        ).strip().lower()
-        r = requests.get(f"{base}/v1/models", headers=_gemini_auth_headers(api_key, auth_mode), timeout=120)
-        if r.status_code >= 400:
-            snippet = (r.text or "")[:2000]
-            raise SystemExit(f"HTTP {r.status_code} GET {base}/v1/models: {snippet}")
-        data = r.json()
-
-        ids: list[str] = []
-        if isinstance(data, dict) and isinstance(data.get("data"), list):
-            for item in data["data"]:
-                if isinstance(item, dict) and item.get("id"):
-                    ids.append(str(item["id"]))
-        elif isinstance(data, dict) and isinstance(data.get("models"), list):
-            for item in data["models"]:
-                if isinstance(item, dict) and item.get("name"):
-                    ids.append(str(item["name"]))
+        capabilities = GatewayCapabilities(
+            (Path(args.cache_dir) if args.cache_dir else default_cache_dir()) / "gateways.json",
+            ttl_s=float(args.capability_ttl),
+        )
+        cached_ids = None if args.refresh else capabilities.models(base)
+        data: Any = None
+        if cached_ids is not None:
+            ids = cached_ids
+        else:
+            with make_http_session(pool_size=1) as session:
+                try:
+                    ids, data = fetch_model_ids(session, base, api_key, _default_auth_mode(), timeout_s=120)
+                except RuntimeError as e:
+                    raise SystemExit(str(e)) from e
+            if ids:
+                capabilities.record_models(base, ids)
 
         if args.contains:
             needle = args.contains.lower()
@@ -601,62 +4637,294 @@ def main() -> None:
 
         for mid in ids:
             print(mid)
-        if not ids:
+        if not ids and data is not None:
             print("(no models parsed; inspect raw JSON)")
             print(json.dumps(data, ensure_ascii=False, indent=2)[:2000])
         return
 
-    if args.cmd == "generate":
-        plan_path = Path(args.plan)
-        plan = json.loads(plan_path.read_text(encoding="utf-8"))
-        base_url = args.base_url or _pick_env("CHERRY_BASE_URL", "GEMINI_BASE_URL")
-        api_key = args.key or _pick_env("CHERRY_API_KEY", "GEMINI_API_KEY")
-        model = args.model or _pick_env("CHERRY_MODEL", "GEMINI_MODEL") or "gemini-3-pro-image-preview"
+    if args.cmd == "serve":
+        # Finished items are forgotten by the dedupe table; repeats are served from the cache.
+        pipeline = ImagePipeline.from_args(args, _gateways_from_args(args), keep_done=False)
+        if args.health_check:
+            pipeline.router.check(pipeline.session)
+        token = args.token
+        if not token and not args.socket:
+            import secrets
 
-        if not base_url:
-            raise SystemExit("Missing CHERRY_BASE_URL/GEMINI_BASE_URL (set in .env or pass --base-url)")
-        if not api_key:
-            raise SystemExit("Missing CHERRY_API_KEY/GEMINI_API_KEY (set in .env or pass --key)")
+            token = secrets.token_urlsafe(24)
+        with pipeline:
+            server = ImageServer(pipeline, root=Path(args.root), token=token)
+            httpd = server.make_server(socket_path=args.socket, port=int(args.port))
+            where = args.socket or "http://{}:{}".format(*httpd.server_address[:2])
+            print(f"Serving image jobs on {where} (concurrency {pipeline.concurrency}); Ctrl+C to stop", flush=True)
+            print(f"Jobs may write under {server.root}", flush=True)
+            if token and not args.token:
+                print(f"Token (send as 'Authorization: Bearer <token>'): {token}", flush=True)
+            try:
+                httpd.serve_forever()
+            except KeyboardInterrupt:
+                print("Stopping: queued images dropped, waiting for in-flight ones...")
+                pipeline.cancel_pending()
+            finally:
+                httpd.server_close()
+                if args.socket:
+                    Path(args.socket).unlink(missing_ok=True)
+        summary = pipeline.summary()
+        if summary:
+            print(summary)
+        return
 
+    if args.cmd == "build":
         out_dir = Path(args.out_dir)
-        out_dir.mkdir(parents=True, exist_ok=True)
+        decks = []
+        for md_path in expand_md_inputs(args.md_in):
+            try:
+                deck = plan_deck(
+                    md_path, args.theme, args.analysis_start_slide, max_images=int(args.max_images), out_dir=out_dir
+                )
+            except ValueError as e:
+                raise SystemExit(str(e)) from None
+            if any(d.slug == deck.slug for d in decks):
+                raise SystemExit(f"Two inputs would both build {deck.out_path}: rename {md_path}")
+            decks.append(deck)
+        print(f"Planned {len(decks)} decks, {sum(len(d.items) for d in decks)} images")
 
-        images = plan.get("images") or []
-        if not isinstance(images, list) or not images:
-            raise SystemExit("Plan has no images[]")
-
-        for i, img in enumerate(images, start=1):
-            item = PlanItem(
-                name=str(img.get("name") or f"image-{i:02d}"),
-                slide_number=int(img.get("slide_number") or 0),
-                prompt=str(img.get("prompt") or ""),
-                size=str(img.get("size") or "16:9"),
-                resolution=str(img.get("resolution") or "1K"),
+        pipeline = ImagePipeline.from_args(args, _gateways_from_args(args))
+        if args.health_check:
+            pipeline.router.check(pipeline.session)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        with pipeline:
+            batch = DeckBatch(
+                pipeline,
+                decks,
+                theme=args.theme,
+                node=args.node,
+                deck_jobs=int(args.deck_jobs),
+                overwrite=args.overwrite,
+                journal=RunJournal(out_dir / "build.journal.jsonl"),
             )
-            if not item.prompt.strip():
-                raise SystemExit(f"Plan item {item.name} missing prompt")
+            wall_s = batch.run()
+        summary = pipeline.summary()
+        if summary:
+            print(summary)
+        print(batch.summary(wall_s))
+        failed = [d.slug for d in decks if d.error]
+        if failed:
+            raise SystemExit(f"{len(failed)}/{len(decks)} decks failed to build: " + ", ".join(failed))
+        print("Done.")
+        return
 
-            out_path = out_dir / f"{item.name}.png"
-            if out_path.exists() and not args.overwrite:
-                print(f"[skip] {out_path} exists")
-                continue
+    if args.cmd == "generate":
+        run_started = time.time()
+        scratch = None
+        if args.pack_only:
+            if not args.pack:
+                raise SystemExit("--pack-only needs --pack")
+            if args.resume:
+                raise SystemExit("--pack-only keeps no loose images to resume from")
+            import tempfile
 
-            print(f"[{i}/{len(images)}] {item.name} (slide {item.slide_number})")
-            generate_one(
-                base_url=base_url,
-                api_key=api_key,
-                model=model,
-                prompt=item.prompt,
-                size=item.size,
-                resolution=item.resolution,
-                out_path=out_path,
-                poll_interval_s=args.poll_interval,
-                timeout_s=args.timeout,
-                out_width=int(args.width),
-                out_height=int(args.height),
-                no_resize=bool(args.no_resize),
+            # On a network share every image would be several small writes and stat probes;
+            # only the finished pack goes there. The scratch dir is removed even on failure.
+            scratch = tempfile.TemporaryDirectory(prefix="gemini-pack-")
+            out_dir = Path(scratch.name)
+        else:
+            out_dir = Path(args.out_dir)
+        gateways = _gateways_from_args(args)
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+        # JSONL plans (and stdin) are consumed lazily: work starts while later items are still
+        # being produced, and [i/N] becomes [i] since N is unknown up front.
+        plan_meta, raw_images = open_plan(args.plan)
+        total = plan_meta.get("count")
+
+        def plan_items() -> Any:
+            for i, img in enumerate(raw_images, start=1):
+                try:
+                    yield _plan_item(img, i)
+                except ValueError as e:
+                    raise SystemExit(str(e)) from None
+
+        def report_diff() -> None:
+            counts = plan_meta.get("diff")
+            if counts:
+                print("Plan diff: " + ", ".join(f"{v} {k}" for k, v in counts.items()))
+            for name in plan_meta.get("removed") or []:
+                print(f"[removed] {name} is no longer in the plan; its old image (if any) was left in place")
+
+        items: Any = plan_items()
+        if total is not None:
+            # A whole JSON plan: validate every item before spending any gateway calls.
+            if not total:
+                raise SystemExit("Plan has no images[]")
+            items = list(items)
+            report_diff()
+            if args.deadline:
+                # Most important first, then slide order, so a cut-off drops the tail.
+                items.sort(key=lambda it: (-it.priority, it.slide_number))
+
+        deadline = None
+        if args.deadline:
+            # Keep a little of the budget for drawing placeholders and shutting down.
+            deadline = run_started + float(args.deadline) - min(5.0, 0.1 * float(args.deadline))
+        pipeline = ImagePipeline.from_args(args, gateways, deadline=deadline)
+        if args.health_check:
+            pipeline.router.check(pipeline.session)
+
+        if args.journal:
+            journal_path = Path(args.journal)
+        elif args.plan == "-":
+            journal_path = out_dir / "stdin.plan.journal.jsonl"
+        else:
+            journal_path = RunJournal.default_path(Path(args.plan), out_dir)
+        journal = RunJournal(journal_path)
+        # Last good output per item: --resume trusts it, and either way its prompt_hash tells
+        # whether an existing image still matches the plan.
+        done_before = journal.completed() if not args.overwrite else {}
+
+        sink = MetricsSink() if args.metrics else None
+
+        # Jobs run on a bounded pool, but results are reported strictly in plan order so the
+        # [i/N] log reads the same regardless of --concurrency.
+        failures: list[tuple[PlanItem, Exception]] = []
+        placeholders: list[tuple[PlanItem, Exception]] = []
+        packed: list[tuple[PlanItem, Path, tuple[Path, ...]]] = []
+        cut_off = False
+        theme = str(plan_meta.get("theme") or "")
+        with pipeline:
+            # A feeder thread submits plan items as they are read; this thread reports them in
+            # plan order. Submission is never held back by the reporting: a task-based gateway
+            # gets every task up front (the poller waits on them together) even while the
+            # report still waits for the first one.
+            jobs: queue.Queue[Any] = queue.Queue()
+            stop = threading.Event()
+            end = object()
+
+            def put(entry: Any) -> bool:
+                if stop.is_set():
+                    return False
+                jobs.put(entry)
+                return True
+
+            def feed() -> None:
+                try:
+                    for item in items:
+                        out_path = pipeline.output_path(out_dir, item)
+                        # Corpus plans name items "<report>/slide-NN": one subdirectory per deck.
+                        out_path.parent.mkdir(parents=True, exist_ok=True)
+                        metrics = ItemMetrics(item.name)
+                        # The journal's prompt_hash (or make-plan's change mark) says an image is stale.
+                        rec = done_before.get(item.name)
+                        stale = output_is_stale(item, out_path, rec)
+                        if args.resume and not args.overwrite:
+                            # Only a journaled, still-intact output of the same prompt at this very
+                            # path counts as done (not one left in another --out-dir).
+                            if not stale and journaled_output(rec, out_path) is not None:
+                                if not put((item, out_path, None, metrics)):
+                                    return
+                                continue
+                        elif out_path.exists() and not args.overwrite and not stale:
+                            if not put((item, out_path, None, metrics)):
+                                return
+                            continue
+                        # Identical prompts within one run share a single gateway call.
+                        fut = pipeline.submit(
+                            item, out_path, metrics, journal=journal, theme=theme, overwrite=args.overwrite
+                        )
+                        if not put((item, out_path, fut, metrics)):
+                            return
+                    put(end)
+                except BaseException as e:
+                    put(e)
+
+            feeder = threading.Thread(target=feed, name="plan-feeder", daemon=True)
+            feeder.start()
+            i = 0
+            while True:
+                entry = jobs.get()
+                if entry is end:
+                    break
+                if isinstance(entry, BaseException):
+                    raise entry
+                item, out_path, fut, metrics = entry
+                i += 1
+                if fut is None:
+                    if sink is not None:
+                        sink.record(metrics, status="skipped", total_s=0.0)
+                    print(f"[skip] {out_path} " + ("verified" if args.resume else "exists"))
+                    renditions = pipeline.finalize_kwargs.get("renditions", ())
+                    packed.append((item, out_path, tuple(p for r in renditions if (p := r.path_for(out_path)).exists())))
+                    continue
+
+                progress = f"[{i}/{total}]" if total else f"[{i}]"
+                print(f"{progress} {item.name} (slide {item.slide_number})")
+                try:
+                    res = _resolve(fut, deadline=deadline)
+                except Exception as e:
+                    if deadline is not None:
+                        # Deliver on time: whatever is not ready (or failed) gets a themed
+                        # stand-in now; --resume regenerates it later.
+                        if time.time() >= deadline and not cut_off:
+                            cut_off = True
+                            pipeline.cancel_pending(wait=False)
+                        res = pipeline.write_placeholder(item, out_path, theme)
+                        reason = "deadline" if isinstance(e, TimeoutError) or time.time() >= deadline else str(e)
+                        journal.append(item.name, "placeholder", path=str(res.path.resolve()), error=reason[:500])
+                        if sink is not None:
+                            sink.record(metrics, status="placeholder", total_s=time.time() - metrics.created)
+                        placeholders.append((item, e))
+                        packed.append((item, res.path, res.extras))
+                        print(f"  ~> {res.path} (placeholder: {reason[:200]})")
+                        continue
+                    journal.append(item.name, "failed", error=str(e)[:500])
+                    if sink is not None:
+                        sink.record(metrics, status="failed", total_s=time.time() - metrics.created)
+                    if not args.keep_going:
+                        # Stop reading the plan and drop queued jobs; in-flight ones finish
+                        # before the pool exits.
+                        stop.set()
+                        pipeline.cancel_pending()
+                        raise
+                    failures.append((item, e))
+                    print(f"  !! {item.name} failed: {e}")
+                    continue
+                pipeline.journal_done(journal, item, res)
+                packed.append((item, res.path, res.extras))
+                if sink is not None:
+                    sink.record(metrics, status="done", total_s=res.elapsed_s, source=res.source)
+                print(f"  -> {res.path}" + (" (cached)" if res.source == "cache" else _best_of(res)))
+                for extra in res.extras:
+                    print(f"     + {extra.name}")
+
+        if total is None:
+            if not i:
+                raise SystemExit("Plan has no items")
+            report_diff()
+        if sink is not None:
+            metrics_path = Path(args.metrics)
+            sink.write_jsonl(metrics_path)
+            sink.write_prometheus(Path(args.metrics_prom) if args.metrics_prom else metrics_path.with_suffix(".prom"))
+            print(sink.summary())
+        summary = pipeline.summary()
+        if summary:
+            print(summary)
+        if placeholders:
+            print(
+                f"{len(placeholders)}/{i} images are placeholders (--deadline {args.deadline:g}s): "
+                + ", ".join(it.name for it, _ in placeholders)
+                + "; rerun with --resume to fill them in"
+            )
+        if args.pack and packed:
+            pack = ImagePack.write(Path(args.pack), packed, theme=theme)
+            size = pack.path.stat().st_size
+            print(f"Packed {len(pack.entries)} images into {pack.path} ({size / (1024 * 1024):.1f} MiB)")
+        if scratch is not None:
+            scratch.cleanup()
+
+        if failures:
+            raise SystemExit(
+                f"{len(failures)}/{i} images failed: " + ", ".join(it.name for it, _ in failures)
             )
-            print(f"  -> {out_path}")
 
         print("Done.")
         return
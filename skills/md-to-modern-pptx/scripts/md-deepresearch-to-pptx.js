@@ -4,6 +4,7 @@
 
   Usage:
     node scripts/md-deepresearch-to-pptx.js --in input.md --out output.pptx --theme golden-hour
+    node scripts/md-deepresearch-to-pptx.js --in input.md --out output.pptx --images-pack deck.imgpack.zip
 
   Notes:
   - Expects a "Deep Research" markdown structure (see references/deepresearch-md-contract.md).
@@ -408,11 +409,42 @@ function findSlideImage(imagesDir, slideNumber) {
     path.join(imagesDir, `slide-${String(slideNumber).padStart(2, "0")}.webp`),
   ];
   for (const c of candidates) {
-    if (fs.existsSync(c)) return c;
+    if (fs.existsSync(c)) return { path: c };
   }
   return null;
 }
 
+// Single-file image pack from `gemini_image_pack.py generate --pack`: the zip comment
+// "imgpack manifest=<offset>,<length>" locates manifest.json, whose entries give each
+// image's byte range, so one slide's image is read without unpacking the archive.
+// Packs covering several reports name items "<report>/slide-NN": only this deck's
+// report is used (the markdown file's name, or "<name>-01" for the first report of a
+// file holding several), falling back to unprefixed "slide-NN" from single-report packs.
+function loadImagePack(packPath, decks) {
+  const fd = fs.openSync(packPath, "r");
+  const size = fs.fstatSync(fd).size;
+  const readAt = (offset, length) => {
+    const buf = Buffer.alloc(length);
+    fs.readSync(fd, buf, 0, length, offset);
+    return buf;
+  };
+  const tailLen = Math.min(size, 1024);
+  const m = /imgpack manifest=(\d+),(\d+)$/.exec(readAt(size - tailLen, tailLen).toString("latin1"));
+  if (!m) throw new Error(`不是图片包（缺少 manifest 索引）：${packPath}`);
+  const manifest = JSON.parse(readAt(Number(m[1]), Number(m[2])).toString("utf8"));
+  const entries = (manifest.images || []).filter((e) => !e.rendition);
+
+  const byItem = new Map(entries.map((e) => [e.item, e]));
+  const deck = decks.find((d) => entries.some((e) => e.item.startsWith(`${d}/`)));
+
+  return (slideNumber) => {
+    const item = `slide-${String(slideNumber).padStart(2, "0")}`;
+    const e = (deck && byItem.get(`${deck}/${item}`)) || byItem.get(item);
+    if (!e) return null;
+    return { data: `${e.mime};base64,${readAt(e.offset, e.bytes).toString("base64")}` };
+  };
+}
+
 function addRightPanel(slide, pres, palette, fonts, opts) {
   const x = 6.85;
   const y = 1.8;
@@ -427,7 +459,7 @@ function addRightPanel(slide, pres, palette, fonts, opts) {
     { shadow: true, fill: mix(palette.card, palette.accent2, 0.05) },
   );
 
-  if (opts?.imagePath) {
+  if (opts?.image) {
     slide.addText("Illustration", {
       x: x + 0.2,
       y: y + 0.22,
@@ -441,7 +473,7 @@ function addRightPanel(slide, pres, palette, fonts, opts) {
     });
 
     slide.addImage({
-      path: opts.imagePath,
+      ...opts.image,
       x: x + 0.18,
       y: y + 0.58,
       w: w - 0.36,
@@ -564,6 +596,7 @@ async function buildDeck(mdPath, outPath, themeSlug, opts = {}) {
   let page = 1;
   const footerLeft = `${stripMd(title)}${date ? ` • ${date}` : ""}`.trim();
   const imagesDir = opts?.imagesDir || null;
+  const slideImage = opts?.slideImage || (imagesDir ? (n) => findSlideImage(imagesDir, n) : null);
 
   // Slide 1: Title
   {
@@ -771,12 +804,12 @@ async function buildDeck(mdPath, outPath, themeSlug, opts = {}) {
       });
     }
 
-    const imagePath = imagesDir ? findSlideImage(imagesDir, page) : null;
+    const image = slideImage ? slideImage(page) : null;
     addRightPanel(slide, pres, palette, fonts, {
       title: "要点",
       bullets: bullets.length > 0 ? bullets.slice(0, 3) : [stripMd(a.title)],
-      imagePath,
-      caption: imagePath ? "AI-generated (Gemini)" : null,
+      image,
+      caption: image ? "AI-generated (Gemini)" : null,
     });
   }
 
@@ -954,11 +987,13 @@ async function main() {
   const themeSlug = argValue(argv, "--theme") || "golden-hour";
   const imagesDirArg = argValue(argv, "--images-dir");
   const imagesDir = imagesDirArg ? path.resolve(process.cwd(), imagesDirArg) : null;
+  const imagesPackArg = argValue(argv, "--images-pack");
+  const imagesPackDeck = argValue(argv, "--images-pack-deck");
   const noImages = argFlag(argv, "--no-images");
 
   if (!inPath || !outPath) {
     console.error(
-      "用法：node md-deepresearch-to-pptx.js --in input.md --out output.pptx [--theme golden-hour] [--images-dir images/] [--no-images]",
+      "用法：node md-deepresearch-to-pptx.js --in input.md --out output.pptx [--theme golden-hour] [--images-dir images/ | --images-pack deck.imgpack.zip [--images-pack-deck NAME]] [--no-images]",
     );
     process.exit(2);
   }
@@ -971,7 +1006,15 @@ async function main() {
     process.exit(1);
   }
 
-  await buildDeck(absIn, absOut, themeSlug, { imagesDir: noImages ? null : imagesDir });
+  const stem = path.basename(absIn, path.extname(absIn));
+  const slideImage =
+    imagesPackArg && !noImages
+      ? loadImagePack(
+          path.resolve(process.cwd(), imagesPackArg),
+          imagesPackDeck ? [imagesPackDeck] : [stem, `${stem}-01`],
+        )
+      : null;
+  await buildDeck(absIn, absOut, themeSlug, { imagesDir: noImages ? null : imagesDir, slideImage });
   console.log(`已生成：${absOut}`);
 }
 
@@ -0,0 +1,292 @@
+"""
+Local stand-in for an image gateway, for offline benchmarks and debugging of
+gemini_image_pack.py. It speaks every response shape the client handles:
+
+  native    POST /v1beta/models/<model>:generateContent -> candidates[].content.parts[].inlineData
+  b64_json  POST /v1/images/generations -> {"data": [{"b64_json": ...}]}
+  url       POST /v1/images/generations -> {"data": [{"url": ".../files/<id>.png"}]}
+  task      POST /v1/images/generations -> {"data": {"task_id": ...}}, then GET /v1/tasks/<id>
+
+plus GET /v1/models, GET /files/<id>.png (with Range support) and GET /_stats (request counters).
+
+  python stub_gateway.py --mode native --latency 0.8 --width 2048 --height 1152 --error-rate 0.1
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+
+@dataclass
+class StubConfig:
+    mode: str = "native"  # native | b64_json | url | task
+    latency_s: float = 0.5
+    jitter_s: float = 0.0
+    width: int = 1376
+    height: int = 768
+    # Random pixels make PNG payloads as large as real 2K/4K art; flat colour is tiny.
+    noise: bool = False
+    # Fraction of generation calls answered with one of error_statuses instead of an image.
+    error_rate: float = 0.0
+    error_statuses: tuple[int, ...] = (429, 503)
+    retry_after_s: float | None = 1.0
+    # When set (e.g. "google/"), native model paths without this prefix get HTTP 400.
+    require_model_prefix: str | None = None
+    task_duration_s: float = 2.0
+    # Seconds each /files GET (whole file or one range) takes; stats["files_inflight_max"] shows overlap.
+    file_latency_s: float = 0.0
+
+
+def make_png(width: int, height: int, *, noise: bool) -> bytes:
+    import io
+    import os
+
+    from PIL import Image  # type: ignore
+
+    if noise:
+        im = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    else:
+        im = Image.new("RGB", (width, height), (214, 150, 60))
+    buf = io.BytesIO()
+    im.save(buf, format="PNG", compress_level=1)
+    return buf.getvalue()
+
+
+class StubGateway:
+    """Threaded stub server; use as a context manager or call start()/stop()."""
+
+    def __init__(self, config: StubConfig, *, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.config = config
+        self.png = make_png(config.width, config.height, noise=config.noise)
+        self.png_b64 = base64.b64encode(self.png).decode("ascii")
+        self.tasks: dict[str, float] = {}
+        self.stats: dict[str, int] = {}
+        self._files_inflight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> StubGateway:
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> StubGateway:
+        return self.start()
+
+    def __exit__(self, *exc: object) -> None:
+        self.stop()
+
+    def count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args: object) -> None:
+                pass
+
+            def _send(self, status: int, body: bytes, ctype: str, headers: dict[str, str] | None = None) -> None:
+                self.send_response(status)
+                self.send_header("content-type", ctype)
+                self.send_header("content-length", str(len(body)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _json(self, status: int, obj: Any, headers: dict[str, str] | None = None) -> None:
+                self._send(status, json.dumps(obj).encode("utf-8"), "application/json", headers)
+
+            def _generation_delay_or_error(self) -> bool:
+                cfg = stub.config
+                time.sleep(max(0.0, cfg.latency_s + random.uniform(-cfg.jitter_s, cfg.jitter_s)))
+                if cfg.error_rate > 0 and random.random() < cfg.error_rate:
+                    status = random.choice(cfg.error_statuses)
+                    stub.count(f"injected_{status}")
+                    headers = {"retry-after": f"{cfg.retry_after_s:g}"} if cfg.retry_after_s is not None else {}
+                    self._json(status, {"error": {"code": status, "message": "injected by stub_gateway"}}, headers)
+                    return True
+                return False
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("content-length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                cfg = stub.config
+
+                m = re.fullmatch(r"/v1beta/models/(.+):generateContent", self.path)
+                if m:
+                    stub.count("native")
+                    if cfg.mode != "native":
+                        self._json(404, {"error": "native route disabled"})
+                        return
+                    if cfg.require_model_prefix and not m.group(1).startswith(cfg.require_model_prefix):
+                        stub.count("native_wrong_path")
+                        self._json(400, {"error": {"message": f"unknown model {m.group(1)}"}})
+                        return
+                    if self._generation_delay_or_error():
+                        return
+                    n = int(((body.get("generationConfig") or {}).get("candidateCount")) or 1)
+                    part = {"inlineData": {"mimeType": "image/png", "data": stub.png_b64}}
+                    self._json(200, {"candidates": [{"content": {"parts": [part]}} for _ in range(n)]})
+                    return
+
+                if self.path == "/v1/images/generations":
+                    stub.count("images_generations")
+                    if self._generation_delay_or_error():
+                        return
+                    n = int(body.get("n") or 1)
+                    mode = "b64_json" if cfg.mode == "native" else cfg.mode
+                    if mode == "task":
+                        task_id = uuid.uuid4().hex
+                        with stub._lock:
+                            stub.tasks[task_id] = time.time() + cfg.task_duration_s
+                        self._json(200, {"data": {"task_id": task_id, "status": "queued"}})
+                    elif mode == "url":
+                        self._json(200, {"data": [{"url": f"{stub.base_url}/files/{uuid.uuid4().hex}.png"}] * n})
+                    else:
+                        self._json(200, {"data": [{"b64_json": stub.png_b64}] * n})
+                    return
+
+                self._json(404, {"error": f"no route for POST {self.path}"})
+
+            def do_GET(self) -> None:
+                path = self.path.split("?", 1)[0]
+                if path.startswith("/v1/tasks/"):
+                    stub.count("task_poll")
+                    task_id = path.rsplit("/", 1)[-1]
+                    with stub._lock:
+                        due = stub.tasks.get(task_id)
+                    if due is None:
+                        self._json(404, {"error": "unknown task"})
+                    elif time.time() < due:
+                        self._json(200, {"data": {"status": "running"}})
+                    else:
+                        url = f"{stub.base_url}/files/{task_id}.png"
+                        self._json(200, {"data": {"status": "success", "result": {"images": [{"url": [url]}]}}})
+                    return
+
+                if path.startswith("/files/"):
+                    stub.count("file")
+                    with stub._lock:
+                        stub._files_inflight += 1
+                        peak = max(stub.stats.get("files_inflight_max", 0), stub._files_inflight)
+                        stub.stats["files_inflight_max"] = peak
+                    try:
+                        time.sleep(stub.config.file_latency_s)
+                        self._send_file()
+                    finally:
+                        with stub._lock:
+                            stub._files_inflight -= 1
+                    return
+
+                if path == "/v1/models":
+                    stub.count("models")
+                    self._json(200, {"data": [{"id": "gemini-3-pro-image-preview"}, {"id": "stub-image"}]})
+                    return
+
+                if path == "/_stats":
+                    with stub._lock:
+                        self._json(200, dict(stub.stats))
+                    return
+
+                self._json(404, {"error": f"no route for GET {path}"})
+
+            def _send_file(self) -> None:
+                data = stub.png
+                m = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("range") or "")
+                if m:
+                    start = int(m.group(1))
+                    end = int(m.group(2)) if m.group(2) else len(data) - 1
+                    chunk = data[start : end + 1]
+                    self._send(
+                        206,
+                        chunk,
+                        "image/png",
+                        {"accept-ranges": "bytes", "content-range": f"bytes {start}-{start + len(chunk) - 1}/{len(data)}"},
+                    )
+                else:
+                    self._send(200, data, "image/png", {"accept-ranges": "bytes"})
+
+            def do_HEAD(self) -> None:
+                if self.path.startswith("/files/"):
+                    self.send_response(200)
+                    self.send_header("content-type", "image/png")
+                    self.send_header("content-length", str(len(stub.png)))
+                    self.send_header("accept-ranges", "bytes")
+                    self.end_headers()
+                    return
+                self.send_response(404)
+                self.send_header("content-length", "0")
+                self.end_headers()
+
+        return Handler
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Local stub image gateway for offline benchmarks.")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=0, help="0 = pick a free port (printed on stdout)")
+    p.add_argument("--mode", choices=("native", "b64_json", "url", "task"), default="native")
+    p.add_argument("--latency", type=float, default=0.5, help="Seconds per generation call")
+    p.add_argument("--jitter", type=float, default=0.0, help="+/- uniform jitter on --latency")
+    p.add_argument("--width", type=int, default=1376)
+    p.add_argument("--height", type=int, default=768)
+    p.add_argument("--noise", action="store_true", help="Random pixels (realistic payload size)")
+    p.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls answered with an error")
+    p.add_argument("--error-statuses", default="429,503", help="Comma list of injected statuses")
+    p.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds on injected errors (<0: omit)")
+    p.add_argument("--require-model-prefix", default=None, help='e.g. "google/": 400 on other native model paths')
+    p.add_argument("--task-duration", type=float, default=2.0, help="Seconds until a task succeeds")
+    p.add_argument("--file-latency", type=float, default=0.0, help="Seconds per /files GET (or range)")
+    args = p.parse_args()
+
+    config = StubConfig(
+        mode=args.mode,
+        latency_s=args.latency,
+        jitter_s=args.jitter,
+        width=args.width,
+        height=args.height,
+        noise=args.noise,
+        error_rate=args.error_rate,
+        error_statuses=tuple(int(x) for x in args.error_statuses.split(",") if x.strip()),
+        retry_after_s=None if args.retry_after < 0 else args.retry_after,
+        require_model_prefix=args.require_model_prefix,
+        task_duration_s=args.task_duration,
+        file_latency_s=args.file_latency,
+    )
+    stub = StubGateway(config, host=args.host, port=args.port).start()
+    print(stub.base_url, flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
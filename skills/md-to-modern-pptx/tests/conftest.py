@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import contextlib
+import os
+import sys
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+SCRIPTS_DIR = Path(__file__).resolve().parents[1] / "scripts"
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+
+@pytest.fixture
+def stub() -> Any:
+    """Factory for started stub gateways (stub_gateway.py), stopped after the test."""
+    from stub_gateway import StubConfig, StubGateway
+
+    started: list[StubGateway] = []
+
+    def make(**config: Any) -> StubGateway:
+        config.setdefault("latency_s", 0.0)
+        config.setdefault("width", 320)
+        config.setdefault("height", 180)
+        gw = StubGateway(StubConfig(**config)).start()
+        started.append(gw)
+        return gw
+
+    yield make
+    for gw in started:
+        gw.stop()
+
+
+@pytest.fixture
+def pipeline(tmp_path: Path) -> Any:
+    """Factory for an ImagePipeline over the given stub gateways (opened; closed after the test)."""
+    import gemini_image_pack as gip
+
+    stack = contextlib.ExitStack()
+
+    def make(*gateways: Any, concurrency: int = 2, **kwargs: Any) -> Any:
+        kwargs.setdefault("cache", None)
+        kwargs.setdefault("limiter_kwargs", {"max_retries": 0})
+        kwargs.setdefault(
+            "finalize_kwargs",
+            {
+                "out_width": 320,
+                "out_height": 180,
+                "no_resize": False,
+                "png_compress_level": 1,
+                "png_optimize": False,
+                "out_format": "png",
+                "quality": 85,
+                "renditions": (),
+            },
+        )
+        pipe = gip.ImagePipeline(
+            [
+                gip.Gateway(f"gw{i}", gw.base_url, "k", "gemini-3-pro-image-preview", auth_mode="bearer")
+                for i, gw in enumerate(gateways)
+            ],
+            concurrency=concurrency,
+            capabilities=gip.GatewayCapabilities(tmp_path / "gateways.json", ttl_s=0),
+            convert_workers=0,
+            timeout_s=30,
+            poll_interval_s=0.05,
+            poll_max_interval_s=0.2,
+            **kwargs,
+        )
+        return stack.enter_context(pipe)
+
+    yield make
+    stack.close()
+
+
+@pytest.fixture
+def cli(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Any:
+    """Run gemini_image_pack's CLI in-process, with a private cache dir and no .env."""
+    import gemini_image_pack as gip
+
+    monkeypatch.setenv("CHERRY_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.chdir(tmp_path)
+
+    def run(*argv: str) -> None:
+        monkeypatch.setattr(sys, "argv", ["gemini_image_pack.py", "--dotenv", os.devnull, *argv])
+        gip.main()
+
+    return run
+
+
+def write_plan(path: Path, prompts: dict[str, str], **fields: Any) -> Path:
+    """Version-1 plan with one item per (name -> prompt), slide numbers in order from 5."""
+    import json
+
+    images = [
+        {"name": name, "slide_number": i, "size": "16:9", "resolution": "1K", "prompt": prompt, **fields}
+        for i, (name, prompt) in enumerate(prompts.items(), start=5)
+    ]
+    path.write_text(json.dumps({"version": 1, "theme": "golden-hour", "images": images}), encoding="utf-8")
+    return path
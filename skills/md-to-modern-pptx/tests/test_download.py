@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+import gemini_image_pack as gip
+
+
+class FileServer:
+    """One file over HTTP; options break it the ways CDNs do (ignored ranges, drops, bad MD5)."""
+
+    def __init__(
+        self,
+        data: bytes,
+        *,
+        ranges: bool = True,
+        honour_range: bool = True,
+        drop_first_at: int = 0,
+        md5: str | None = None,
+    ) -> None:
+        self.data = data
+        self.ranges = ranges
+        self.honour_range = honour_range
+        self.drop_first_at = drop_first_at
+        self.md5 = md5
+        self.requests: list[str] = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args: object) -> None:
+                pass
+
+            def _headers(self, status: int, length: int, extra: dict[str, str]) -> None:
+                self.send_response(status)
+                self.send_header("content-type", "image/png")
+                self.send_header("content-length", str(length))
+                if server.ranges:
+                    self.send_header("accept-ranges", "bytes")
+                if server.md5:
+                    self.send_header("content-md5", server.md5)
+                for k, v in extra.items():
+                    self.send_header(k, v)
+                self.end_headers()
+
+            def do_HEAD(self) -> None:
+                server.requests.append("HEAD")
+                self._headers(200, len(server.data), {})
+
+            def do_GET(self) -> None:
+                rng = self.headers.get("range") or ""
+                server.requests.append(f"GET {rng}".strip())
+                m = re.fullmatch(r"bytes=(\d+)-(\d*)", rng)
+                if m and server.honour_range:
+                    start = int(m.group(1))
+                    end = int(m.group(2)) if m.group(2) else len(server.data) - 1
+                    body = server.data[start : end + 1]
+                    self._headers(206, len(body), {"content-range": f"bytes {start}-{end}/{len(server.data)}"})
+                    self.wfile.write(body)
+                    return
+                self._headers(200, len(server.data), {})
+                if server.drop_first_at:
+                    # Promise the whole file, send part of it, hang up (once).
+                    cut, server.drop_first_at = server.drop_first_at, 0
+                    self.wfile.write(server.data[:cut])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    self.connection.shutdown(2)
+                    return
+                self.wfile.write(server.data)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return "http://{}:{}/files/image.png".format(*self.httpd.server_address[:2])
+
+    def close(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def serve_file() -> Any:
+    servers: list[FileServer] = []
+
+    def make(data: bytes, **options: Any) -> FileServer:
+        servers.append(FileServer(data, **options))
+        return servers[-1]
+
+    yield make
+    for s in servers:
+        s.close()
+
+
+@pytest.fixture
+def small_ranges(monkeypatch: pytest.MonkeyPatch) -> None:
+    # Ranged downloads for anything over 1 KiB, in 16 KiB parts.
+    monkeypatch.setattr(gip, "_RANGED_MIN_BYTES", 1024)
+    monkeypatch.setattr(gip, "_RANGE_PART_BYTES", 16 * 1024)
+
+
+DATA = os.urandom(100 * 1024)
+
+
+def test_ranged_download_reassembles_the_file(serve_file: Any, small_ranges: None, tmp_path: Path) -> None:
+    srv = serve_file(DATA, md5=base64.b64encode(hashlib.md5(DATA).digest()).decode())
+    out = tmp_path / "out.png"
+    gip._download_to(srv.url, out, max_parts=4)
+    assert out.read_bytes() == DATA
+    assert sum(1 for r in srv.requests if r.startswith("GET bytes=")) == 4
+    assert not list(tmp_path.glob(".*.tmp"))
+
+
+def test_ignored_ranges_fall_back_to_one_stream(serve_file: Any, small_ranges: None, tmp_path: Path) -> None:
+    srv = serve_file(DATA, honour_range=False)
+    out = tmp_path / "out.png"
+    gip._download_to(srv.url, out, max_parts=4)
+    assert out.read_bytes() == DATA
+    assert "GET" in srv.requests
+
+
+def test_dropped_stream_resumes_from_its_last_byte(serve_file: Any, tmp_path: Path) -> None:
+    # Big enough that whole 256 KiB chunks land before the drop.
+    data = os.urandom(1024 * 1024)
+    srv = serve_file(data, drop_first_at=600 * 1024)
+    out = tmp_path / "out.png"
+    gip._download_to(srv.url, out, max_parts=1)
+    assert out.read_bytes() == data
+    resumed = [r for r in srv.requests if r.startswith("GET bytes=")]
+    assert len(resumed) == 1 and int(resumed[0][len("GET bytes=") : -1]) > 0
+
+
+def test_md5_mismatch_is_rejected(serve_file: Any, tmp_path: Path) -> None:
+    srv = serve_file(DATA, md5=base64.b64encode(hashlib.md5(b"other").digest()).decode())
+    out = tmp_path / "out.png"
+    with pytest.raises(RuntimeError, match="MD5"):
+        gip._download_to(srv.url, out, max_parts=1)
+    assert not out.exists()
+
+
+def test_ranges_overlap_even_at_concurrency_one(stub: Any, pipeline: Any, small_ranges: None, tmp_path: Path) -> None:
+    # One worker means a one-connection generation pool; downloads have their own.
+    gw = stub(mode="url", noise=True, file_latency_s=0.3)
+    pipe = pipeline(gw, concurrency=1)
+    out = tmp_path / "slide-05.png"
+    pipe.submit(gip.PlanItem("slide-05", 5, "p"), out, gip.ItemMetrics("slide-05")).result(timeout=30)
+    assert out.exists()
+    assert gw.stats["file"] >= 4
+    assert gw.stats["files_inflight_max"] >= 2
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import time
+from concurrent.futures import Future
+
+import pytest
+
+import gemini_image_pack as gip
+
+
+def test_limit_halves_on_throttling_and_grows_back_additively() -> None:
+    lim = gip.GatewayLimiter(max_concurrency=8)
+    before_cut = lim.acquire()
+    lim.record(lim.acquire(), 429)
+    assert lim.limit == 4
+    lim.record(before_cut, 503)  # sent before the cut: already paid for
+    assert lim.limit == 4
+    lim.record(lim.acquire(), 503)
+    assert lim.limit == 2
+    lim.record(lim.acquire(), 200)
+    assert lim.limit == 2.5
+    # About one step per round of `limit` successes, capped at max_concurrency.
+    for _ in range(3):
+        lim.record(lim.acquire(), 200)
+    assert 3.0 < lim.limit < 4.0
+    for _ in range(100):
+        lim.record(lim.acquire(), 200)
+    assert lim.limit == 8
+    assert lim.throttled == 3
+
+
+def test_breaker_opens_half_opens_and_closes() -> None:
+    lim = gip.GatewayLimiter(max_concurrency=2, breaker_threshold=3, breaker_cooldown_s=0.1)
+    for _ in range(3):
+        lim.record(lim.acquire(), 500)
+    assert not lim.available()
+    with pytest.raises(gip.CircuitOpenError):
+        lim.acquire()
+
+    time.sleep(0.15)
+    assert lim.available()
+    probe = lim.acquire()  # half-open: one probe, the others wait for its verdict
+    assert not lim.available() and not lim.has_capacity()
+    lim.record(probe, None)  # failed probe: open again, for twice as long
+    assert lim.trips == 2
+    time.sleep(0.15)
+    with pytest.raises(gip.CircuitOpenError):
+        lim.acquire()
+
+    time.sleep(0.1)
+    lim.record(lim.acquire(), 200)
+    assert lim.available() and lim.has_capacity()
+    lim.record(lim.acquire(), 500)  # one failure after closing does not trip it
+    assert lim.available()
+
+
+def test_token_bucket_keeps_to_its_rate() -> None:
+    lim = gip.GatewayLimiter(max_concurrency=4, rate_per_s=20, burst=2)
+    started = time.monotonic()
+    for _ in range(2):
+        lim.release(lim.acquire())
+    assert time.monotonic() - started < 0.05  # the burst goes at once
+    assert not lim.has_capacity()
+    for _ in range(4):
+        lim.release(lim.acquire())
+    assert time.monotonic() - started >= 4 / 20 - 0.01
+
+
+def _router(*names: str) -> gip.GatewayRouter:
+    gateways = [gip.Gateway(n, f"http://{n}.invalid", "k", "gemini-3-pro-image-preview") for n in names]
+    return gip.GatewayRouter(gateways, make_limiter=lambda g: gip.GatewayLimiter(max_concurrency=2))
+
+
+def test_router_fails_over_and_scores_gateways(monkeypatch: pytest.MonkeyPatch) -> None:
+    router = _router("bad", "good")
+
+    def fetch_image(*, base_url: str, **kwargs: object) -> str:
+        if "bad" in base_url:
+            raise RuntimeError("HTTP 500")
+        return "image"
+
+    monkeypatch.setattr(gip, "fetch_image", fetch_image)
+    monkeypatch.setattr(gip.random, "choices", lambda candidates, weights: [candidates[0]])
+    out, gw = router.fetch(prompt="p")
+    assert (out, gw.name) == ("image", "good")
+    bad, good = router.states
+    assert bad.failures == 1 and bad.error_rate > 0 and bad.latency_s is None
+    assert good.failures == 0 and good.error_rate == 0 and good.latency_s is not None
+    assert bad.inflight == good.inflight == 0
+
+
+def test_router_releases_the_slot_when_the_deadline_cuts_a_call(monkeypatch: pytest.MonkeyPatch) -> None:
+    router = _router("only")
+
+    def fetch_image(**kwargs: object) -> str:
+        raise gip.DeadlineExceeded("Run deadline reached")
+
+    monkeypatch.setattr(gip, "fetch_image", fetch_image)
+    for _ in range(3):
+        with pytest.raises(gip.DeadlineExceeded):
+            router.fetch(prompt="p")
+    st = router.states[0]
+    # Not counted against the gateway, and not left looking busy to pick() or /v1/health.
+    assert st.inflight == 0 and st.failures == 0 and st.error_rate == 0
+
+    pending: Future[str] = Future()
+    monkeypatch.setattr(gip, "fetch_image", lambda **kwargs: pending)
+    router.fetch(prompt="p")
+    assert st.inflight == 1
+    pending.set_exception(gip.DeadlineExceeded("Run deadline reached while task t1 was running"))
+    assert st.inflight == 0 and st.failures == 0
@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any
+
+import gemini_image_pack as gip
+
+HEDGE = {"percentile": 90, "budget": 4, "initial_after_s": 0.05}
+
+
+def _run(pipe: Any, tmp_path: Path, *names: str) -> list[Any]:
+    futures = [
+        pipe.submit(gip.PlanItem(n, 5, f"prompt for {n}"), tmp_path / f"{n}.png", gip.ItemMetrics(n)) for n in names
+    ]
+    return [f.result(timeout=30) for f in futures]
+
+
+def test_no_hedge_without_a_free_slot(stub: Any, pipeline: Any, tmp_path: Path) -> None:
+    # One gateway, one slot: a hedge would only queue behind the primary it should overtake.
+    gw = stub(latency_s=0.4)
+    pipe = pipeline(gw, concurrency=1, hedge_kwargs=HEDGE)
+    _run(pipe, tmp_path, "slide-05", "slide-06")
+    assert pipe.hedger.spent == 0
+    assert pipe.hedger.skipped >= 1
+    assert gw.stats["native"] == 2
+
+
+def test_hedge_is_sent_and_charged_when_a_slot_is_free(stub: Any, pipeline: Any, tmp_path: Path) -> None:
+    gw = stub(latency_s=0.4)
+    pipe = pipeline(gw, concurrency=2, hedge_kwargs=HEDGE)
+    _run(pipe, tmp_path, "slide-05")
+    assert pipe.hedger.spent == 1
+    assert pipe.hedger.skipped == 0
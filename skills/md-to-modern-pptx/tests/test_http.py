@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any
+
+import pytest
+import requests
+
+import gemini_image_pack as gip
+
+
+def test_waiting_for_a_pooled_connection_is_bounded(stub: Any) -> None:
+    gw = stub(latency_s=1.5)
+    url = f"{gw.base_url}/v1beta/models/gemini-3-pro-image-preview:generateContent"
+    with gip.make_http_session(pool_size=1) as session:
+        busy = threading.Thread(target=lambda: session.post(url, json={}, timeout=10))
+        busy.start()
+        time.sleep(0.2)  # the only connection is held by the slow call
+        started = time.time()
+        with pytest.raises(requests.ConnectTimeout):
+            session.get(f"{gw.base_url}/v1/models", timeout=(0.3, 10))
+        assert time.time() - started < 1.0
+        busy.join()
+        assert session.get(f"{gw.base_url}/v1/models", timeout=(0.3, 10)).ok
+
+
+def test_task_polls_do_not_share_the_generation_pool(stub: Any, pipeline: Any) -> None:
+    pipe = pipeline(stub())
+    assert pipe.poller.session is pipe.poll_session
+    assert pipe.poll_session is not pipe.session
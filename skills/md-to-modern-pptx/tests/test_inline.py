@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+import base64
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+import gemini_image_pack as gip
+
+IMAGES = [os.urandom(3000), os.urandom(1001)]
+
+
+def _body() -> bytes:
+    parts = [{"text": "here you go", "data": "not an image"}]
+    parts += [{"inlineData": {"mimeType": "image/webp", "data": base64.b64encode(raw).decode()}} for raw in IMAGES]
+    # Some JSON encoders escape "/" as "\/", which is not valid base64 on its own.
+    return json.dumps({"candidates": [{"content": {"parts": parts}}]}).replace("/", "\\/").encode()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64, 1 << 20])
+def test_scanner_decodes_across_chunk_boundaries(tmp_path: Path, chunk_size: int) -> None:
+    body = _body()
+    assert b"\\/" in body
+    scanner = gip._InlineImageScanner(tmp_path)
+    for i in range(0, len(body), chunk_size):
+        scanner.feed(body[i : i + chunk_size])
+    assert [p.read_bytes() for p in scanner.blobs] == IMAGES
+    skeleton = json.loads(bytes(scanner.skeleton))
+    parts = skeleton["candidates"][0]["content"]["parts"]
+    assert parts[0] == {"text": "here you go", "data": "not an image"}
+    assert [p["inlineData"] for p in parts[1:]] == [{"mimeType": "image/webp", "data": ""}] * 2
+    scanner.discard()
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any
+
+from conftest import write_plan
+
+import gemini_image_pack as gip
+
+
+def test_completed_keeps_the_last_done_record(tmp_path: Path) -> None:
+    journal = gip.RunJournal(tmp_path / "plan.journal.jsonl")
+    journal.append("slide-05", "done", path="a.png")
+    journal.append("slide-06", "done", path="b.png")
+    journal.append("slide-06", "started")
+    journal.append("slide-07", "placeholder", path="c.png")
+    with journal.path.open("a", encoding="utf-8") as f:
+        f.write('{"name": "slide-08", "status": "do')  # crash mid-append
+    assert set(journal.completed()) == {"slide-05"}
+
+
+def test_verify_output_rejects_changed_files(tmp_path: Path) -> None:
+    from PIL import Image
+
+    path = tmp_path / "slide-05.png"
+    Image.new("RGB", (8, 8)).save(path)
+    rec = {"path": str(path), "bytes": path.stat().st_size, "sha256": gip._sha256_file(path)}
+    assert gip.verify_output(rec) == path
+    path.write_bytes(path.read_bytes()[:-4] + b"\0\0\0\0")
+    assert gip.verify_output(rec) is None
+    assert gip.verify_output({**rec, "path": str(tmp_path / "missing.png")}) is None
+
+
+def _generate(cli: Any, base_url: str, plan: Path, *extra: str) -> None:
+    cli("generate", "--plan", str(plan), "--base-url", base_url, "--key", "k", "--model", "gemini-3-pro-image-preview", *extra)
+
+
+def test_resume_redoes_only_damaged_outputs(cli: Any, stub: Any, tmp_path: Path, capsys: Any) -> None:
+    gw = stub()
+    plan = write_plan(tmp_path / "plan.json", {"slide-05": "first", "slide-06": "second"})
+    _generate(cli, gw.base_url, plan, "--no-cache")
+    assert gw.stats["native"] == 2
+    capsys.readouterr()
+
+    (tmp_path / "images" / "slide-06.png").write_bytes(b"not an image")
+    _generate(cli, gw.base_url, plan, "--no-cache", "--resume")
+    out = capsys.readouterr().out
+    assert "[skip] " in out and "slide-05.png verified" in out
+    assert gw.stats["native"] == 3
+
+    journal = tmp_path / "images" / "plan.journal.jsonl"
+    assert gip.RunJournal.default_path(plan, tmp_path / "images") == journal
+    records = [json.loads(l) for l in journal.read_text(encoding="utf-8").splitlines()]
+    assert [r["status"] for r in records if r["name"] == "slide-06"] == ["started", "done", "started", "done"]
+
+
+def test_resume_into_another_out_dir_regenerates(cli: Any, stub: Any, tmp_path: Path, capsys: Any) -> None:
+    gw = stub()
+    plan = write_plan(tmp_path / "plan.json", {"slide-05": "first"})
+    journal = tmp_path / "run.journal.jsonl"
+    _generate(cli, gw.base_url, plan, "--no-cache", "--journal", str(journal))
+    _generate(cli, gw.base_url, plan, "--no-cache", "--journal", str(journal), "--resume", "--out-dir", "other")
+    assert "[skip]" not in capsys.readouterr().out
+    assert gw.stats["native"] == 2
+    assert (tmp_path / "other" / "slide-05.png").exists()
+
+
+def test_edited_prompt_regenerates_without_a_change_mark(cli: Any, stub: Any, tmp_path: Path, capsys: Any) -> None:
+    gw = stub()
+    plan = write_plan(tmp_path / "plan.json", {"slide-05": "first", "slide-06": "second"})
+    _generate(cli, gw.base_url, plan, "--no-cache")
+    _generate(cli, gw.base_url, plan, "--no-cache")
+    assert gw.stats["native"] == 2  # unchanged: both skipped
+
+    # Hand-edited plan, no make-plan diff: the journal's prompt_hash still catches it.
+    write_plan(plan, {"slide-05": "first", "slide-06": "second, revised"})
+    capsys.readouterr()
+    _generate(cli, gw.base_url, plan, "--no-cache")
+    out = capsys.readouterr().out
+    assert "slide-05.png exists" in out and "[skip]" in out
+    assert gw.stats["native"] == 3
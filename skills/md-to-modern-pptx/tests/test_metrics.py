@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import json
+import re
+from pathlib import Path
+
+import gemini_image_pack as gip
+
+SAMPLE = re.compile(r'^([a-z_]+)(?:\{([a-z_]+="[^"]*"(?:,[a-z_]+="[^"]*")*)\})? (-?\d+(?:\.\d+)?)$')
+
+
+def _sink() -> gip.MetricsSink:
+    sink = gip.MetricsSink()
+    for name, ttfb, statuses, status in [("slide-05", 1.0, [429, 200], "done"), ("slide-06", 3.0, [500], "failed")]:
+        m = gip.ItemMetrics(name)
+        m.add("ttfb", ttfb)
+        m.http_statuses.extend(statuses)
+        m.retries = len(statuses) - 1
+        sink.record(m, status=status, total_s=ttfb + 1)
+    return sink
+
+
+def test_prometheus_textfile_format(tmp_path: Path) -> None:
+    path = tmp_path / "run.prom"
+    _sink().write_prometheus(path)
+    lines = path.read_text().splitlines()
+    samples: dict[str, str] = {}
+    declared: set[str] = set()
+    for line in lines:
+        if line.startswith("# TYPE "):
+            declared.add(line.split()[2])
+            continue
+        if line.startswith("#"):
+            assert line.startswith("# HELP "), line
+            continue
+        m = SAMPLE.match(line)
+        assert m, line
+        # Every sample belongs to a family whose TYPE came first (summaries add _sum/_count).
+        assert re.sub(r"_(sum|count)$", "", m.group(1)) in declared, line
+        samples[f"{m.group(1)}{{{m.group(2) or ''}}}"] = m.group(3)
+
+    assert samples['gemini_image_pack_stage_seconds{stage="ttfb",quantile="0.5"}'] == "1.000000"
+    assert samples['gemini_image_pack_stage_seconds{stage="ttfb",quantile="1.0"}'] == "3.000000"
+    assert samples['gemini_image_pack_stage_seconds_sum{stage="total"}'] == "6.000000"
+    assert samples['gemini_image_pack_stage_seconds_count{stage="ttfb"}'] == "2"
+    assert samples['gemini_image_pack_items_total{status="failed"}'] == "1"
+    assert samples['gemini_image_pack_http_responses_total{code="429"}'] == "1"
+    assert samples["gemini_image_pack_retries_total{}"] == "1"
+
+
+def test_jsonl_has_one_record_per_item(tmp_path: Path) -> None:
+    path = tmp_path / "run.jsonl"
+    _sink().write_jsonl(path)
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(r["name"], r["status"], r["stages"]["ttfb"]) for r in records] == [
+        ("slide-05", "done", 1.0),
+        ("slide-06", "failed", 3.0),
+    ]
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import zipfile
+from pathlib import Path
+from typing import Any
+
+import pytest
+from conftest import write_plan
+
+import gemini_image_pack as gip
+
+
+def _image(path: Path, size: tuple[int, int], colour: tuple[int, int, int]) -> Path:
+    from PIL import Image
+
+    Image.new("RGB", size, colour).save(path)
+    return path
+
+
+def test_pack_round_trip(tmp_path: Path) -> None:
+    a = _image(tmp_path / "slide-05.png", (64, 36), (200, 120, 40))
+    a_small = _image(tmp_path / "slide-05.32x18.png", (32, 18), (200, 120, 40))
+    b = _image(tmp_path / "slide-06.png", (64, 36), (20, 120, 240))
+    items = [gip.PlanItem("slide-05", 5, "p5"), gip.PlanItem("slide-06", 6, "p6")]
+    pack = gip.ImagePack.write(tmp_path / "deck.zip", [(items[0], a, (a_small,)), (items[1], b, ())], theme="t")
+
+    with zipfile.ZipFile(pack.path) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == ["slide-05.png", "slide-05.32x18.png", "slide-06.png", "manifest.json"]
+        assert zf.read("slide-06.png") == b.read_bytes()
+
+    opened = gip.ImagePack.open(pack.path)
+    assert opened.manifest == pack.manifest
+    entries = {e["name"]: e for e in opened.entries}
+    assert entries["slide-05.32x18.png"]["rendition"] == "32x18"
+    assert (entries["slide-06.png"]["width"], entries["slide-06.png"]["height"]) == (64, 36)
+    assert entries["slide-05.png"]["slide_number"] == 5
+    for src in (a, a_small, b):
+        assert opened.read(entries[src.name]) == src.read_bytes()
+
+
+def test_pack_read_checks_sha256(tmp_path: Path) -> None:
+    a = _image(tmp_path / "slide-05.png", (16, 16), (1, 2, 3))
+    pack = gip.ImagePack.write(tmp_path / "deck.zip", [(gip.PlanItem("slide-05", 5, "p"), a, ())])
+    entry = dict(pack.entries[0], sha256="0" * 64)
+    with pytest.raises(RuntimeError, match="sha256"):
+        pack.read(entry)
+
+
+def test_pack_members_follow_report_directories(tmp_path: Path) -> None:
+    (tmp_path / "beans").mkdir()
+    a = _image(tmp_path / "beans" / "slide-05.png", (16, 16), (1, 2, 3))
+    pack = gip.ImagePack.write(tmp_path / "deck.zip", [(gip.PlanItem("beans/slide-05", 5, "p"), a, ())])
+    assert pack.entries[0]["name"] == "beans/slide-05.png"
+    assert pack.entries[0]["item"] == "beans/slide-05"
+
+
+def test_export_refuses_names_leaving_the_out_dir(cli: Any, tmp_path: Path) -> None:
+    (tmp_path / "src").mkdir()
+    a = _image(tmp_path / "src" / "slide-05.png", (16, 16), (1, 2, 3))
+    good = gip.ImagePack.write(tmp_path / "good.zip", [(gip.PlanItem("deck/slide-05", 5, "p"), a, ())])
+    cli("pack", "export", str(good.path), "--out-dir", "out")
+    assert (tmp_path / "out" / "deck" / "slide-05.png").read_bytes() == a.read_bytes()
+
+    # A hand-made manifest can name anything; export must not follow it out of --out-dir.
+    evil = gip.ImagePack.write(tmp_path / "evil.zip", [(gip.PlanItem("../../slide-05", 5, "p"), a, ())])
+    assert evil.entries[0]["name"] == "../../slide-05.png"
+    with pytest.raises(SystemExit, match="Unsafe name"):
+        cli("pack", "export", str(evil.path), "--out-dir", "out/sub")
+    assert not (tmp_path / "slide-05.png").exists()
+
+
+def test_pack_only_writes_nothing_but_the_pack(cli: Any, stub: Any, tmp_path: Path, capsys: Any) -> None:
+    gw = stub()
+    plan = write_plan(tmp_path / "plan.json", {"slide-05": "first", "deck/slide-06": "second"})
+    share = tmp_path / "share"
+    args = ["generate", "--plan", str(plan), "--base-url", gw.base_url, "--key", "k", "--no-cache"]
+    cli(*args, "--out-dir", str(share / "images"), "--pack", str(share / "deck.zip"), "--pack-only")
+    assert [p.name for p in share.iterdir()] == ["deck.zip"]
+    scratch = {Path(line.split("-> ", 1)[1]).parent for line in capsys.readouterr().out.splitlines() if "-> " in line}
+    assert scratch and not any(d.exists() for d in scratch)
+
+    cli("pack", "export", str(share / "deck.zip"), "--out-dir", str(tmp_path / "loose"))
+    assert sorted(p.relative_to(tmp_path / "loose").as_posix() for p in (tmp_path / "loose").rglob("*.png")) == [
+        "deck/slide-06.png",
+        "slide-05.png",
+    ]
+    with pytest.raises(SystemExit, match="needs --pack"):
+        cli(*args, "--pack-only")
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any
+
+import pytest
+from conftest import write_plan
+
+import gemini_image_pack as gip
+
+
+def _item(name: str, prompt: str = "a lighthouse") -> Any:
+    return gip.PlanItem(name, 5, prompt)
+
+
+def test_cache_hits_and_duplicates_land_in_place(stub: Any, pipeline: Any, tmp_path: Path) -> None:
+    gw = stub()
+    pipe = pipeline(gw, cache=gip.ImageCache(tmp_path / "cache", max_bytes=1 << 30))
+    a, b = tmp_path / "out" / "slide-05.png", tmp_path / "out" / "slide-06.png"
+    first = pipe.submit(_item("slide-05"), a, gip.ItemMetrics("slide-05"))
+    dup = pipe.submit(_item("slide-06"), b, gip.ItemMetrics("slide-06"))
+    assert first.result(timeout=30).path == a
+    assert dup.result(timeout=30).path == b and b.read_bytes() == a.read_bytes()
+    a.unlink()
+    pipe._inflight.clear()
+    again = pipe.submit(_item("slide-05"), a, gip.ItemMetrics("slide-05")).result(timeout=30)
+    assert again.source == "cache" and again.path == a and a.exists()
+    assert gw.stats["native"] == 1
+    assert not list((tmp_path / "out").glob(".staging-*"))
+
+
+def test_overwrite_skips_the_cache_but_refreshes_it(stub: Any, pipeline: Any, tmp_path: Path) -> None:
+    gw = stub()
+    cache = gip.ImageCache(tmp_path / "cache", max_bytes=1 << 30)
+    pipe = pipeline(gw, cache=cache)
+    out = tmp_path / "out" / "slide-05.png"
+    item = _item("slide-05")
+    pipe.submit(item, out, gip.ItemMetrics("slide-05")).result(timeout=30)
+    entry = next(p for p, _ in cache.entries())
+    entry.unlink()
+    entry.write_bytes(b"a bad image")
+    pipe._inflight.clear()
+    res = pipe.submit(item, out, gip.ItemMetrics("slide-05"), overwrite=True).result(timeout=30)
+    assert res.source != "cache" and gw.stats["native"] == 2
+    assert out.read_bytes().startswith(b"\x89PNG") and entry.read_bytes() == out.read_bytes()
+
+
+def test_cache_store_scans_only_to_prune(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    cache = gip.ImageCache(tmp_path / "cache", max_bytes=250)
+    scans = []
+    entries = cache.entries
+    monkeypatch.setattr(cache, "entries", lambda: scans.append(1) or entries())
+
+    def store(key: str, mtime: int) -> None:
+        src = tmp_path / f"{key}-{mtime}.png"
+        src.write_bytes(b"x" * 100)
+        cache.store(key, src)
+        os.utime(cache._entry(key), (mtime, mtime))  # type: ignore[arg-type]
+
+    store("aa01", 1)
+    store("aa02", 2)
+    store("aa02", 3)  # replacing an entry does not count it twice
+    assert len(scans) == 1
+    store("aa03", 4)  # 300 bytes > 250: prune the least recently used
+    assert len(scans) == 2
+    assert not cache.has("aa01") and cache.has("aa02") and cache.has("aa03")
+
+
+def test_late_result_never_replaces_a_placeholder(stub: Any, pipeline: Any, tmp_path: Path) -> None:
+    cache = gip.ImageCache(tmp_path / "cache", max_bytes=1 << 30)
+    pipe = pipeline(stub(latency_s=0.5), cache=cache)
+    out = tmp_path / "out" / "slide-05.png"
+    out.parent.mkdir()
+    item = _item("slide-05")
+    fut = pipe.submit(item, out, gip.ItemMetrics("slide-05"))
+    time.sleep(0.1)  # the gateway call is in flight
+    placeholder = pipe.write_placeholder(item, out, "golden-hour").path.read_bytes()
+    with pytest.raises(gip.DeadlineExceeded, match="placeholder"):
+        fut.result(timeout=30)
+    assert out.read_bytes() == placeholder
+    assert cache.has(pipe.cache_key(item))  # kept for the rerun
+    assert not list(out.parent.glob(".staging-*"))
+
+
+@pytest.mark.parametrize("mode", ["native", "task"])
+def test_deadline_caps_in_flight_calls(cli: Any, stub: Any, tmp_path: Path, capsys: Any, mode: str) -> None:
+    gw = stub(mode=mode, latency_s=6.0 if mode == "native" else 0.0, task_duration_s=6.0)
+    plan = write_plan(tmp_path / "plan.json", {"slide-05": "first"})
+    started = time.time()
+    cli(
+        "generate",
+        "--plan",
+        str(plan),
+        "--base-url",
+        gw.base_url,
+        "--key",
+        "k",
+        "--model",
+        "gemini-3-pro-image-preview" if mode == "native" else "gpt-image-1",
+        "--no-cache",
+        "--deadline",
+        "2",
+    )
+    # The call in flight is cut at the deadline instead of running its 6 s (or 120 s timeout).
+    assert time.time() - started < 4
+    assert "placeholder" in capsys.readouterr().out
+    records = [json.loads(l) for l in (tmp_path / "images" / "plan.journal.jsonl").read_text().splitlines()]
+    assert records[-1]["status"] == "placeholder"
+
+
+def test_task_mode_submits_the_whole_plan_at_concurrency_one(cli: Any, stub: Any, tmp_path: Path) -> None:
+    gw = stub(mode="task", task_duration_s=2.0)
+    plan = tmp_path / "plan.jsonl"
+    lines = [{"version": 1, "format": "jsonl", "theme": "golden-hour"}]
+    lines += [{"name": f"slide-{n:02d}", "slide_number": n, "prompt": f"scene {n}"} for n in range(5, 29)]
+    plan.write_text("".join(json.dumps(line) + "\n" for line in lines), encoding="utf-8")
+    started = time.time()
+    cli(
+        "generate",
+        "--plan",
+        str(plan),
+        "--base-url",
+        gw.base_url,
+        "--key",
+        "k",
+        "--model",
+        "gpt-image-1",
+        "--no-cache",
+        "--concurrency",
+        "1",
+        "--poll-interval",
+        "0.1",
+        "--poll-max-interval",
+        "0.2",
+    )
+    # All 24 two-second tasks are pending at once: one wait of 2 s (plus finishing 24 images
+    # on one worker), not six rounds of 2 s behind a feed four tasks deep.
+    assert time.time() - started < 7
+    assert gw.stats["images_generations"] == 24
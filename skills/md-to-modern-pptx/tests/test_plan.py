@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import io
+import json
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+import gemini_image_pack as gip
+
+REPORT = """# Beans Report
+
+## Executive Summary
+
+Summary text.
+
+## Detailed Analysis
+
+### Market Size
+
+The market is large.
+
+```
+### not a heading (inside a fence)
+```
+
+### Supply Chain
+
+Tomatoes come from Italy.
+
+## Sources
+
+- none
+"""
+
+
+def test_markdown_index_finds_sections_and_skips_fences() -> None:
+    index = gip.MarkdownIndex(REPORT.encode("utf-8"))
+    titles = [(sec.level, sec.title) for sec in index.sections]
+    assert titles == [
+        (1, "Beans Report"),
+        (2, "Executive Summary"),
+        (2, "Detailed Analysis"),
+        (3, "Market Size"),
+        (3, "Supply Chain"),
+        (2, "Sources"),
+    ]
+    market = index.find("Market Size", 3, index.find("Detailed Analysis", 2))
+    assert market is not None
+    assert "not a heading" in index.body(market)
+
+
+def test_markdown_index_strips_only_a_closing_hash_sequence() -> None:
+    index = gip.MarkdownIndex(b"## C#\n## Closed ##\n### F# notes #  \n")
+    assert [sec.title for sec in index.sections] == ["C#", "Closed", "F# notes"]
+
+
+def test_parse_detailed_analysis() -> None:
+    out = gip.parse_detailed_analysis(REPORT)
+    assert [a["title"] for a in out] == ["Market Size", "Supply Chain"]
+    assert out[1]["body"] == "Tomatoes come from Italy."
+
+
+def test_iter_plan_images_prefixes_names_for_several_reports(tmp_path: Path) -> None:
+    one = tmp_path / "beans.md"
+    one.write_text(REPORT, encoding="utf-8")
+    single = list(gip.iter_plan_images([one], "golden-hour", 5))
+    assert [img["name"] for img in single] == ["slide-05", "slide-06"]
+    assert "report" not in single[0]
+
+    two = tmp_path / "corpus.md"
+    two.write_text(REPORT + "\n" + REPORT.replace("Beans", "Peas"), encoding="utf-8")
+    multi = list(gip.iter_plan_images([two], "golden-hour", 5, max_images=1))
+    assert [img["name"] for img in multi] == ["corpus-01/slide-05", "corpus-02/slide-05"]
+    assert "Peas Report" in multi[1]["prompt"]
+
+
+def test_plan_diff_marks_changes(tmp_path: Path) -> None:
+    md = tmp_path / "beans.md"
+    md.write_text(REPORT, encoding="utf-8")
+    previous = gip.make_plan(md, "golden-hour", 5)
+    md.write_text(REPORT.replace("Tomatoes come from Italy.", "Tomatoes come from Spain."), encoding="utf-8")
+    previous["images"].append({"name": "slide-09", "prompt": "gone"})
+    plan = gip.make_plan(md, "golden-hour", 5, previous=previous)
+    assert [img["change"] for img in plan["images"]] == ["unchanged", "changed"]
+    assert plan["diff"] == {"unchanged": 1, "changed": 1, "added": 0, "removed": 1}
+    assert plan["removed"] == ["slide-09"]
+
+
+def test_open_plan_reads_json_and_jsonl() -> None:
+    items = [{"name": "slide-05", "prompt": "a"}, {"name": "slide-06", "prompt": "b"}]
+    meta, it = gip.open_plan(io.StringIO(json.dumps({"version": 1, "theme": "t", "images": items})))
+    assert meta["count"] == 2 and [i["name"] for i in it] == ["slide-05", "slide-06"]
+
+    buf = io.StringIO()
+    gip.write_plan_jsonl(buf, {"version": 1, "format": "jsonl", "theme": "t"}, iter(items))
+    meta, it = gip.open_plan(io.StringIO(buf.getvalue()))
+    assert "count" not in meta
+    assert [i["prompt"] for i in it] == ["a", "b"]
+    assert meta["theme"] == "t"
+
+
+@pytest.mark.parametrize(
+    "lines, bad",
+    [
+        ([{"name": "slide-05", "prompt": "a"}, {"name": "slide-06", "promt": "typo", "theme": "x"}], 2),
+        ([{"version": 1, "theme": "t"}, {"name": "slide-05", "prompt": "a"}], 1),  # header without "format"
+        ([{"format": "jsonl"}, {"name": "slide-05", "prompt": "a"}, {"format": "jsonl", "theme": "x"}], 3),
+        ([{"format": "jsonl"}, ["slide-05", "a"]], 2),
+    ],
+)
+def test_open_plan_rejects_jsonl_lines_without_a_prompt(lines: list[Any], bad: int) -> None:
+    meta, it = gip.open_plan(io.StringIO("".join(json.dumps(line) + "\n" for line in lines)))
+    with pytest.raises(SystemExit, match=f"Plan line {bad} "):
+        list(it)
+    assert "theme" not in meta
+
+
+def test_plan_item_requires_a_prompt() -> None:
+    assert gip._plan_item({"name": "x", "prompt": "p", "slide_number": "7"}, 1).slide_number == 7
+    with pytest.raises(ValueError):
+        gip._plan_item({"name": "x", "prompt": "  "}, 1)
+
+
+def test_pick_image_size_covers_the_largest_output() -> None:
+    assert gip.pick_image_size("16:9", "4K", [(640, 360)]) == ("16:9", "1K")
+    assert gip.pick_image_size("16:9", "1K", [(1920, 1080)]) == ("16:9", "2K")
+    assert gip.pick_image_size("16:9", "1K", [(1000, 1000)]) == ("1:1", "1K")
+
+
+def test_plan_diff_keeps_pending_marks_when_rerun(tmp_path: Path) -> None:
+    md = tmp_path / "beans.md"
+    md.write_text(REPORT, encoding="utf-8")
+    first = gip.make_plan(md, "golden-hour", 5)
+    md.write_text(REPORT.replace("Italy", "Spain"), encoding="utf-8")
+    second = gip.make_plan(md, "golden-hour", 5, previous=first)
+    # make-plan again before generate ran: slide-06 is still owed a new image.
+    third = gip.make_plan(md, "golden-hour", 5, previous=second)
+    assert [img["change"] for img in third["images"]] == ["unchanged", "changed"]
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+import gemini_image_pack as gip
+
+FINALIZE = {
+    "out_width": 320,
+    "out_height": 180,
+    "no_resize": False,
+    "png_compress_level": 1,
+    "png_optimize": False,
+    "out_format": "png",
+    "quality": 85,
+}
+
+
+def test_rendition_specs_and_names() -> None:
+    assert gip.parse_rendition("320x180:webp") == gip.Rendition(320, 180, "webp", 82)
+    assert gip.parse_rendition("1280x720:JPG:70") == gip.Rendition(1280, 720, "jpeg", 70)
+    assert gip.parse_rendition("64x36") == gip.Rendition(64, 36, "png")
+    for bad in ("320", "320x180:gif", "320x180:webp:high", "320x180:webp:1:2"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            gip.parse_rendition(bad)
+    out = Path("deck/slide-05.png")
+    assert gip.Rendition(320, 180, "webp").path_for(out) == Path("deck/slide-05.320x180.webp")
+    assert gip.Rendition(1280, 720, "jpeg").path_for(out) == Path("deck/slide-05.1280x720.jpg")
+
+
+def test_renditions_are_written_and_cached_under_their_own_keys(stub: Any, pipeline: Any, tmp_path: Path) -> None:
+    from PIL import Image  # type: ignore
+
+    renditions = (gip.Rendition(160, 90, "webp"), gip.Rendition(64, 36, "jpeg", 60))
+    finalize = {**FINALIZE, "renditions": renditions}
+    gw = stub()
+    pipe = pipeline(gw, cache=gip.ImageCache(tmp_path / "cache", max_bytes=1 << 30), finalize_kwargs=finalize)
+    item = gip.PlanItem("slide-05", 5, "a lighthouse")
+    keys = [pipe.cache_key(item), *pipe._rendition_keys(item, finalize)]
+    assert len(set(keys)) == 3
+    # A rendition's key depends on its own size/format/quality, not on its place in the list.
+    assert pipe._rendition_keys(item, {**finalize, "renditions": renditions[::-1]}) == keys[:0:-1]
+    other_quality = (renditions[0], gip.Rendition(64, 36, "jpeg", 90))
+    assert pipe._rendition_keys(item, {**finalize, "renditions": other_quality})[1] != keys[2]
+
+    out = tmp_path / "out" / "slide-05.png"
+    res = pipe.submit(item, out, gip.ItemMetrics("slide-05")).result(timeout=30)
+    assert res.extras == (out.with_name("slide-05.160x90.webp"), out.with_name("slide-05.64x36.jpg"))
+    for path, (w, h, fmt) in zip(res.extras, [(160, 90, "WEBP"), (64, 36, "JPEG")]):
+        with Image.open(path) as im:
+            assert (im.size, im.format) == ((w, h), fmt)
+    assert all(pipe.cache.has(k) for k in keys)
+
+
+def test_auto_resolution_requests_the_smallest_covering_size(stub: Any, pipeline: Any, capsys: Any) -> None:
+    pipe = pipeline(stub(), resolution_policy="auto", finalize_kwargs={**FINALIZE, "out_width": 640, "out_height": 360})
+    item = gip.PlanItem("slide-05", 5, "a lighthouse", size="16:9", resolution="4K")
+    fitted = pipe.fit_resolution(item)
+    assert (fitted.size, fitted.resolution) == ("16:9", "1K")
+    assert "requesting 16:9 @ 1K" in capsys.readouterr().out
+    # A 1920x1080 rendition needs more than 1K; no_resize keeps what the plan asked for.
+    big = {**pipe.finalize_kwargs, "renditions": (gip.Rendition(1920, 1080),)}
+    assert pipe.fit_resolution(item, big).resolution == "2K"
+    assert pipe.fit_resolution(item, {**pipe.finalize_kwargs, "no_resize": True}) is item
+    # The cache key follows the size actually requested.
+    assert pipe.cache_key(fitted) != pipe.cache_key(item)
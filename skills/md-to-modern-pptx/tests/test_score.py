@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+import pytest
+
+import gemini_image_pack as gip
+
+pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+ImageDraw = pytest.importorskip("PIL.ImageDraw")
+
+THEME = "golden-hour"
+
+
+def _clean(path: Path) -> Path:
+    path.write_bytes(gip.render_placeholder(THEME, 640, 360, seed="clean"))
+    return path
+
+
+def _noise(path: Path) -> Path:
+    Image.frombytes("RGB", (640, 360), os.urandom(640 * 360 * 3)).save(path)
+    return path
+
+
+def _lettering(path: Path) -> Path:
+    # Rows of black glyph-like strokes on white, the way a caption baked into the art looks.
+    im = Image.new("RGB", (640, 360), "white")
+    draw = ImageDraw.Draw(im)
+    for y in range(120, 240, 40):
+        for x in range(40, 600, 22):
+            draw.rectangle((x, y, x + 3, y + 24), fill="black")
+            draw.rectangle((x + 3, y, x + 14, y + 3), fill="black")
+            draw.rectangle((x + 3, y + 21, x + 14, y + 24), fill="black")
+    im.save(path)
+    return path
+
+
+def test_score_prefers_quiet_on_palette_art(tmp_path: Path) -> None:
+    clean = gip.score_image(_clean(tmp_path / "clean.png"), THEME)
+    noise = gip.score_image(_noise(tmp_path / "noise.png"), THEME)
+    text = gip.score_image(_lettering(tmp_path / "text.png"), THEME)
+    assert clean is not None and noise is not None and text is not None
+    assert clean["score"] > text["score"] and clean["score"] > noise["score"]
+    assert noise["edge_density"] > clean["edge_density"]
+    assert clean["border_emptiness"] > noise["border_emptiness"]
+    assert text["text_likeness"] > clean["text_likeness"]
+    assert clean["palette_distance"] < text["palette_distance"]
+    assert gip.score_image(tmp_path / "missing.png", THEME) is None
+
+
+def test_pick_candidate_keeps_the_best_and_deletes_the_rest(tmp_path: Path) -> None:
+    broken = tmp_path / "broken.png"
+    broken.write_bytes(b"not an image")
+    noise, clean = _noise(tmp_path / "noise.png"), _clean(tmp_path / "clean.png")
+    fetched = gip.FetchedImage(
+        broken, "image/png", alternates=(gip.FetchedImage(noise, "image/png"), gip.FetchedImage(clean, "image/png"))
+    )
+    best, records = gip.pick_candidate(fetched, THEME)
+    assert best.path == clean and best.alternates == ()
+    assert [r["chosen"] for r in records] == [False, False, True]
+    assert records[0]["score"] is None  # does not decode, never wins
+    assert clean.exists() and not noise.exists() and not broken.exists()
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import json
+import threading
+from pathlib import Path
+from typing import Any
+
+import pytest
+import requests
+
+import gemini_image_pack as gip
+
+TOKEN = "s3cret"
+AUTH = {"authorization": f"Bearer {TOKEN}"}
+
+
+@pytest.fixture
+def served(stub: Any, pipeline: Any, tmp_path: Path) -> Any:
+    root = tmp_path / "root"
+    root.mkdir()
+    server = gip.ImageServer(pipeline(stub()), root=root, token=TOKEN)
+    httpd = server.make_server(port=0)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield server, "http://{}:{}".format(*httpd.server_address[:2])
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _plan(*names: str) -> str:
+    return "\n".join(json.dumps({"name": n, "prompt": f"prompt for {n}"}) for n in names)
+
+
+def test_jobs_need_the_token_and_no_browser_origin(served: Any) -> None:
+    server, url = served
+    out = server.root / "images"
+    post = f"{url}/v1/jobs?out_dir={out}"
+    assert requests.post(post, data=_plan("slide-05")).status_code == 401
+    assert requests.post(post, data=_plan("slide-05"), headers={"authorization": "Bearer nope"}).status_code == 401
+    assert requests.get(f"{url}/v1/health", headers={**AUTH, "origin": "https://evil.example"}).status_code == 403
+    assert requests.post(post, data=_plan("slide-05"), headers={**AUTH, "origin": "null"}).status_code == 403
+    assert not out.exists()
+
+    r = requests.post(post + "&stream=1", data=_plan("slide-05", "deck/slide-06"), headers=AUTH)
+    events = [json.loads(line) for line in r.text.splitlines()]
+    assert [e["status"] for e in events if e["event"] == "item"] == ["done", "done"]
+    assert (out / "slide-05.png").exists() and (out / "deck" / "slide-06.png").exists()
+
+
+def test_writes_stay_under_the_root(served: Any, tmp_path: Path) -> None:
+    server, url = served
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    (server.root / "images").mkdir()
+    (server.root / "images" / "link").symlink_to(outside, target_is_directory=True)
+
+    def post(out_dir: Path, plan: str) -> requests.Response:
+        return requests.post(f"{url}/v1/jobs?out_dir={out_dir}", data=plan, headers=AUTH)
+
+    assert post(outside, _plan("slide-05")).status_code == 400
+    assert post(server.root / ".." / "outside", _plan("slide-05")).status_code == 400
+    for name in ("../../x", "/tmp/x", "C:/x", "a\\..\\..\\x", "link/x"):
+        r = post(server.root / "images", _plan("slide-05", name))
+        assert r.status_code == 400, name
+    assert server.jobs == {}
+    assert list(outside.iterdir()) == []
+
+
+def test_tcp_listener_requires_a_token(stub: Any, pipeline: Any, tmp_path: Path) -> None:
+    with pytest.raises(RuntimeError, match="token"):
+        gip.ImageServer(pipeline(stub()), root=tmp_path).make_server(port=0)
@@ -0,0 +1,19 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+import bench_startup
+import pytest
+
+
+@pytest.mark.parametrize("fmt", ["json", "jsonl"])
+def test_make_plan_leaves_the_network_and_imaging_stack_unimported(tmp_path: Path, fmt: str) -> None:
+    md = tmp_path / "report.md"
+    bench_startup._write_report(md, sections=3)
+    out = tmp_path / f"plan.{fmt}"
+    env = {**os.environ, "CHERRY_CACHE_DIR": str(tmp_path / "cache")}
+    heavy = bench_startup._loaded_heavy_modules(["make-plan", "--in", str(md), "--out", str(out)], env)
+    assert heavy == []
+    assert out.stat().st_size > 0
+    assert {"requests", "PIL", "numpy"} <= set(bench_startup.HEAVY_MODULES)